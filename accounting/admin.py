@@ -1,5 +1,5 @@
-from accounting.models import Payment, PaymentMethod, Account, FiscalYear, Invoice, InvoiceItem, \
-    Journal, JournalEntry, JournalLine, LedgerSettings, Settings
+from accounting.models import Payment, PaymentMethod, Account, AccountPeriodBalance, FiscalYear, Invoice, \
+    InvoiceItem, Journal, JournalEntry, JournalLine, LedgerSettings, Settings
 
 from django.contrib import admin
 
@@ -22,7 +22,8 @@ class FiscalYearAdmin(admin.ModelAdmin):
 
 @admin.register(FiscalYear)
 class FiscalYearAdmin(admin.ModelAdmin):
-    pass
+    # closing / reopening only through services.close_fiscal_year / reopen_fiscal_year
+    readonly_fields = ("is_closed",)
 
 
 @admin.register(Invoice)
@@ -50,6 +51,12 @@ class JournalLineAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(AccountPeriodBalance)
+class AccountPeriodBalanceAdmin(admin.ModelAdmin):
+    list_display = ("account", "fiscal_year", "period", "debit", "credit")
+    list_filter = ("fiscal_year",)
+
+
 @admin.register(LedgerSettings)
 class LedgerSettingsAdmin(admin.ModelAdmin):
     pass
@@ -0,0 +1,225 @@
+# accounting/allocation.py
+
+from __future__ import annotations
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils.translation import gettext_lazy as _
+
+from .models import DECIMAL_ZERO, Invoice, Payment, PaymentReconciliation
+
+
+# =====================================================================
+# Strategies
+# =====================================================================
+
+class AllocationStrategy(models.TextChoices):
+    FIFO = "fifo", _("الأقدم أولاً (تاريخ الفاتورة)")
+    DUE_DATE = "due_date", _("حسب تاريخ الاستحقاق")
+    EXACT = "exact", _("مطابقة المبلغ تماماً")
+
+
+# (amount available on the payment, ordered candidates, open balance per invoice)
+#   -> [(invoice, amount), ...]
+StrategyFn = Callable[[Decimal, List[Invoice], Dict[int, Decimal]], List[Tuple[Invoice, Decimal]]]
+
+
+def _greedy(available: Decimal, candidates: List[Invoice], open_balances: Dict[int, Decimal]):
+    result = []
+    for invoice in candidates:
+        if available <= 0:
+            break
+        open_balance = open_balances[invoice.pk]
+        if open_balance <= 0:
+            continue
+        amount = min(available, open_balance)
+        result.append((invoice, amount))
+        available -= amount
+    return result
+
+
+def allocate_fifo(available, candidates, open_balances):
+    """أقدم فاتورة أولاً حسب تاريخ الإصدار."""
+    ordered = sorted(candidates, key=lambda inv: (inv.issued_at, inv.pk))
+    return _greedy(available, ordered, open_balances)
+
+
+def allocate_by_due_date(available, candidates, open_balances):
+    """الأقرب استحقاقاً أولاً (الفواتير بدون تاريخ استحقاق تُعامل بتاريخ إصدارها)."""
+    ordered = sorted(candidates, key=lambda inv: (inv.due_date or inv.issued_at, inv.issued_at, inv.pk))
+    return _greedy(available, ordered, open_balances)
+
+
+def allocate_exact(available, candidates, open_balances):
+    """فاتورة واحدة رصيدها يساوي المبلغ المتاح تماماً، وإلا لا شيء."""
+    for invoice in sorted(candidates, key=lambda inv: (inv.issued_at, inv.pk)):
+        if open_balances[invoice.pk] == available:
+            return [(invoice, available)]
+    return []
+
+
+STRATEGIES: Dict[str, StrategyFn] = {
+    AllocationStrategy.FIFO: allocate_fifo,
+    AllocationStrategy.DUE_DATE: allocate_by_due_date,
+    AllocationStrategy.EXACT: allocate_exact,
+}
+
+
+# =====================================================================
+# Engine
+# =====================================================================
+
+@dataclass
+class AllocationResult:
+    """
+    Summary of a bulk allocation run.
+    """
+    allocations: List[Tuple[int, int, Decimal]] = field(default_factory=list)  # (payment_id, invoice_id, amount)
+    payments_count: int = 0
+    invoices_count: int = 0
+
+    @property
+    def total_amount(self) -> Decimal:
+        return sum((amount for _p, _i, amount in self.allocations), DECIMAL_ZERO)
+
+
+def invoice_type_for_payment(payment: Payment) -> str:
+    """سند القبض يُسوّى مع فواتير المبيعات، وسند الصرف مع فواتير المشتريات."""
+    if payment.type == Payment.Type.PAYMENT:
+        return Invoice.InvoiceType.PURCHASE
+    return Invoice.InvoiceType.SALES
+
+
+def payments_with_unallocated_amount():
+    """الدفعات التي لها مبلغ غير مخصص (استعلام واحد مع تجميع)."""
+    return Payment.objects.annotate(
+        allocated_sum=Coalesce(
+            Sum("allocations__amount"),
+            DECIMAL_ZERO,
+            output_field=models.DecimalField(max_digits=12, decimal_places=3),
+        )
+    ).filter(amount__gt=F("allocated_sum"))
+
+
+def auto_allocate_payments(
+    payments: Iterable[Payment],
+    *,
+    strategy: str = AllocationStrategy.FIFO,
+    dry_run: bool = False,
+) -> AllocationResult:
+    """
+    تسوية مجموعة من الدفعات تلقائياً مع الفواتير المفتوحة لنفس الطرف.
+
+    - تُقفل الدفعات ثم كل الفواتير المرشحة باستعلام واحد (select_for_update).
+    - تُحسب التسويات في الذاكرة حسب الاستراتيجية (fifo / due_date / exact).
+    - تُكتب أسطر PaymentReconciliation عبر bulk_create / bulk_update،
+      ثم حفظ واحد لكل فاتورة متأثرة (allocated_total + balance + status).
+    - dry_run=True يحسب النتيجة فقط بدون أي كتابة، وبدون أقفال أو
+      transaction حتى لا تحجب المعاينة التسويات الفعلية.
+    """
+    try:
+        strategy_fn = STRATEGIES[strategy]
+    except KeyError:
+        raise ValidationError(_("استراتيجية التسوية غير معروفة: %(s)s") % {"s": strategy})
+
+    payment_ids = [p.pk for p in payments]
+    if dry_run:
+        return _allocate(payment_ids, strategy_fn, dry_run=True)
+    with transaction.atomic():
+        return _allocate(payment_ids, strategy_fn, dry_run=False)
+
+
+def _allocate(payment_ids: List[int], strategy_fn: StrategyFn, *, dry_run: bool) -> AllocationResult:
+    payments_qs = Payment.objects.filter(pk__in=payment_ids)
+    invoices_qs = Invoice.objects.all()
+    if not dry_run:
+        payments_qs = payments_qs.select_for_update()
+        invoices_qs = invoices_qs.select_for_update()
+
+    payments = list(payments_qs.order_by("date", "pk"))
+    result = AllocationResult()
+    if not payments:
+        return result
+
+    # المبالغ المخصصة مسبقاً لكل دفعة (GROUP BY واحد)
+    already_allocated = dict(
+        PaymentReconciliation.objects.filter(payment_id__in=[p.pk for p in payments])
+        .values("payment_id")
+        .annotate(total=Sum("amount"))
+        .values_list("payment_id", "total")
+    )
+
+    # كل الفواتير المرشحة لكل الأطراف، مقفلة في استعلام واحد
+    invoices = list(
+        invoices_qs.filter(customer_id__in={p.contact_id for p in payments}, balance__gt=0)
+        .exclude(status__in=[Invoice.Status.DRAFT, Invoice.Status.CANCELLED, Invoice.Status.PAID])
+        .order_by("pk")
+    )
+    candidates = defaultdict(list)
+    for invoice in invoices:
+        candidates[(invoice.customer_id, invoice.type)].append(invoice)
+    open_balances = {invoice.pk: invoice.balance for invoice in invoices}
+
+    # 1) الحساب في الذاكرة
+    planned: Dict[Tuple[int, int], Decimal] = defaultdict(lambda: DECIMAL_ZERO)
+    touched: Dict[int, Invoice] = {}
+
+    for payment in payments:
+        available = payment.amount - (already_allocated.get(payment.pk) or DECIMAL_ZERO)
+        if available <= 0:
+            continue
+
+        pool = candidates.get((payment.contact_id, invoice_type_for_payment(payment)), [])
+        lines = strategy_fn(available, pool, open_balances)
+        if not lines:
+            continue
+
+        result.payments_count += 1
+        for invoice, amount in lines:
+            open_balances[invoice.pk] -= amount
+            planned[(payment.pk, invoice.pk)] += amount
+            touched[invoice.pk] = invoice
+            result.allocations.append((payment.pk, invoice.pk, amount))
+
+    result.invoices_count = len(touched)
+    if dry_run or not planned:
+        return result
+
+    # 2) الكتابة: تحديث الأزواج الموجودة وإنشاء الجديدة
+    existing = {
+        (rec.payment_id, rec.invoice_id): rec
+        for rec in PaymentReconciliation.objects.filter(
+            payment_id__in={p for p, _i in planned},
+            invoice_id__in={i for _p, i in planned},
+        )
+    }
+
+    to_create, to_update = [], []
+    for (payment_id, invoice_id), amount in planned.items():
+        rec = existing.get((payment_id, invoice_id))
+        if rec is None:
+            to_create.append(
+                PaymentReconciliation(payment_id=payment_id, invoice_id=invoice_id, amount=amount)
+            )
+        else:
+            rec.amount += amount
+            to_update.append(rec)
+
+    PaymentReconciliation.objects.bulk_create(to_create, batch_size=500)
+    if to_update:
+        PaymentReconciliation.objects.bulk_update(to_update, ["amount"], batch_size=500)
+
+    # 3) حفظ واحد لكل فاتورة متأثرة (save() يحدّث balance ويشغّل hooks الحالة)
+    for invoice in touched.values():
+        invoice.allocated_total = invoice.total_amount - open_balances[invoice.pk]
+        invoice.update_payment_status(commit=False)
+        invoice.save(update_fields=["allocated_total", "status"])
+
+    return result
@@ -24,4 +24,5 @@ class AccountingConfig(AppConfig):
         - Do NOT import models or heavy stuff to avoid circular imports.
         """
         import accounting.handlers  # noqa
+        import accounting.signals.dashboard  # noqa  (dashboard / aging cache invalidation)
 
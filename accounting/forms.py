@@ -273,6 +273,7 @@ class LedgerSettingsForm(BootstrapFormMixin, forms.ModelForm):
             "sales_revenue_0_account",
             "sales_vat_output_account",
             "sales_advance_account",
+            "retained_earnings_account",
         ]
 
     def __init__(self, *args, **kwargs):
@@ -283,6 +284,10 @@ class LedgerSettingsForm(BootstrapFormMixin, forms.ModelForm):
             self.fields["sales_receivable_account"].queryset = (
                 Account.objects.active().filter(type=Account.Type.ASSET)
             )
+        if "retained_earnings_account" in self.fields:
+            self.fields["retained_earnings_account"].queryset = (
+                Account.objects.active().filter(type=Account.Type.EQUITY)
+            )
 
 
 # ============================================================
@@ -328,7 +333,8 @@ class PaymentForm(BootstrapFormMixin, forms.ModelForm):
 class FiscalYearForm(BootstrapFormMixin, forms.ModelForm):
     class Meta:
         model = FiscalYear
-        fields = ["year", "start_date", "end_date", "is_closed", "is_default"]
+        # is_closed is changed only by services.close_fiscal_year / reopen_fiscal_year
+        fields = ["year", "start_date", "end_date", "is_default"]
         widgets = {
             "start_date": forms.DateInput(attrs={"type": "date"}),
             "end_date": forms.DateInput(attrs={"type": "date"}),
@@ -362,14 +368,141 @@ class TrialBalanceFilterForm(BootstrapFormMixin, forms.Form):
         label=_("إلى تاريخ"),
         widget=forms.DateInput(attrs={"type": "date"}),
     )
+    as_tree = forms.BooleanField(
+        required=False,
+        label=_("عرض شجري مع مجاميع المجموعات"),
+    )
+
+    # Comparative mode: N monthly columns ending at `month`
+    compare = forms.ChoiceField(
+        choices=(
+            ("", _("بدون مقارنة")),
+            ("mom", _("شهر مقابل شهر")),
+            ("yoy", _("نفس الشهر في السنوات السابقة")),
+        ),
+        required=False,
+        label=_("مقارنة الفترات"),
+    )
+    month = forms.DateField(
+        required=False,
+        input_formats=["%Y-%m", "%Y-%m-%d"],
+        label=_("الشهر"),
+        widget=forms.DateInput(attrs={"type": "month"}, format="%Y-%m"),
+    )
+    periods = forms.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=12,
+        initial=3,
+        label=_("عدد الأعمدة"),
+    )
 
 
 class AccountLedgerFilterForm(TrialBalanceFilterForm):
+    as_tree = None
+    compare = None
+    month = None
+    periods = None
+
     account = forms.ModelChoiceField(
         queryset=Account.objects.active().order_by("code"),
         required=False,
         label=_("الحساب"),
     )
+    include_children = forms.BooleanField(
+        required=False,
+        label=_("تشمل الحسابات الفرعية"),
+    )
+
+
+class AgingReportFilterForm(BootstrapFormMixin, forms.Form):
+    KIND_CHOICES = (
+        ("receivable", _("ذمم مدينة (العملاء)")),
+        ("payable", _("ذمم دائنة (الموردون)")),
+    )
+
+    kind = forms.ChoiceField(
+        choices=KIND_CHOICES,
+        required=False,
+        initial="receivable",
+        label=_("نوع التقرير"),
+    )
+    as_of = forms.DateField(
+        required=False,
+        label=_("كما في تاريخ"),
+        widget=forms.DateInput(attrs={"type": "date"}),
+    )
+
+
+class FinancialStatementForm(BootstrapFormMixin, forms.Form):
+    STATEMENT_CHOICES = (
+        ("income", _("قائمة الدخل")),
+        ("balance", _("الميزانية العمومية")),
+    )
+    COMPARE_CHOICES = (
+        ("mom", _("شهر مقابل شهر")),
+        ("yoy", _("نفس الشهر في السنوات السابقة")),
+    )
+
+    statement = forms.ChoiceField(
+        choices=STATEMENT_CHOICES,
+        required=False,
+        initial="income",
+        label=_("القائمة"),
+    )
+    compare = forms.ChoiceField(
+        choices=COMPARE_CHOICES,
+        required=False,
+        initial="mom",
+        label=_("المقارنة"),
+    )
+    month = forms.DateField(
+        required=False,
+        input_formats=["%Y-%m", "%Y-%m-%d"],
+        label=_("الشهر"),
+        widget=forms.DateInput(attrs={"type": "month"}, format="%Y-%m"),
+    )
+    periods = forms.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=12,
+        initial=3,
+        label=_("عدد الأعمدة"),
+    )
+
+
+class GeneralLedgerExportForm(BootstrapFormMixin, forms.Form):
+    FORMAT_CHOICES = (
+        ("csv", "CSV"),
+        ("xlsx", "Excel (XLSX)"),
+        ("xml", "SAF-T (XML)"),
+    )
+
+    fiscal_year = forms.ModelChoiceField(
+        queryset=FiscalYear.objects.order_by("-year"),
+        required=False,
+        label=_("السنة المالية"),
+    )
+    date_from = forms.DateField(
+        required=False,
+        label=_("من تاريخ"),
+        widget=forms.DateInput(attrs={"type": "date"}),
+    )
+    date_to = forms.DateField(
+        required=False,
+        label=_("إلى تاريخ"),
+        widget=forms.DateInput(attrs={"type": "date"}),
+    )
+    include_drafts = forms.BooleanField(
+        required=False,
+        label=_("تضمين القيود غير المرحّلة"),
+    )
+    format = forms.ChoiceField(
+        choices=FORMAT_CHOICES,
+        required=False,
+        initial="csv",
+        label=_("الصيغة"),
+    )
 
 
 class JournalEntryFilterForm(BootstrapFormMixin, forms.Form):
@@ -378,6 +511,10 @@ class JournalEntryFilterForm(BootstrapFormMixin, forms.Form):
         ("posted", _("مُرحّل")),
         ("draft", _("مسودة")),
     )
+    BALANCE_CHOICES = (
+        ("", _("الكل")),
+        ("unbalanced", _("غير متوازن")),
+    )
 
     q = forms.CharField(
         required=False,
@@ -404,6 +541,11 @@ class JournalEntryFilterForm(BootstrapFormMixin, forms.Form):
         label=_("الدفتر"),
         queryset=Journal.objects.active(),
     )
+    balance = forms.ChoiceField(
+        required=False,
+        label=_("التوازن"),
+        choices=BALANCE_CHOICES,
+    )
 
 
 # ============================================================
@@ -422,6 +564,12 @@ class ChartOfAccountsImportForm(BootstrapFormMixin, forms.Form):
         required=False,
         label=_("سنة الرصيد الافتتاحي"),
     )
+    dry_run = forms.BooleanField(
+        required=False,
+        label=_("معاينة فقط (بدون حفظ)"),
+        initial=False,
+        help_text=_("يعرض الحسابات التي ستُنشأ أو تُعدّل دون تنفيذ أي تغيير."),
+    )
 
 
 
@@ -440,11 +588,15 @@ class PaymentReconciliationForm(forms.Form):
         self.payment = payment
         self.invoices = invoices
 
+        # التسويات السابقة لهذه الدفعة (استعلام واحد بدل استعلام لكل فاتورة)
+        existing = dict(
+            payment.allocations.filter(invoice__in=invoices)
+            .values_list("invoice_id", "amount")
+        )
+
         for invoice in invoices:
             field_name = self._field_name_for_invoice(invoice)
-            # نحاول جلب أي تسوية سابقة لهذه الفاتورة مع هذه الدفعة
-            allocation = invoice.allocations.filter(payment=payment).first()
-            initial_amount = allocation.amount if allocation else Decimal("0.000")
+            initial_amount = existing.get(invoice.pk, Decimal("0.000"))
 
             self.fields[field_name] = forms.DecimalField(
                 label=_("المبلغ المخصص للفاتورة %(inv)s") % {
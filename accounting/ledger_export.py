@@ -0,0 +1,202 @@
+# accounting/ledger_export.py
+
+from __future__ import annotations
+
+from datetime import date
+from decimal import Decimal
+from typing import Callable, Iterator
+from xml.sax.saxutils import escape
+
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from core.services.exports import DEFAULT_CHUNK_SIZE
+from .models import DECIMAL_ZERO, Account, JournalLine
+
+EXPORT_FORMATS = ("csv", "xlsx", "xml")
+PROGRESS_EVERY = 10000
+
+SAFT_NAMESPACE = "urn:OECD:StandardAuditFile-Tax:2.00"
+
+# (header, values() path) — one flat row per JournalLine
+GL_COLUMNS = (
+    ("entry_id", "entry_id"),
+    ("date", "entry__date"),
+    ("fiscal_year", "entry__fiscal_year__year"),
+    ("journal_code", "entry__journal__code"),
+    ("journal_name", "entry__journal__name"),
+    ("reference", "entry__reference"),
+    ("entry_description", "entry__description"),
+    ("posted", "entry__posted"),
+    ("line_id", "id"),
+    ("account_code", "account__code"),
+    ("account_name", "account__name"),
+    ("account_type", "account__type"),
+    ("line_description", "description"),
+    ("debit", "debit"),
+    ("credit", "credit"),
+)
+GL_HEADER = [header for header, _path in GL_COLUMNS]
+GL_FIELDS = [path for _header, path in GL_COLUMNS]
+_POSTED_INDEX = GL_FIELDS.index("entry__posted")
+
+ProgressFn = Callable[[int], None]
+
+
+# =====================================================================
+# Query
+# =====================================================================
+
+def general_ledger_queryset(
+    *,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    fiscal_year=None,
+    posted_only: bool = True,
+):
+    """
+    Every JournalLine in the selection, in audit order
+    (entry date, entry, line). Rows are read with values(), no model instances.
+    """
+    qs = JournalLine.objects.all()
+    if posted_only:
+        qs = qs.posted()
+    if fiscal_year is not None:
+        qs = qs.filter(entry__fiscal_year=fiscal_year)
+    return qs.within_period(date_from, date_to).order_by("entry__date", "entry_id", "id")
+
+
+def general_ledger_rows(
+    queryset,
+    *,
+    progress: ProgressFn | None = None,
+    progress_every: int = PROGRESS_EVERY,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[list]:
+    """
+    Lazily yield one list per line (GL_HEADER order) from a server-side
+    iterator, so memory does not grow with the number of lines.
+    `progress(count)` is called every `progress_every` rows and at the end.
+    """
+    count = 0
+    for row in queryset.values_list(*GL_FIELDS).iterator(chunk_size=chunk_size):
+        count += 1
+        if progress and count % progress_every == 0:
+            progress(count)
+        row = list(row)
+        row[_POSTED_INDEX] = int(row[_POSTED_INDEX])  # bool -> 1/0
+        yield row
+    if progress:
+        progress(count)
+
+
+# =====================================================================
+# SAF-T (GeneralLedgerEntries)
+# =====================================================================
+
+def _amount(tag: str, value: Decimal) -> str:
+    return f"<{tag}><Amount>{value:.3f}</Amount></{tag}>"
+
+
+def _text(tag: str, value) -> str:
+    return f"<{tag}>{escape(str(value or ''))}</{tag}>"
+
+
+def iter_saft_xml(
+    queryset,
+    *,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    company_name: str = "",
+    progress: ProgressFn | None = None,
+    progress_every: int = PROGRESS_EVERY,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[str]:
+    """
+    SAF-T style XML (Header, GeneralLedgerAccounts, GeneralLedgerEntries),
+    yielded one transaction at a time.
+
+    The entry count and debit/credit totals that SAF-T puts before the
+    entries come from one aggregate; lines are then streamed ordered by
+    journal and entry, and grouped on the fly.
+    """
+    queryset = queryset.order_by("entry__journal__code", "entry__date", "entry_id", "id")
+    totals = queryset.aggregate(
+        entries=Count("entry_id", distinct=True),
+        debit=Sum("debit"),
+        credit=Sum("credit"),
+    )
+
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield f'<AuditFile xmlns="{SAFT_NAMESPACE}">\n'
+    yield (
+        "<Header>"
+        "<AuditFileVersion>2.00</AuditFileVersion>"
+        f"{_text('CompanyName', company_name)}"
+        f"<AuditFileDateCreated>{timezone.localdate().isoformat()}</AuditFileDateCreated>"
+        "<SelectionCriteria>"
+        f"{_text('SelectionStartDate', date_from.isoformat() if date_from else '')}"
+        f"{_text('SelectionEndDate', date_to.isoformat() if date_to else '')}"
+        "</SelectionCriteria>"
+        "</Header>\n"
+    )
+
+    yield "<MasterFiles><GeneralLedgerAccounts>\n"
+    for code, name, account_type in (
+        Account.objects.order_by("code").values_list("code", "name", "type").iterator(chunk_size=chunk_size)
+    ):
+        yield (
+            f"<Account>{_text('AccountID', code)}{_text('AccountDescription', name)}"
+            f"{_text('AccountType', account_type)}</Account>\n"
+        )
+    yield "</GeneralLedgerAccounts></MasterFiles>\n"
+
+    yield (
+        "<GeneralLedgerEntries>"
+        f"<NumberOfEntries>{totals['entries']}</NumberOfEntries>"
+        f"<TotalDebit>{(totals['debit'] or DECIMAL_ZERO):.3f}</TotalDebit>"
+        f"<TotalCredit>{(totals['credit'] or DECIMAL_ZERO):.3f}</TotalCredit>\n"
+    )
+
+    fields = [
+        "id", "entry_id", "entry__date", "entry__reference", "entry__description",
+        "entry__journal__code", "entry__journal__name", "account__code", "description", "debit", "credit",
+    ]
+    journal_code = entry_id = None
+    count = 0
+    for row in queryset.values(*fields).iterator(chunk_size=chunk_size):
+        if row["entry_id"] != entry_id and entry_id is not None:
+            yield "</Transaction>\n"
+        code = row["entry__journal__code"] or ""
+        if code != journal_code:
+            if journal_code is not None:
+                yield "</Journal>\n"
+            journal_code = code
+            yield f"<Journal>{_text('JournalID', journal_code)}{_text('Description', row['entry__journal__name'])}\n"
+            entry_id = None
+        if row["entry_id"] != entry_id:
+            entry_id = row["entry_id"]
+            yield (
+                f"<Transaction>{_text('TransactionID', f'JE-{entry_id}')}"
+                f"<TransactionDate>{row['entry__date'].isoformat()}</TransactionDate>"
+                f"{_text('SourceDocumentID', row['entry__reference'])}"
+                f"{_text('Description', row['entry__description'])}\n"
+            )
+
+        side = _amount("DebitAmount", row["debit"]) if row["debit"] else _amount("CreditAmount", row["credit"])
+        yield (
+            f"<Line>{_text('RecordID', row['id'])}{_text('AccountID', row['account__code'])}"
+            f"{_text('Description', row['description'] or row['entry__description'])}{side}</Line>\n"
+        )
+
+        count += 1
+        if progress and count % progress_every == 0:
+            progress(count)
+
+    if entry_id is not None:
+        yield "</Transaction>\n"
+    if journal_code is not None:
+        yield "</Journal>\n"
+    yield "</GeneralLedgerEntries>\n</AuditFile>\n"
+    if progress:
+        progress(count)
@@ -0,0 +1,56 @@
+# accounting/management/commands/auto_allocate_payments.py
+
+from django.core.management.base import BaseCommand
+
+from accounting.allocation import (
+    AllocationStrategy,
+    auto_allocate_payments,
+    payments_with_unallocated_amount,
+)
+
+
+class Command(BaseCommand):
+    """
+    Allocate unallocated payments to open invoices of the same contact.
+    """
+
+    help = "Automatically allocate payments to open invoices (fifo / due_date / exact)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--strategy",
+            choices=AllocationStrategy.values,
+            default=AllocationStrategy.FIFO,
+            help="Allocation strategy (default: fifo).",
+        )
+        parser.add_argument("--contact", type=int, help="Only payments of this contact id.")
+        parser.add_argument("--date-from", help="Only payments dated on/after YYYY-MM-DD.")
+        parser.add_argument("--date-to", help="Only payments dated on/before YYYY-MM-DD.")
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Compute allocations without writing anything.",
+        )
+
+    def handle(self, *args, **options):
+        payments = payments_with_unallocated_amount()
+        if options.get("contact"):
+            payments = payments.filter(contact_id=options["contact"])
+        if options.get("date_from"):
+            payments = payments.filter(date__gte=options["date_from"])
+        if options.get("date_to"):
+            payments = payments.filter(date__lte=options["date_to"])
+
+        result = auto_allocate_payments(
+            payments.only("pk"),
+            strategy=options["strategy"],
+            dry_run=options["dry_run"],
+        )
+
+        prefix = "[dry-run] " if options["dry_run"] else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{prefix}Allocated {result.total_amount} from {result.payments_count} payment(s) "
+                f"to {result.invoices_count} invoice(s) using '{options['strategy']}'."
+            )
+        )
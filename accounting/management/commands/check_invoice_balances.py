@@ -0,0 +1,45 @@
+# accounting/management/commands/check_invoice_balances.py
+
+from django.core.management.base import BaseCommand
+
+from accounting.models import Invoice
+from accounting.services import refresh_invoice_allocation_totals
+
+
+class Command(BaseCommand):
+    """
+    Compare Invoice.allocated_total / balance with the actual allocations.
+    """
+
+    help = "Check (and optionally fix) denormalized invoice allocated_total / balance columns."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Recompute the columns for the mismatching invoices.",
+        )
+
+    def handle(self, *args, **options):
+        mismatches = list(
+            Invoice.objects.allocation_mismatches()
+            .order_by("pk")
+            .values("pk", "total_amount", "allocated_total", "balance", "actual_allocated")
+        )
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS("All invoice balances are consistent."))
+            return
+
+        for row in mismatches:
+            self.stdout.write(
+                f"INV-{row['pk']}: stored allocated={row['allocated_total']} balance={row['balance']}, "
+                f"actual allocated={row['actual_allocated']} "
+                f"balance={row['total_amount'] - row['actual_allocated']}"
+            )
+
+        if options["fix"]:
+            fixed = refresh_invoice_allocation_totals([row["pk"] for row in mismatches])
+            self.stdout.write(self.style.SUCCESS(f"Fixed {fixed} invoice(s)."))
+        else:
+            self.stdout.write(self.style.WARNING(f"{len(mismatches)} invoice(s) out of sync. Use --fix to repair."))
@@ -0,0 +1,91 @@
+# accounting/management/commands/export_general_ledger.py
+
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounting.ledger_export import (
+    EXPORT_FORMATS,
+    GL_HEADER,
+    general_ledger_queryset,
+    general_ledger_rows,
+    iter_saft_xml,
+)
+from accounting.models import FiscalYear
+from core.services.exports import iter_csv_lines, write_xlsx
+
+
+class Command(BaseCommand):
+    """
+    Stream every journal line (with entry, account and journal) to a file
+    for external auditors. Rows are read with a server-side iterator and
+    written as they come, so memory stays flat for millions of lines.
+    """
+
+    help = "Export the general ledger (all journal lines) as CSV, XLSX or SAF-T style XML."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv", help="Output format (default: csv).")
+        parser.add_argument(
+            "--output",
+            help="Output file path. CSV and XML go to stdout when omitted; XLSX requires a path.",
+        )
+        parser.add_argument("--year", type=int, help="Only this fiscal year.")
+        parser.add_argument("--date-from", help="Only entries dated on/after YYYY-MM-DD.")
+        parser.add_argument("--date-to", help="Only entries dated on/before YYYY-MM-DD.")
+        parser.add_argument("--include-drafts", action="store_true", help="Include unposted entries.")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Rows fetched per round trip (default: 2000).")
+
+    def _parse_date(self, value, option):
+        if not value:
+            return None
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f"Invalid {option}: {value} (expected YYYY-MM-DD).")
+
+    def handle(self, *args, **options):
+        fmt = options["format"]
+        output = options.get("output")
+        if fmt == "xlsx" and not output:
+            raise CommandError("--output is required for xlsx.")
+
+        fiscal_year = None
+        if options.get("year"):
+            fiscal_year = FiscalYear.objects.for_year(options["year"]).first()
+            if fiscal_year is None:
+                raise CommandError(f"Fiscal year {options['year']} not found.")
+
+        date_from = self._parse_date(options.get("date_from"), "--date-from")
+        date_to = self._parse_date(options.get("date_to"), "--date-to")
+        queryset = general_ledger_queryset(
+            date_from=date_from,
+            date_to=date_to,
+            fiscal_year=fiscal_year,
+            posted_only=not options["include_drafts"],
+        )
+
+        def progress(count):
+            self.stderr.write(f"... {count} lines")
+
+        stream = dict(progress=progress, chunk_size=options["chunk_size"])
+
+        if fmt == "xlsx":
+            with open(output, "wb") as fh:
+                write_xlsx(fh, GL_HEADER, general_ledger_rows(queryset, **stream), sheet_title="General Ledger")
+        else:
+            if fmt == "xml":
+                chunks = iter_saft_xml(queryset, date_from=date_from, date_to=date_to, **stream)
+            else:
+                chunks = iter_csv_lines(GL_HEADER, general_ledger_rows(queryset, **stream))
+
+            if output:
+                with open(output, "w", encoding="utf-8", newline="") as fh:
+                    for chunk in chunks:
+                        fh.write(chunk)
+            else:
+                for chunk in chunks:
+                    self.stdout.write(chunk, ending="")
+
+        if output:
+            self.stderr.write(self.style.SUCCESS(f"General ledger exported to {output}."))
@@ -0,0 +1,46 @@
+# accounting/management/commands/post_invoices_to_ledger.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounting.models import Invoice
+from accounting.services import post_invoices_to_ledger
+
+
+class Command(BaseCommand):
+    """
+    Batch-post issued sales invoices that have no ledger entry yet.
+    """
+
+    help = "Post unposted sales invoices to the ledger in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date-from", help="Only invoices issued on/after YYYY-MM-DD.")
+        parser.add_argument("--date-to", help="Only invoices issued on/before YYYY-MM-DD.")
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Invoices per transaction (default: 500).",
+        )
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.unposted().filter(type=Invoice.InvoiceType.SALES)
+        if options.get("date_from"):
+            invoices = invoices.filter(issued_at__gte=options["date_from"])
+        if options.get("date_to"):
+            invoices = invoices.filter(issued_at__lte=options["date_to"])
+
+        try:
+            result = post_invoices_to_ledger(invoices, chunk_size=options["chunk_size"])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        for error in result["errors"]:
+            self.stdout.write(self.style.WARNING(str(error)))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Posted {result['posted']} invoice(s), skipped {result['skipped']}, "
+                f"{len(result['errors'])} error(s)."
+            )
+        )
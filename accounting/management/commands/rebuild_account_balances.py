@@ -0,0 +1,34 @@
+# accounting/management/commands/rebuild_account_balances.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounting.models import FiscalYear
+from accounting.services import rebuild_account_balances
+
+
+class Command(BaseCommand):
+    """
+    Rebuild AccountPeriodBalance from posted journal lines.
+    """
+
+    help = "Recompute the per-account monthly balance table from posted journal lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--year",
+            type=int,
+            help="Rebuild only this fiscal year (default: all years).",
+        )
+
+    def handle(self, *args, **options):
+        fiscal_year = None
+        year = options.get("year")
+        if year:
+            fiscal_year = FiscalYear.objects.for_year(year).first()
+            if fiscal_year is None:
+                raise CommandError(f"Fiscal year {year} not found.")
+
+        count = rebuild_account_balances(fiscal_year=fiscal_year)
+
+        scope = f"fiscal year {year}" if fiscal_year else "all years"
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} balance rows ({scope})."))
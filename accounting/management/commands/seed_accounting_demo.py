@@ -19,6 +19,7 @@ from accounting.models import (
     PaymentReconciliation,
     LedgerSettings,
 )
+from accounting.services import post_journal_entry, refresh_invoice_allocation_totals
 from contacts.models import Contact
 
 
@@ -237,10 +238,8 @@ class Command(BaseCommand):
             order=3,
         )
 
-        je_sales.posted = True
-        je_sales.posted_at = now_dt
-        je_sales.posted_by = user
-        je_sales.save(update_fields=["posted", "posted_at", "posted_by"])
+        # Through the service: also adds the lines to AccountPeriodBalance
+        post_journal_entry(je_sales, user=user)
 
         # Link invoice to journal entry
         invoice_sales.ledger_entry = je_sales
@@ -286,10 +285,7 @@ class Command(BaseCommand):
             order=2,
         )
 
-        je_receipt.posted = True
-        je_receipt.posted_at = now_dt
-        je_receipt.posted_by = user
-        je_receipt.save(update_fields=["posted", "posted_at", "posted_by"])
+        post_journal_entry(je_receipt, user=user)
 
         payment_receipt.journal_entry = je_receipt
         payment_receipt.is_posted = True
@@ -303,7 +299,7 @@ class Command(BaseCommand):
             amount=invoice_sales.total_amount,
             note="Demo full settlement of sales invoice",
         )
-        invoice_sales.update_payment_status()
+        refresh_invoice_allocation_totals([invoice_sales.pk])
 
         # ------------------------------------------------------------------
         # 2) Demo PURCHASE invoice + journal entry + payment voucher
@@ -366,10 +362,7 @@ class Command(BaseCommand):
             order=3,
         )
 
-        je_purchase.posted = True
-        je_purchase.posted_at = now_dt
-        je_purchase.posted_by = user
-        je_purchase.save(update_fields=["posted", "posted_at", "posted_by"])
+        post_journal_entry(je_purchase, user=user)
 
         invoice_purchase.ledger_entry = je_purchase
         invoice_purchase.save(update_fields=["ledger_entry"])
@@ -413,10 +406,7 @@ class Command(BaseCommand):
             order=2,
         )
 
-        je_payment.posted = True
-        je_payment.posted_at = now_dt
-        je_payment.posted_by = user
-        je_payment.save(update_fields=["posted", "posted_at", "posted_by"])
+        post_journal_entry(je_payment, user=user)
 
         payment_voucher.journal_entry = je_payment
         payment_voucher.is_posted = True
@@ -429,6 +419,6 @@ class Command(BaseCommand):
             amount=invoice_purchase.total_amount,
             note="Demo full settlement of purchase invoice",
         )
-        invoice_purchase.update_payment_status()
+        refresh_invoice_allocation_totals([invoice_purchase.pk])
 
         self.stdout.write(self.style.SUCCESS("Demo accounting data created successfully."))
@@ -1,6 +1,13 @@
 # accounting/managers.py
 
-from django.db import models
+import uuid
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
 
@@ -32,12 +39,114 @@ class FiscalYearQuerySet(models.QuerySet):
         return self.filter(start_date__lte=date, end_date__gte=date)
 
 
+class FiscalYearIndex:
+    """
+    Read-only, in-memory snapshot of all fiscal years for date lookups.
+
+    Years are sorted by start_date and searched with bisect, so resolving a
+    date costs O(log n) and no query. If fiscal years overlap (not expected,
+    but not forbidden by the schema) lookups fall back to a linear scan and
+    pick the latest year, like the old `.first()` on ordering ["-year"].
+    """
+
+    def __init__(self, fiscal_years):
+        self.years = sorted(fiscal_years, key=lambda fy: (fy.start_date, fy.pk))
+        self.starts = [fy.start_date for fy in self.years]
+        self.by_year = {fy.year: fy for fy in self.years}
+        self.by_pk = {fy.pk: fy for fy in self.years}
+        self.overlapping = any(
+            prev.end_date >= nxt.start_date
+            for prev, nxt in zip(self.years, self.years[1:])
+        )
+
+    @staticmethod
+    def _as_date(value):
+        if isinstance(value, datetime):
+            return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+        return value
+
+    def containing(self, value):
+        """Fiscal year whose [start_date, end_date] contains the date, or None."""
+        day = self._as_date(value)
+        if not day:
+            return None
+
+        if self.overlapping:
+            matches = [fy for fy in self.years if fy.start_date <= day <= fy.end_date]
+            return max(matches, key=lambda fy: fy.year) if matches else None
+
+        i = bisect_right(self.starts, day) - 1
+        if i >= 0 and self.years[i].end_date >= day:
+            return self.years[i]
+        return None
+
+    def for_date(self, value, *, fallback_to_year: bool = True):
+        """containing(date), then (optionally) the fiscal year with the same calendar year."""
+        fy = self.containing(value)
+        if fy is None and fallback_to_year and value:
+            fy = self.by_year.get(self._as_date(value).year)
+        return fy
+
+    def for_dates(self, values, *, fallback_to_year: bool = True) -> dict:
+        """Resolve many dates at once: {date: FiscalYear | None}."""
+        return {
+            value: self.for_date(value, fallback_to_year=fallback_to_year)
+            for value in set(values)
+        }
+
+    def closed_ids(self) -> set:
+        return {fy.pk for fy in self.years if fy.is_closed}
+
+    def carry_forward_start(self, value=None):
+        """
+        First day after the latest closed year (ending before `value`, or any
+        if None) whose balances were carried into an opening entry.
+        Cumulative balances only need to be summed from that day on; earlier
+        history is already inside the opening entry. None if no such year.
+        """
+        day = self._as_date(value)
+        ends = [
+            fy.end_date for fy in self.years
+            if fy.is_closed and fy.opening_entry_id and (day is None or fy.end_date < day)
+        ]
+        return max(ends) + timedelta(days=1) if ends else None
+
+
+# Per-process snapshot, checked against a version key in the shared cache
+# (settings.CACHES): a save / delete in any worker makes the others rebuild.
+_FISCAL_YEAR_INDEX = {"version": None, "index": None}
+_FISCAL_YEAR_INDEX_VERSION_KEY = "accounting:fiscal_year_index:version"
+
+
 class FiscalYearManager(models.Manager.from_queryset(FiscalYearQuerySet)):
     """
     Manager wrapper to expose convenient helpers like:
         FiscalYear.objects.for_date(date)
+        FiscalYear.objects.for_dates([date, ...])
     """
 
+    def index(self) -> FiscalYearIndex:
+        """
+        The in-memory fiscal year index, rebuilt (one query) only after a
+        FiscalYear was saved or deleted in any process.
+        """
+        version = cache.get(_FISCAL_YEAR_INDEX_VERSION_KEY)
+        if version is None:
+            cache.add(_FISCAL_YEAR_INDEX_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+            version = cache.get(_FISCAL_YEAR_INDEX_VERSION_KEY)
+
+        if _FISCAL_YEAR_INDEX["version"] != version or _FISCAL_YEAR_INDEX["index"] is None:
+            _FISCAL_YEAR_INDEX["index"] = FiscalYearIndex(self.get_queryset())
+            _FISCAL_YEAR_INDEX["version"] = version
+        return _FISCAL_YEAR_INDEX["index"]
+
+    def invalidate_index(self) -> None:
+        def bump():
+            cache.set(_FISCAL_YEAR_INDEX_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+        bump()
+        transaction.on_commit(bump)
+
     def for_date(self, date):
         """
         Get the fiscal year that contains `date`, or fallback to same calendar year.
@@ -45,11 +154,14 @@ class FiscalYearManager(models.Manager.from_queryset(FiscalYearQuerySet)):
         """
         if not date:
             return None
+        return self.index().for_date(date)
 
-        fy = self.containing(date).first()
-        if fy:
-            return fy
-        return self.for_year(date.year).first()
+    def for_dates(self, dates, *, fallback_to_year: bool = True) -> dict:
+        """
+        Resolve many dates with no database round-trip:
+            {date: FiscalYear | None}
+        """
+        return self.index().for_dates(dates, fallback_to_year=fallback_to_year)
 
 
 # ==============================================================================
@@ -74,6 +186,29 @@ class AccountQuerySet(models.QuerySet):
         """
         return self.active().filter(allow_settlement=True)
 
+    # --- Tree (materialized path) ---
+
+    def tree_order(self):
+        return self.order_by("path")
+
+    def roots(self):
+        return self.filter(parent__isnull=True)
+
+    def subtree(self, account, *, include_self: bool = True):
+        """
+        The account and all its descendants (one indexed prefix query).
+        """
+        qs = self.filter(path__startswith=account.path)
+        if not include_self:
+            qs = qs.exclude(pk=account.pk)
+        return qs
+
+    def ancestors_of(self, account):
+        return self.filter(code__in=account.ancestor_codes)
+
+    def leaves(self):
+        return self.filter(children__isnull=True)
+
 
 class AccountManager(models.Manager.from_queryset(AccountQuerySet)):
     """
@@ -225,12 +360,23 @@ class JournalEntryQuerySet(models.QuerySet):
         Annotate each entry with:
           - total_debit_value
           - total_credit_value
+        (0 for entries without lines). JournalEntry.total_debit / total_credit /
+        imbalance / is_balanced read these instead of running an aggregate.
         """
+        if "total_debit_value" in self.query.annotations:
+            return self
+        output = models.DecimalField(max_digits=14, decimal_places=3)
         return self.annotate(
-            total_debit_value=models.Sum("lines__debit"),
-            total_credit_value=models.Sum("lines__credit"),
+            total_debit_value=Coalesce(models.Sum("lines__debit"), Decimal("0.000"), output_field=output),
+            total_credit_value=Coalesce(models.Sum("lines__credit"), Decimal("0.000"), output_field=output),
         )
 
+    def unbalanced(self):
+        """
+        Entries whose debit and credit totals differ (HAVING on the grouped totals).
+        """
+        return self.with_totals().exclude(total_debit_value=models.F("total_credit_value"))
+
 
 class JournalEntryManager(models.Manager.from_queryset(JournalEntryQuerySet)):
     """
@@ -281,6 +427,56 @@ class JournalLineQuerySet(models.QuerySet):
             qs = qs.filter(entry__date__lte=date_to)
         return qs
 
+    def _reconciled_sum(self):
+        # Sum of BankReconciliation.amount_reconciled per line (correlated subquery);
+        # the banking model is reached through the reverse relation, no import.
+        reconciliation = self.model._meta.get_field("bank_reconciliations").related_model
+        output = models.DecimalField(max_digits=18, decimal_places=3)
+        total = (
+            reconciliation.objects.filter(journal_item=models.OuterRef("pk"))
+            .values("journal_item")
+            .annotate(total=models.Sum("amount_reconciled"))
+            .values("total")
+        )
+        return Coalesce(models.Subquery(total, output_field=output), Decimal("0.000"), output_field=output)
+
+    def with_reconciliation(self):
+        """
+        Annotate each line with:
+          - amount_reconciled_value: sum of its bank reconciliations
+          - amount_open_value: (debit - credit) - amount_reconciled_value
+        JournalLine.amount_reconciled / amount_open / is_fully_reconciled
+        read these instead of aggregating per line.
+        """
+        return self.annotate(amount_reconciled_value=self._reconciled_sum()).annotate(
+            amount_open_value=models.ExpressionWrapper(
+                models.F("debit") - models.F("credit") - models.F("amount_reconciled_value"),
+                output_field=models.DecimalField(max_digits=18, decimal_places=3),
+            ),
+        )
+
+    def open_items(self):
+        """
+        Lines not fully reconciled, read from the maintained
+        amount_reconciled_total column (plain WHERE, sortable in SQL).
+        """
+        return self.exclude(amount_reconciled_total=models.F("debit") - models.F("credit"))
+
+    def refresh_reconciled_totals(self) -> int:
+        """
+        Recompute amount_reconciled_total and the reconciled flag of these
+        lines from their bank reconciliations, in one UPDATE.
+        """
+        reconciled_sum = self._reconciled_sum()
+        return self.update(
+            amount_reconciled_total=reconciled_sum,
+            # fully reconciled ⇔ debit - credit == reconciled sum
+            reconciled=models.ExpressionWrapper(
+                models.Q(debit=reconciled_sum + models.F("credit")),
+                output_field=models.BooleanField(),
+            ),
+        )
+
 
 class JournalLineManager(models.Manager.from_queryset(JournalLineQuerySet)):
     """
@@ -322,10 +518,36 @@ class InvoiceQuerySet(models.QuerySet):
         """
         Open invoices (with remaining balance):
         - not cancelled
-        - total_amount > paid_amount
+        - balance > 0 (denormalized column, filtered in SQL)
         """
-        return self.exclude(status="cancelled").filter(
-            total_amount__gt=models.F("paid_amount")
+        return self.exclude(status="cancelled").filter(balance__gt=0)
+
+    def unposted(self):
+        """
+        Issued invoices (not draft / cancelled) without a ledger entry yet.
+        """
+        return self.exclude(status__in=["draft", "cancelled"]).filter(ledger_entry__isnull=True)
+
+    def allocation_mismatches(self):
+        """
+        Invoices whose stored allocated_total / balance disagree with
+        the actual sum of their PaymentReconciliation rows.
+        """
+        from .models import PaymentReconciliation  # local import to avoid circular
+
+        actual = Coalesce(
+            models.Subquery(
+                PaymentReconciliation.objects.filter(invoice=models.OuterRef("pk"))
+                .values("invoice")
+                .annotate(s=models.Sum("amount"))
+                .values("s")[:1]
+            ),
+            models.Value(Decimal("0.000")),
+            output_field=models.DecimalField(max_digits=12, decimal_places=3),
+        )
+        return self.annotate(actual_allocated=actual).filter(
+            ~models.Q(allocated_total=models.F("actual_allocated"))
+            | ~models.Q(balance=models.F("total_amount") - models.F("actual_allocated"))
         )
 
     # ----- Overdue -----
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-16 19:36
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountPeriodBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(verbose_name='الفترة (الشهر)')),
+                ('debit', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=16, verbose_name='مدين')),
+                ('credit', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=16, verbose_name='دائن')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='period_balances', to='accounting.account', verbose_name='الحساب')),
+                ('fiscal_year', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='account_balances', to='accounting.fiscalyear', verbose_name='السنة المالية')),
+            ],
+            options={
+                'verbose_name': 'رصيد حساب شهري',
+                'verbose_name_plural': 'أرصدة الحسابات الشهرية',
+                'ordering': ['period', 'account__code'],
+                'indexes': [models.Index(fields=['period', 'account'], name='acc_balance_period_idx'), models.Index(fields=['fiscal_year', 'account'], name='acc_balance_fy_idx')],
+                'constraints': [models.UniqueConstraint(fields=('account', 'fiscal_year', 'period'), name='uniq_account_period_balance')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.8 on 2026-10-16 19:40
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_invoice_totals(apps, schema_editor):
+    Invoice = apps.get_model("accounting", "Invoice")
+    PaymentReconciliation = apps.get_model("accounting", "PaymentReconciliation")
+
+    sums = dict(
+        PaymentReconciliation.objects.values("invoice_id")
+        .annotate(total=Sum("amount"))
+        .values_list("invoice_id", "total")
+    )
+
+    invoices = list(Invoice.objects.only("pk", "total_amount"))
+    for invoice in invoices:
+        invoice.allocated_total = sums.get(invoice.pk) or Decimal("0.000")
+        invoice.balance = invoice.total_amount - invoice.allocated_total
+    Invoice.objects.bulk_update(invoices, ["allocated_total", "balance"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0002_account_period_balance'),
+        ('contacts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='allocated_total',
+            field=models.DecimalField(decimal_places=3, default=Decimal('0.000'), editable=False, max_digits=12, verbose_name='إجمالي المبالغ المسوّاة'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='balance',
+            field=models.DecimalField(decimal_places=3, default=Decimal('0.000'), editable=False, max_digits=12, verbose_name='الرصيد المتبقي'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['customer', 'type', 'balance'], name='invoice_open_balance_idx'),
+        ),
+        migrations.RunPython(backfill_invoice_totals, migrations.RunPython.noop),
+    ]
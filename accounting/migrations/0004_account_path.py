@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-16 19:54
+
+from django.db import migrations, models
+
+
+def backfill_account_paths(apps, schema_editor):
+    Account = apps.get_model("accounting", "Account")
+
+    nodes = {pk: (code, parent_id) for pk, code, parent_id in Account.objects.values_list("pk", "code", "parent_id")}
+    paths = {}
+
+    def resolve(pk, seen=()):
+        if pk in paths:
+            return paths[pk]
+        code, parent_id = nodes[pk]
+        parent_path = ""
+        if parent_id in nodes and parent_id not in seen:
+            parent_path = resolve(parent_id, seen + (pk,))
+        paths[pk] = f"{parent_path}{code}/"
+        return paths[pk]
+
+    accounts = list(Account.objects.only("pk"))
+    for account in accounts:
+        account.path = resolve(account.pk)
+        account.level = account.path.count("/") - 1
+    Account.objects.bulk_update(accounts, ["path", "level"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0003_invoice_allocated_total'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='level',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='المستوى'),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255, verbose_name='المسار في الشجرة'),
+        ),
+        migrations.RunPython(backfill_account_paths, migrations.RunPython.noop),
+    ]
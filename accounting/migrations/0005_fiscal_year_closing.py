@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-16 20:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0004_account_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fiscalyear',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='تاريخ الإقفال'),
+        ),
+        migrations.AddField(
+            model_name='fiscalyear',
+            name='closing_entry',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='accounting.journalentry', verbose_name='قيد الإقفال'),
+        ),
+        migrations.AddField(
+            model_name='fiscalyear',
+            name='opening_entry',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='accounting.journalentry', verbose_name='القيد الافتتاحي للسنة التالية'),
+        ),
+        migrations.AddField(
+            model_name='ledgersettings',
+            name='retained_earnings_account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='accounting.account', verbose_name='حساب الأرباح المبقاة (إقفال السنة)'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-16 20:08
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_reconciled_totals(apps, schema_editor):
+    JournalLine = apps.get_model("accounting", "JournalLine")
+    BankReconciliation = apps.get_model("banking", "BankReconciliation")
+
+    total = (
+        BankReconciliation.objects.filter(journal_item=OuterRef("pk"))
+        .values("journal_item")
+        .annotate(total=Sum("amount_reconciled"))
+        .values("total")
+    )
+    output = models.DecimalField(max_digits=18, decimal_places=3)
+    JournalLine.objects.filter(pk__in=BankReconciliation.objects.values("journal_item")).update(
+        amount_reconciled_total=Coalesce(Subquery(total, output_field=output), Decimal("0.000"), output_field=output)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0005_fiscal_year_closing'),
+        ('banking', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journalline',
+            name='amount_reconciled_total',
+            field=models.DecimalField(decimal_places=3, default=Decimal('0.000'), editable=False, max_digits=18, verbose_name='إجمالي المبلغ المُسوّى'),
+        ),
+        migrations.RunPython(backfill_reconciled_totals, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,7 @@
 # accounting/models.py
 
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import timedelta
 from decimal import Decimal
 
@@ -8,6 +10,7 @@ from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
 from django.db.models import Sum, Q, F, CheckConstraint
+from django.db.models.functions import Coalesce, Concat, Substr
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -22,17 +25,21 @@ from accounting.managers import (
 )
 from core.domain.hooks import on_lifecycle, on_transition
 from core.models.domain import StatefulDomainModel
+from core.models.singleton import CachedSingletonMixin
 
 User = get_user_model()
 
 DECIMAL_ZERO = Decimal("0.000")
 
+# pks of invoices whose total recalculation is deferred (see Invoice.deferred_totals)
+_DEFERRED_INVOICE_TOTALS: ContextVar[frozenset] = ContextVar("deferred_invoice_totals", default=frozenset())
+
 
 # ==============================================================================
 # Invoice Settings (global)
 # ==============================================================================
 
-class Settings(models.Model):
+class Settings(CachedSingletonMixin, models.Model):
     """
     Global invoice settings (due days, VAT, default terms, etc.).
     """
@@ -77,14 +84,6 @@ class Settings(models.Model):
         verbose_name = _("إعدادات الفواتير")
         verbose_name_plural = _("إعدادات الفواتير")
 
-    @classmethod
-    def get_solo(cls) -> "Settings":
-        """
-        Simple singleton pattern: ensure there is always one settings row (pk=1).
-        """
-        obj, _ = cls.objects.get_or_create(pk=1)
-        return obj
-
     def __str__(self) -> str:
         return str(_("إعدادات الفواتير"))
 
@@ -113,6 +112,32 @@ class FiscalYear(models.Model):
         verbose_name=_("افتراضية"),
     )
 
+    # Set by services.close_fiscal_year()
+    closed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name=_("تاريخ الإقفال"),
+    )
+    closing_entry = models.ForeignKey(
+        "JournalEntry",
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        verbose_name=_("قيد الإقفال"),
+    )
+    opening_entry = models.ForeignKey(
+        "JournalEntry",
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        verbose_name=_("القيد الافتتاحي للسنة التالية"),
+    )
+
     objects = FiscalYearManager()
 
     class Meta:
@@ -132,12 +157,9 @@ class FiscalYear(models.Model):
     @classmethod
     def for_date(cls, date):
         """
-        Find fiscal year for a given date.
+        Find fiscal year for a given date (in-memory index, no query).
         """
-        return cls.objects.filter(
-            start_date__lte=date,
-            end_date__gte=date,
-        ).first()
+        return cls.objects.index().containing(date)
 
     def save(self, *args, **kwargs):
         """
@@ -146,6 +168,12 @@ class FiscalYear(models.Model):
         if self.is_default:
             FiscalYear.objects.exclude(pk=self.pk).update(is_default=False)
         super().save(*args, **kwargs)
+        FiscalYear.objects.invalidate_index()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        FiscalYear.objects.invalidate_index()
+        return result
 
 
 # ==============================================================================
@@ -196,8 +224,27 @@ class Account(models.Model):
         verbose_name=_("يقبل التسوية"),
     )
 
+    # Materialized path: codes from the root down, e.g. "1000/1100/1110/".
+    # Maintained by save() and rebuild_account_paths(); a subtree is one
+    # prefix query (path__startswith) and ordering by path gives tree order.
+    path = models.CharField(
+        max_length=255,
+        blank=True,
+        default="",
+        editable=False,
+        db_index=True,
+        verbose_name=_("المسار في الشجرة"),
+    )
+    level = models.PositiveSmallIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_("المستوى"),
+    )
+
     objects = AccountManager()
 
+    PATH_SEPARATOR = "/"
+
     class Meta:
         ordering = ["code"]
         verbose_name = _("حساب")
@@ -206,6 +253,64 @@ class Account(models.Model):
     def __str__(self) -> str:
         return f"{self.code} - {self.name}"
 
+    # ------------------------------------------------------------------
+    # Tree (materialized path)
+    # ------------------------------------------------------------------
+    @classmethod
+    def build_path(cls, code: str, parent_path: str = "") -> str:
+        return f"{parent_path}{code}{cls.PATH_SEPARATOR}"
+
+    @staticmethod
+    def level_of(path: str) -> int:
+        return max(path.count(Account.PATH_SEPARATOR) - 1, 0)
+
+    @property
+    def ancestor_codes(self) -> list[str]:
+        """أكواد الآباء من الجذر حتى الأب المباشر."""
+        return [code for code in self.path.split(self.PATH_SEPARATOR) if code][:-1]
+
+    def _stored_path(self) -> str:
+        if self.pk is None:
+            return ""
+        return Account.objects.filter(pk=self.pk).values_list("path", flat=True).first() or ""
+
+    def _check_parent(self, stored_path: str) -> None:
+        if not self.parent_id:
+            return
+        if self.pk is not None and self.parent_id == self.pk:
+            raise ValidationError({"parent": _("لا يمكن أن يكون الحساب أباً لنفسه.")})
+        if stored_path and self.parent.path.startswith(stored_path):
+            raise ValidationError({"parent": _("لا يمكن جعل الحساب تابعاً لأحد فروعه.")})
+
+    def clean(self):
+        super().clean()
+        self._check_parent(self._stored_path())
+
+    def save(self, *args, **kwargs):
+        old_path = self._stored_path()
+        self._check_parent(old_path)
+
+        parent_path = self.parent.path if self.parent_id else ""
+        self.path = self.build_path(self.code, parent_path)
+        self.level = self.level_of(self.path)
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = set(update_fields) | {"path", "level"}
+
+        super().save(*args, **kwargs)
+
+        if old_path and old_path != self.path:
+            # Re-root the whole subtree in one UPDATE
+            Account.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(
+                    models.Value(self.path),
+                    Substr("path", len(old_path) + 1),
+                    output_field=models.CharField(),
+                ),
+                level=F("level") + (self.level - self.level_of(old_path)),
+            )
+
 
 # ==============================================================================
 # Journal & JournalEntry & JournalLine
@@ -313,13 +418,20 @@ class JournalEntry(models.Model):
         verbose_name = _("قيد يومية")
         verbose_name_plural = _("قيود اليومية")
 
+    def _lines_total(self, field: str) -> Decimal:
+        # Annotated by JournalEntryQuerySet.with_totals() → no extra query
+        annotated = f"total_{field}_value"
+        if annotated in self.__dict__:
+            return self.__dict__[annotated] or Decimal(0)
+        return self.lines.aggregate(sum=Sum(field))["sum"] or Decimal(0)
+
     @property
     def total_debit(self) -> Decimal:
-        return self.lines.aggregate(sum=Sum("debit"))["sum"] or Decimal(0)
+        return self._lines_total("debit")
 
     @property
     def total_credit(self) -> Decimal:
-        return self.lines.aggregate(sum=Sum("credit"))["sum"] or Decimal(0)
+        return self._lines_total("credit")
 
     @property
     def imbalance(self):
@@ -331,7 +443,7 @@ class JournalEntry(models.Model):
 
     @property
     def is_balanced(self) -> bool:
-        return self.total_debit == self.total_credit
+        return self.imbalance == 0
 
     @property
     def display_number(self) -> str:
@@ -393,6 +505,15 @@ class JournalLine(models.Model):
         default=False,
         verbose_name=_("مُسوّى بالكامل"),
     )
+    # مجموع BankReconciliation.amount_reconciled لهذا السطر، يُحدَّث مع كل
+    # تسوية / إلغاء تسوية؛ يسمح بفلترة وترتيب البنود المفتوحة في SQL
+    amount_reconciled_total = models.DecimalField(
+        max_digits=18,
+        decimal_places=3,
+        default=Decimal("0.000"),
+        editable=False,
+        verbose_name=_("إجمالي المبلغ المُسوّى"),
+    )
 
     order = models.PositiveIntegerField(default=0)
 
@@ -434,7 +555,10 @@ class JournalLine(models.Model):
         """
         مجموع المبالغ التي تم تسويتها من خلال BankReconciliation
         (الربط بين هذا السطر وبين سطور البنك).
+        Reads the with_reconciliation() annotation when present.
         """
+        if "amount_reconciled_value" in self.__dict__:
+            return self.__dict__["amount_reconciled_value"]
         total = self.bank_reconciliations.aggregate(
             sum=Sum("amount_reconciled")
         )["sum"] or Decimal("0.000")
@@ -447,6 +571,8 @@ class JournalLine(models.Model):
         signed_amount - amount_reconciled
         إذا كان الناتج 0 يعني أن السطر تمت تسويته بالكامل.
         """
+        if "amount_open_value" in self.__dict__:
+            return self.__dict__["amount_open_value"]
         return self.signed_amount - self.amount_reconciled
 
     @property
@@ -460,11 +586,76 @@ class JournalLine(models.Model):
         return f"{self.account.name}: D({self.debit}) C({self.credit})"
 
 
+# ==============================================================================
+# Account period balances (maintained incrementally)
+# ==============================================================================
+
+class AccountPeriodBalance(models.Model):
+    """
+    Posted debit/credit totals per account, fiscal year and calendar month.
+
+    Maintained transactionally whenever a JournalEntry is posted / unposted
+    (see accounting.services.apply_entry_to_balances), and can be rebuilt
+    from scratch with: python manage.py rebuild_account_balances
+    """
+
+    account = models.ForeignKey(
+        Account,
+        on_delete=models.CASCADE,
+        related_name="period_balances",
+        verbose_name=_("الحساب"),
+    )
+    # Opening entries are stored without fiscal year (see chart import)
+    fiscal_year = models.ForeignKey(
+        FiscalYear,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="account_balances",
+        verbose_name=_("السنة المالية"),
+    )
+    # First day of the month
+    period = models.DateField(verbose_name=_("الفترة (الشهر)"))
+
+    debit = models.DecimalField(
+        max_digits=16,
+        decimal_places=3,
+        default=DECIMAL_ZERO,
+        verbose_name=_("مدين"),
+    )
+    credit = models.DecimalField(
+        max_digits=16,
+        decimal_places=3,
+        default=DECIMAL_ZERO,
+        verbose_name=_("دائن"),
+    )
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["period", "account__code"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account", "fiscal_year", "period"],
+                name="uniq_account_period_balance",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["period", "account"], name="acc_balance_period_idx"),
+            models.Index(fields=["fiscal_year", "account"], name="acc_balance_fy_idx"),
+        ]
+        verbose_name = _("رصيد حساب شهري")
+        verbose_name_plural = _("أرصدة الحسابات الشهرية")
+
+    def __str__(self) -> str:
+        return f"{self.account_id} @ {self.period:%Y-%m}: D({self.debit}) C({self.credit})"
+
+
 # ==============================================================================
 # LedgerSettings
 # ==============================================================================
 
-class LedgerSettings(models.Model):
+class LedgerSettings(CachedSingletonMixin, models.Model):
     """
     Mapping of default journals and accounts used by automatic postings.
     """
@@ -560,6 +751,14 @@ class LedgerSettings(models.Model):
         related_name="+",
         verbose_name=_("حساب الدفعات المقدمة"),
     )
+    retained_earnings_account = models.ForeignKey(
+        Account,
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name="+",
+        verbose_name=_("حساب الأرباح المبقاة (إقفال السنة)"),
+    )
 
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -567,11 +766,6 @@ class LedgerSettings(models.Model):
         verbose_name = _("إعدادات الدفاتر")
         verbose_name_plural = _("إعدادات الدفاتر")
 
-    @classmethod
-    def get_solo(cls) -> "LedgerSettings":
-        obj, _ = cls.objects.get_or_create(pk=1)
-        return obj
-
 
 # ==============================================================================
 # Invoice & InvoiceItem
@@ -630,6 +824,23 @@ class Invoice(StatefulDomainModel):
         verbose_name=_("المبلغ المدفوع (قديم، سيتم إلغاءه لاحقاً)"),
     )
 
+    # مجاميع مخزنة (denormalized) تُحدّث من خدمات التسوية تحت قفل الصف
+    allocated_total = models.DecimalField(
+        max_digits=12,
+        decimal_places=3,
+        default=DECIMAL_ZERO,
+        editable=False,
+        verbose_name=_("إجمالي المبالغ المسوّاة"),
+    )
+
+    balance = models.DecimalField(
+        max_digits=12,
+        decimal_places=3,
+        default=DECIMAL_ZERO,
+        editable=False,
+        verbose_name=_("الرصيد المتبقي"),
+    )
+
     status = models.CharField(
         max_length=20,
         choices=Status.choices,
@@ -650,21 +861,33 @@ class Invoice(StatefulDomainModel):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("تاريخ الإنشاء"))
     updated_at = models.DateTimeField(auto_now=True, verbose_name=_("آخر تحديث"))
 
+    objects = InvoiceManager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["customer", "type", "balance"],
+                name="invoice_open_balance_idx",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        # balance مشتق دائماً من الإجمالي والمسوّى
+        self.balance = (self.total_amount or DECIMAL_ZERO) - (self.allocated_total or DECIMAL_ZERO)
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"total_amount", "allocated_total"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "balance"}
+
+        super().save(*args, **kwargs)
+
     # ------------------------------------------------------
     # خصائص الدفع
     # ------------------------------------------------------
     @property
     def allocated_amount(self) -> Decimal:
-        """المبلغ الذي تم تسويته فعلياً من خلال الدفعات."""
-        return (
-            self.allocations.aggregate(sum=Sum("amount"))["sum"]
-            or DECIMAL_ZERO
-        )
-
-    @property
-    def balance(self) -> Decimal:
-        """الرصيد المتبقي على الفاتورة."""
-        return self.total_amount - self.allocated_amount
+        """المبلغ الذي تم تسويته فعلياً من خلال الدفعات (من الحقل المخزن)."""
+        return self.allocated_total
 
     @property
     def is_fully_paid(self) -> bool:
@@ -681,30 +904,60 @@ class Invoice(StatefulDomainModel):
     def recalculate_totals(self, commit: bool = True) -> None:
         """
         يحسب total_amount من بنود الفاتورة:
-        sum(quantity * unit_price) لجميع items المرتبطة.
+        SUM(quantity * unit_price) في قاعدة البيانات (استعلام واحد).
         """
-        total = DECIMAL_ZERO
-
-        # نفترض أن related_name للبنود هو "items"
-        for line in self.items.all():
-            qty = line.quantity or DECIMAL_ZERO
-            price = line.unit_price or DECIMAL_ZERO
-            total += qty * price
-
-        self.total_amount = total
+        money = models.DecimalField(max_digits=16, decimal_places=3)
+        self.total_amount = self.items.aggregate(
+            total=Coalesce(
+                Sum(F("quantity") * F("unit_price"), output_field=money),
+                models.Value(DECIMAL_ZERO),
+                output_field=money,
+            )
+        )["total"].quantize(Decimal("0.001"))
 
         if commit:
             self.save(update_fields=["total_amount"])
 
+    @classmethod
+    def totals_deferred(cls, invoice_id) -> bool:
+        return invoice_id in _DEFERRED_INVOICE_TOTALS.get()
+
+    @contextmanager
+    def deferred_totals(self):
+        """
+        تأجيل إعادة احتساب الإجمالي أثناء كتابة عدد كبير من البنود:
+
+            with invoice.deferred_totals():
+                item_formset.save()
+
+        InvoiceItem.save() / delete() لا تعيد الاحتساب داخل الـ block،
+        ويُحسب الإجمالي مرة واحدة عند الخروج (ولا يُحسب إذا حدث استثناء).
+        الـ blocks المتداخلة لنفس الفاتورة لا تحسب إلا مرة واحدة (الخارجي).
+        """
+        if self.pk is None:
+            raise ValueError("deferred_totals() requires a saved invoice.")
+
+        deferred = _DEFERRED_INVOICE_TOTALS.get()
+        if self.pk in deferred:
+            yield self
+            return
+
+        token = _DEFERRED_INVOICE_TOTALS.set(deferred | {self.pk})
+        try:
+            yield self
+        finally:
+            _DEFERRED_INVOICE_TOTALS.reset(token)
+        self.recalculate_totals()
+
     # ------------------------------------------------------
     # تحديث حالة الفاتورة حسب التسويات
     # ------------------------------------------------------
-    def update_payment_status(self) -> None:
-        """تحديث حالة الفاتورة."""
+    def update_payment_status(self, commit: bool = True) -> None:
+        """تحديث حالة الفاتورة حسب allocated_total."""
         if self.status in [self.Status.DRAFT, self.Status.CANCELLED]:
             return
 
-        allocated = self.allocated_amount
+        allocated = self.allocated_total
 
         if allocated >= self.total_amount and self.total_amount > 0:
             self.status = self.Status.PAID
@@ -713,7 +966,8 @@ class Invoice(StatefulDomainModel):
         else:
             self.status = self.Status.SENT
 
-        self.save(update_fields=["status"])
+        if commit:
+            self.save(update_fields=["status"])
 
     # ------------------------------------------------------
     def __str__(self):
@@ -769,14 +1023,17 @@ class InvoiceItem(models.Model):
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        # Recalculate invoice total after saving the line.
-        self.invoice.recalculate_totals()
+        # Recalculate invoice total after saving the line (unless deferred).
+        if not Invoice.totals_deferred(self.invoice_id):
+            self.invoice.recalculate_totals()
 
     def delete(self, *args, **kwargs):
-        invoice = self.invoice
+        invoice_id = self.invoice_id
+        invoice = None if Invoice.totals_deferred(invoice_id) else self.invoice
         super().delete(*args, **kwargs)
-        # Recalculate totals on parent invoice after deletion.
-        invoice.recalculate_totals()
+        # Recalculate totals on parent invoice after deletion (unless deferred).
+        if invoice is not None:
+            invoice.recalculate_totals()
 
     def __str__(self) -> str:
         return f"{self.product or self.description} ({self.quantity})"
@@ -0,0 +1,687 @@
+# accounting/reports.py
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Iterator
+
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, F, OuterRef, Q, Subquery, Sum, Value, Window
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import (
+    Account,
+    AccountPeriodBalance,
+    FiscalYear,
+    Invoice,
+    JournalEntry,
+    JournalLine,
+    Payment,
+    PaymentReconciliation,
+)
+from .services import (
+    DECIMAL_ZERO,
+    bump_cache_version,
+    get_account_totals,
+    get_cache_version,
+    get_closing_entry_totals,
+    get_subtree_totals,
+    ledger_version,
+)
+
+LEDGER_CURSOR_SALT = "accounting.ledger.cursor"
+
+DASHBOARD_CACHE_KEY = "accounting:dashboard:metrics"
+DASHBOARD_CACHE_TIMEOUT = 60  # seconds
+
+# Reports below are keyed by version keys in the shared cache (settings.CACHES),
+# so a posting in any worker invalidates them for all workers.
+TRIAL_BALANCE_CACHE_TIMEOUT = 60 * 60  # seconds (keyed by ledger version)
+
+AGING_CACHE_VERSION_KEY = "accounting:aging:version"
+AGING_CACHE_TIMEOUT = 15 * 60  # seconds
+
+
+# =====================================================================
+# Account Ledger (keyset pagination + running balance in SQL)
+# =====================================================================
+
+@dataclass
+class LedgerPage:
+    """
+    One page of an account ledger.
+    """
+    lines: list[dict]
+    opening_balance: Decimal
+    next_cursor: str | None = None
+    totals: dict = field(default_factory=dict)
+
+    @property
+    def has_more(self) -> bool:
+        return self.next_cursor is not None
+
+
+class AccountLedger:
+    """
+    Ledger of a single account over [date_from, date_to].
+
+    - Lines are ordered by (entry__date, entry_id, id) and paged with a keyset
+      cursor on the same tuple, so every page is an indexed range scan.
+    - The running balance is computed by a SQL window function within each
+      page; the balance carried from the previous page travels in the
+      (signed) cursor, so no page ever re-aggregates earlier history.
+    - Opening balance comes from AccountPeriodBalance (see get_account_totals).
+    """
+
+    ORDERING = ("entry__date", "entry_id", "id")
+
+    def __init__(
+        self,
+        account: Account,
+        *,
+        date_from: date | None = None,
+        date_to: date | None = None,
+        include_children: bool = False,
+    ):
+        self.account = account
+        # Without a start date the ledger begins at the last carry-forward
+        # (opening entry of the year after a closed one)
+        if date_from is None:
+            date_from = FiscalYear.objects.index().carry_forward_start(date_to)
+        self.date_from = date_from
+        self.date_to = date_to
+        # include_children: the account and all its sub-accounts (path prefix)
+        self.include_children = include_children
+
+    # -----------------------------------------------------------------
+    # Balances
+    # -----------------------------------------------------------------
+    @property
+    def is_debit_nature(self) -> bool:
+        return self.account.type in [Account.Type.ASSET, Account.Type.EXPENSE]
+
+    def _signed(self, dr: Decimal, cr: Decimal) -> Decimal:
+        return dr - cr if self.is_debit_nature else cr - dr
+
+    def _totals(self, **filters) -> tuple[Decimal, Decimal]:
+        if self.include_children:
+            return get_subtree_totals(self.account, **filters)
+        return get_account_totals(account_ids=[self.account.pk], **filters).get(
+            self.account.pk, (DECIMAL_ZERO, DECIMAL_ZERO)
+        )
+
+    def opening_balance(self) -> Decimal:
+        if not self.date_from:
+            return DECIMAL_ZERO
+        if FiscalYear.objects.index().carry_forward_start(self.date_from) == self.date_from:
+            # The opening entry dated date_from already holds the history
+            return DECIMAL_ZERO
+        dr, cr = self._totals(date_to=self.date_from - timedelta(days=1))
+        return self._signed(dr, cr)
+
+    def period_totals(self, opening_balance: Decimal | None = None) -> dict:
+        """
+        Debit / credit totals of the period and the closing balance.
+        """
+        if opening_balance is None:
+            opening_balance = self.opening_balance()
+        dr, cr = self._totals(date_from=self.date_from, date_to=self.date_to)
+        return {
+            "total_debit": dr,
+            "total_credit": cr,
+            "closing_balance": opening_balance + self._signed(dr, cr),
+        }
+
+    # -----------------------------------------------------------------
+    # Query
+    # -----------------------------------------------------------------
+    def queryset(self):
+        qs = JournalLine.objects.posted()
+        if self.include_children:
+            qs = qs.filter(account__path__startswith=self.account.path)
+        else:
+            qs = qs.for_account(self.account)
+        return qs.within_period(self.date_from, self.date_to)
+
+    def _rows_after(self, key: tuple | None, limit: int):
+        qs = self.queryset()
+        if key is not None:
+            key_date, key_entry, key_id = key
+            qs = qs.filter(
+                Q(entry__date__gt=key_date)
+                | Q(entry__date=key_date, entry_id__gt=key_entry)
+                | Q(entry__date=key_date, entry_id=key_entry, id__gt=key_id)
+            )
+
+        signed = F("debit") - F("credit") if self.is_debit_nature else F("credit") - F("debit")
+        running = Window(
+            expression=Sum(signed),
+            order_by=[F(name).asc() for name in self.ORDERING],
+            output_field=DecimalField(max_digits=16, decimal_places=3),
+        )
+
+        return list(
+            qs.order_by(*self.ORDERING)
+            .values(
+                "id",
+                "entry_id",
+                "entry__date",
+                "account__code",
+                "entry__reference",
+                "entry__description",
+                "description",
+                "debit",
+                "credit",
+            )
+            .annotate(running=running)[:limit]
+        )
+
+    def _to_line(self, row: dict, carried: Decimal) -> dict:
+        return {
+            "id": row["id"],
+            "entry_id": row["entry_id"],
+            "entry_number": f"JE-{row['entry_id']}",
+            "account_code": row["account__code"],
+            "date": row["entry__date"],
+            "reference": row["entry__reference"],
+            "description": row["description"] or row["entry__description"],
+            "debit": row["debit"],
+            "credit": row["credit"],
+            "balance": carried + (row["running"] or DECIMAL_ZERO),
+        }
+
+    # -----------------------------------------------------------------
+    # Cursor
+    # -----------------------------------------------------------------
+    def _dump_cursor(self, line: dict) -> str:
+        return signing.dumps(
+            {
+                "a": self.account.pk,
+                "d": line["date"].isoformat(),
+                "e": line["entry_id"],
+                "i": line["id"],
+                "b": str(line["balance"]),
+            },
+            salt=LEDGER_CURSOR_SALT,
+            compress=True,
+        )
+
+    def _load_cursor(self, cursor: str):
+        try:
+            data = signing.loads(cursor, salt=LEDGER_CURSOR_SALT)
+            if data["a"] != self.account.pk:
+                return None
+            key = (date.fromisoformat(data["d"]), int(data["e"]), int(data["i"]))
+            return key, Decimal(data["b"])
+        except (signing.BadSignature, KeyError, TypeError, ValueError, ArithmeticError):
+            return None
+
+    # -----------------------------------------------------------------
+    # Public API
+    # -----------------------------------------------------------------
+    def page(self, cursor: str | None = None, *, limit: int = 200) -> LedgerPage:
+        """
+        Return one page of lines. An invalid/foreign cursor restarts from the top.
+        """
+        opening = self.opening_balance()
+        decoded = self._load_cursor(cursor) if cursor else None
+        key, carried = decoded if decoded else (None, opening)
+
+        rows = self._rows_after(key, limit + 1)
+        has_more = len(rows) > limit
+        lines = [self._to_line(row, carried) for row in rows[:limit]]
+
+        return LedgerPage(
+            lines=lines,
+            opening_balance=opening,
+            next_cursor=self._dump_cursor(lines[-1]) if has_more and lines else None,
+            totals=self.period_totals(opening),
+        )
+
+    def iter_lines(self, *, chunk_size: int = 2000) -> Iterator[dict]:
+        """
+        Stream every line of the period, chunk by chunk (keyset), with the
+        running balance. Memory is bounded by chunk_size.
+        """
+        key = None
+        carried = self.opening_balance()
+
+        while True:
+            rows = self._rows_after(key, chunk_size)
+            if not rows:
+                return
+
+            line = None
+            for row in rows:
+                line = self._to_line(row, carried)
+                yield line
+
+            carried = line["balance"]
+            key = (line["date"], line["entry_id"], line["id"])
+            if len(rows) < chunk_size:
+                return
+
+
+# =====================================================================
+# Trial balance tree (roll-up along the materialized path)
+# =====================================================================
+
+@dataclass
+class TrialBalanceNode:
+    """
+    One account in the tree trial balance.
+    debit/credit are the account's own postings; total_* include descendants.
+    """
+    account_id: int
+    parent_id: int | None
+    code: str
+    name: str
+    type: str
+    level: int
+    path: str
+    debit: Decimal = DECIMAL_ZERO
+    credit: Decimal = DECIMAL_ZERO
+    total_debit: Decimal = DECIMAL_ZERO
+    total_credit: Decimal = DECIMAL_ZERO
+    has_children: bool = False
+
+    @property
+    def is_group(self) -> bool:
+        return self.has_children
+
+    @property
+    def type_label(self) -> str:
+        return Account.Type(self.type).label if self.type in Account.Type.values else self.type
+
+
+def build_trial_balance_tree(account_totals: dict[int, tuple[Decimal, Decimal]]) -> list[TrialBalanceNode]:
+    """
+    Roll (debit, credit) per account up to every ancestor.
+
+    The chart is read once in path order; ancestors are found from the
+    codes in each path, so no recursive walk over `parent` is needed.
+    Nodes with nothing in their subtree are dropped.
+    """
+    nodes: dict[str, TrialBalanceNode] = {}
+    for row in Account.objects.tree_order().values("pk", "parent_id", "code", "name", "type", "level", "path"):
+        nodes[row["code"]] = TrialBalanceNode(
+            account_id=row["pk"],
+            parent_id=row["parent_id"],
+            code=row["code"],
+            name=row["name"],
+            type=row["type"],
+            level=row["level"],
+            path=row["path"],
+        )
+
+    by_id = {node.account_id: node for node in nodes.values()}
+    for node in by_id.values():
+        parent = by_id.get(node.parent_id)
+        if parent is not None:
+            parent.has_children = True
+
+    for account_id, (dr, cr) in account_totals.items():
+        node = by_id.get(account_id)
+        if node is None:
+            continue
+        node.debit += dr
+        node.credit += cr
+        for code in node.path.split(Account.PATH_SEPARATOR):
+            ancestor = nodes.get(code)
+            if ancestor is not None:
+                ancestor.total_debit += dr
+                ancestor.total_credit += cr
+
+    return [node for node in nodes.values() if node.total_debit or node.total_credit]
+
+
+# =====================================================================
+# Comparative trial balance (periods pivoted into columns)
+# =====================================================================
+
+@dataclass
+class ComparativeTrialBalanceRow:
+    account_id: int
+    code: str
+    name: str
+    type: str
+    # one (debit, credit) pair per column
+    pairs: list[tuple[Decimal, Decimal]]
+
+    @property
+    def balances(self) -> list[Decimal]:
+        return [dr - cr for dr, cr in self.pairs]
+
+
+@dataclass
+class ComparativeTrialBalance:
+    columns: list
+    rows: list[ComparativeTrialBalanceRow]
+    totals: list[tuple[Decimal, Decimal]]
+    from_cache: bool = False
+
+    @property
+    def is_balanced(self) -> bool:
+        return all(dr == cr for dr, cr in self.totals)
+
+
+def compute_comparative_trial_balance(columns) -> ComparativeTrialBalance:
+    """
+    Debit / credit per account for every column (StatementColumn: whole
+    months) from one `GROUP BY account, period` over AccountPeriodBalance —
+    the monthly roll-up of posted lines — pivoted into columns in Python.
+    Year-end closing entries are subtracted (get_closing_entry_totals) so a
+    closed year's last month shows its pre-closing balances.
+    """
+    span = Q()
+    for column in columns:
+        span |= Q(period__gte=column.date_from, period__lte=column.date_to)
+
+    width = len(columns)
+    rows: dict[int, ComparativeTrialBalanceRow] = {}
+    grouped = (
+        AccountPeriodBalance.objects.filter(span)
+        .values("account_id", "account__code", "account__name", "account__type", "period")
+        .annotate(dr=Sum("debit"), cr=Sum("credit"))
+        .order_by("account__code", "period")
+    )
+    for item in grouped:
+        row = rows.get(item["account_id"])
+        if row is None:
+            row = rows[item["account_id"]] = ComparativeTrialBalanceRow(
+                account_id=item["account_id"],
+                code=item["account__code"],
+                name=item["account__name"],
+                type=item["account__type"],
+                pairs=[(DECIMAL_ZERO, DECIMAL_ZERO)] * width,
+            )
+        for i, column in enumerate(columns):
+            if column.date_from <= item["period"] <= column.date_to:
+                dr, cr = row.pairs[i]
+                row.pairs[i] = (dr + (item["dr"] or DECIMAL_ZERO), cr + (item["cr"] or DECIMAL_ZERO))
+
+    for (account_id, period), (closing_dr, closing_cr) in get_closing_entry_totals(span).items():
+        row = rows.get(account_id)
+        if row is None:
+            continue
+        for i, column in enumerate(columns):
+            if column.date_from <= period <= column.date_to:
+                dr, cr = row.pairs[i]
+                row.pairs[i] = (dr - closing_dr, cr - closing_cr)
+
+    result_rows = [row for row in rows.values() if any(dr or cr for dr, cr in row.pairs)]
+    totals = [
+        (
+            sum((row.pairs[i][0] for row in result_rows), DECIMAL_ZERO),
+            sum((row.pairs[i][1] for row in result_rows), DECIMAL_ZERO),
+        )
+        for i in range(width)
+    ]
+    return ComparativeTrialBalance(columns=list(columns), rows=result_rows, totals=totals)
+
+
+def get_comparative_trial_balance(columns) -> ComparativeTrialBalance:
+    """
+    Cached per (columns, ledger version). Posting / unposting, a balance
+    rebuild or a chart change bumps the ledger version.
+    """
+    filter_key = ",".join(f"{c.date_from:%Y%m%d}-{c.date_to:%Y%m%d}" for c in columns)
+    key = f"accounting:trial_balance:{ledger_version()}:{filter_key}"
+
+    report = cache.get(key)
+    if report is not None:
+        report.from_cache = True
+        return report
+
+    report = compute_comparative_trial_balance(columns)
+    cache.set(key, report, TRIAL_BALANCE_CACHE_TIMEOUT)
+    return report
+
+
+# =====================================================================
+# Dashboard metrics (one aggregate per table, short-TTL snapshot)
+# =====================================================================
+
+def _money_sum(field_name: str, condition: Q):
+    return Coalesce(
+        Sum(field_name, filter=condition),
+        Value(DECIMAL_ZERO),
+        output_field=DecimalField(max_digits=16, decimal_places=3),
+    )
+
+
+def compute_dashboard_metrics() -> dict:
+    """
+    Build the dashboard numbers with one conditional aggregate per table
+    plus the short "recent" lists (related rows pre-joined, so the
+    snapshot can be cached and rendered without extra queries).
+    """
+    started = time.perf_counter()
+
+    sales = Q(type=Invoice.InvoiceType.SALES)
+    purchase = Q(type=Invoice.InvoiceType.PURCHASE)
+    metrics = Invoice.objects.aggregate(
+        invoices_count=Count("pk"),
+        sales_invoice_count=Count("pk", filter=sales),
+        purchase_invoice_count=Count("pk", filter=purchase),
+        sales_total_amount=_money_sum("total_amount", sales),
+        purchase_total_amount=_money_sum("total_amount", purchase),
+    )
+    metrics.update(
+        Payment.objects.aggregate(
+            payments_receipt_total=_money_sum("amount", Q(type=Payment.Type.RECEIPT)),
+            payments_payment_total=_money_sum("amount", Q(type=Payment.Type.PAYMENT)),
+        )
+    )
+    metrics["unposted_entries"] = JournalEntry.objects.unposted().count()
+
+    metrics.update({
+        "recent_invoices": list(Invoice.objects.select_related("customer").order_by("-created_at")[:5]),
+        "recent_sales_invoices": list(
+            Invoice.objects.filter(sales).select_related("customer").order_by("-id")[:5]
+        ),
+        "recent_payments": list(Payment.objects.select_related("contact").order_by("-date")[:5]),
+        "key_accounts": list(Account.objects.filter(parent__isnull=True)[:5]),
+    })
+
+    metrics["dashboard_computed_at"] = timezone.now()
+    metrics["dashboard_compute_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return metrics
+
+
+def get_dashboard_metrics() -> dict:
+    """
+    Cached snapshot of compute_dashboard_metrics() (DASHBOARD_CACHE_TIMEOUT).
+    "dashboard_from_cache" tells whether this call hit the cache.
+    """
+    metrics = cache.get(DASHBOARD_CACHE_KEY)
+    if metrics is None:
+        metrics = compute_dashboard_metrics()
+        cache.set(DASHBOARD_CACHE_KEY, metrics, DASHBOARD_CACHE_TIMEOUT)
+        return {**metrics, "dashboard_from_cache": False}
+    return {**metrics, "dashboard_from_cache": True}
+
+
+def invalidate_dashboard_metrics() -> None:
+    cache.delete(DASHBOARD_CACHE_KEY)
+
+
+# =====================================================================
+# Aged receivables / payables (one grouped query, versioned cache)
+# =====================================================================
+
+AGING_RECEIVABLE = "receivable"
+AGING_PAYABLE = "payable"
+
+AGING_KIND_INVOICE_TYPES = {
+    AGING_RECEIVABLE: Invoice.InvoiceType.SALES,
+    AGING_PAYABLE: Invoice.InvoiceType.PURCHASE,
+}
+
+# (key, days overdue from, days overdue to) — None = open-ended
+AGING_BUCKETS = (
+    ("current", None, 0),
+    ("days_1_30", 1, 30),
+    ("days_31_60", 31, 60),
+    ("days_61_90", 61, 90),
+    ("days_over_90", 91, None),
+)
+AGING_BUCKET_KEYS = tuple(key for key, _lo, _hi in AGING_BUCKETS)
+
+
+@dataclass
+class AgingRow:
+    """
+    Open balance of one contact split by how many days it is overdue.
+    """
+    contact_id: int
+    contact_name: str
+    buckets: dict
+    total: Decimal
+    invoices_count: int = 0
+
+    @property
+    def bucket_values(self) -> list[Decimal]:
+        return [self.buckets[key] for key in AGING_BUCKET_KEYS]
+
+
+@dataclass
+class AgingReport:
+    kind: str
+    as_of: date
+    rows: list[AgingRow]
+    totals: dict
+    total: Decimal
+    computed_at: object = None
+    from_cache: bool = False
+
+    @property
+    def total_values(self) -> list[Decimal]:
+        return [self.totals[key] for key in AGING_BUCKET_KEYS]
+
+
+def invalidate_aging_reports() -> None:
+    """
+    Bump the aging cache version, so every cached report — whatever its
+    kind / as-of date — is recomputed on next access.
+    """
+    bump_cache_version(AGING_CACHE_VERSION_KEY)
+
+
+def _aging_bucket_condition(as_of: date, days_from: int | None, days_to: int | None) -> Q:
+    """
+    days overdue = as_of - due_ref; thresholds are plain dates computed here,
+    so the database only compares dates (no date arithmetic per row).
+    """
+    condition = Q()
+    if days_from is not None:
+        condition &= Q(due_ref__lte=as_of - timedelta(days=days_from))
+    if days_to is not None:
+        condition &= Q(due_ref__gte=as_of - timedelta(days=days_to))
+    return condition
+
+
+def aging_queryset(kind: str = AGING_RECEIVABLE, *, as_of: date | None = None):
+    """
+    Invoices of `kind` issued up to `as_of`, annotated with:
+      - allocated_as_of: sum of reconciliations whose payment is dated <= as_of
+      - open_amount: total_amount - allocated_as_of
+      - due_ref: due_date, or issued_at when no due date is set
+    and limited to those still open at that date.
+    """
+    as_of = as_of or timezone.localdate()
+    money = DecimalField(max_digits=16, decimal_places=3)
+
+    allocated = (
+        PaymentReconciliation.objects.filter(invoice=OuterRef("pk"), payment__date__lte=as_of)
+        .order_by()
+        .values("invoice")
+        .annotate(total=Sum("amount"))
+        .values("total")
+    )
+
+    return (
+        Invoice.objects.filter(
+            type=AGING_KIND_INVOICE_TYPES[kind],
+            issued_at__lte=as_of,
+        )
+        .exclude(status__in=[Invoice.Status.DRAFT, Invoice.Status.CANCELLED])
+        .annotate(
+            allocated_as_of=Coalesce(Subquery(allocated, output_field=money), Value(DECIMAL_ZERO), output_field=money),
+            open_amount=F("total_amount") - F("allocated_as_of"),
+            due_ref=Coalesce("due_date", "issued_at"),
+        )
+        .filter(open_amount__gt=0)
+    )
+
+
+def compute_aging_report(kind: str = AGING_RECEIVABLE, *, as_of: date | None = None) -> AgingReport:
+    """
+    Bucket open balances per contact in a single GROUP BY:
+    every bucket is a conditional SUM over the same annotated invoices.
+    """
+    if kind not in AGING_KIND_INVOICE_TYPES:
+        raise ValueError(f"Unknown aging kind: {kind}")
+    as_of = as_of or timezone.localdate()
+
+    aggregates = {
+        key: _money_sum("open_amount", _aging_bucket_condition(as_of, lo, hi))
+        for key, lo, hi in AGING_BUCKETS
+    }
+    grouped = (
+        aging_queryset(kind, as_of=as_of)
+        .order_by()
+        .values("customer_id", "customer__name")
+        .annotate(
+            total=_money_sum("open_amount", Q()),
+            invoices_count=Count("pk"),
+            **aggregates,
+        )
+        .order_by("customer__name", "customer_id")
+    )
+
+    rows = []
+    totals = {key: DECIMAL_ZERO for key in AGING_BUCKET_KEYS}
+    for item in grouped:
+        buckets = {key: item[key] for key in AGING_BUCKET_KEYS}
+        for key, value in buckets.items():
+            totals[key] += value
+        rows.append(AgingRow(
+            contact_id=item["customer_id"],
+            contact_name=item["customer__name"],
+            buckets=buckets,
+            total=item["total"],
+            invoices_count=item["invoices_count"],
+        ))
+
+    return AgingReport(
+        kind=kind,
+        as_of=as_of,
+        rows=rows,
+        totals=totals,
+        total=sum(totals.values(), DECIMAL_ZERO),
+        computed_at=timezone.now(),
+    )
+
+
+def get_aging_report(kind: str = AGING_RECEIVABLE, *, as_of: date | None = None) -> AgingReport:
+    """
+    Cached compute_aging_report(), keyed by (kind, as_of, version).
+    Any invoice / payment / reconciliation change bumps the version.
+    """
+    as_of = as_of or timezone.localdate()
+    key = f"accounting:aging:{get_cache_version(AGING_CACHE_VERSION_KEY)}:{kind}:{as_of.isoformat()}"
+
+    report = cache.get(key)
+    if report is not None:
+        report.from_cache = True
+        return report
+
+    report = compute_aging_report(kind, as_of=as_of)
+    cache.set(key, report, AGING_CACHE_TIMEOUT)
+    return report
@@ -1,11 +1,16 @@
 # accounting/services.py
 
-from datetime import timedelta
+import uuid
+from collections import defaultdict
+from datetime import date, timedelta
 from decimal import Decimal, ROUND_HALF_UP
 from typing import Dict
 
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncMonth
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from openpyxl import load_workbook
@@ -16,6 +21,7 @@ from .models import (
     JournalEntry,
     JournalLine,
     Account,
+    AccountPeriodBalance,
     Journal, Payment, Invoice, PaymentReconciliation,
 )
 
@@ -23,6 +29,45 @@ from .models import (
 DECIMAL_ZERO = Decimal("0.000")
 QUANTIZER_3DP = Decimal("0.001")
 
+# Bumped whenever posted balances (or the chart itself) change
+LEDGER_VERSION_KEY = "accounting:ledger:version"
+
+
+# =====================================================================
+# Cache versions
+# =====================================================================
+
+def get_cache_version(key: str) -> str:
+    """
+    Current value of a version key (created on first use). Cached results
+    embed it in their own key, so bumping it invalidates all of them at once.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(key: str) -> None:
+    """
+    Bump now and again on commit, so a reader that cached a result computed
+    inside the still-open transaction does not keep it.
+    """
+    def bump():
+        cache.set(key, uuid.uuid4().hex, timeout=None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def ledger_version() -> str:
+    return get_cache_version(LEDGER_VERSION_KEY)
+
+
+def bump_ledger_version() -> None:
+    bump_cache_version(LEDGER_VERSION_KEY)
+
 
 # =====================================================================
 # Journal Entry Services
@@ -100,10 +145,457 @@ def build_lines_from_formset(line_formset):
     return lines, total_debit, total_credit
 
 
+JOURNAL_LINE_FIELDS = ("account_id", "description", "debit", "credit", "order")
+BALANCE_TOLERANCE = Decimal("0.001")
+
+
+def _journal_line_from_data(entry: JournalEntry, index: int, data: dict) -> JournalLine:
+    account = data.get("account")
+    line = JournalLine(
+        entry=entry,
+        account_id=account.pk if account is not None else data.get("account_id"),
+        description=data.get("description") or "",
+        debit=data.get("debit") or DECIMAL_ZERO,
+        credit=data.get("credit") or DECIMAL_ZERO,
+        order=data.get("order", index),
+    )
+    if not line.account_id:
+        raise ValidationError(
+            _("السطر رقم %(row)d: يوجد مبلغ بدون تحديد الحساب.") % {"row": index + 1}
+        )
+    if line.debit < 0 or line.credit < 0 or (line.debit > 0 and line.credit > 0) or not (line.debit or line.credit):
+        raise ValidationError(
+            _("السطر رقم %(row)d: يجب أن يحتوي السطر على مبلغ مدين أو دائن موجب (وليس كليهما).")
+            % {"row": index + 1}
+        )
+    return line
+
+
+@transaction.atomic
+def write_journal_lines(entry: JournalEntry, lines) -> dict:
+    """
+    Validate journal lines in memory and write them in bulk.
+
+    `lines` are dicts as returned by build_lines_from_formset()
+    (account or account_id, description, debit, credit, order).
+
+      - Every line is checked (account, one positive side) and the entry
+        must balance, before anything is written.
+      - A new entry gets all its lines in one bulk_create.
+      - An existing entry is updated as a diff by position: changed lines
+        are bulk_update'd in place (ids stay stable), extra lines are
+        bulk_create'd and surplus lines deleted in one query.
+
+    Returns:
+        {"created": int, "updated": int, "deleted": int}
+    """
+    new_lines = [_journal_line_from_data(entry, i, data) for i, data in enumerate(lines)]
+    if not new_lines:
+        raise ValidationError(_("يجب إدخال سطر واحد على الأقل."))
+
+    dr = sum((line.debit for line in new_lines), DECIMAL_ZERO)
+    cr = sum((line.credit for line in new_lines), DECIMAL_ZERO)
+    if abs(dr - cr) > BALANCE_TOLERANCE:
+        raise ValidationError(
+            _("القيد غير متوازن.\nالمدين: %(dr)s | الدائن: %(cr)s | الفرق: %(diff)s")
+            % {"dr": dr, "cr": cr, "diff": dr - cr}
+        )
+
+    existing = list(entry.lines.order_by("order", "id")) if entry.pk else []
+
+    to_update = []
+    for current, line in zip(existing, new_lines):
+        if any(getattr(current, name) != getattr(line, name) for name in JOURNAL_LINE_FIELDS):
+            for name in JOURNAL_LINE_FIELDS:
+                setattr(current, name, getattr(line, name))
+            to_update.append(current)
+    to_create = new_lines[len(existing):]
+    surplus = [line.pk for line in existing[len(new_lines):]]
+
+    if surplus:
+        JournalLine.objects.filter(pk__in=surplus).delete()
+    if to_update:
+        JournalLine.objects.bulk_update(to_update, JOURNAL_LINE_FIELDS, batch_size=500)
+    if to_create:
+        JournalLine.objects.bulk_create(to_create, batch_size=1000)
+
+    return {"created": len(to_create), "updated": len(to_update), "deleted": len(surplus)}
+
+
+@transaction.atomic
+def post_journal_entry(entry: JournalEntry, *, user=None) -> JournalEntry:
+    """
+    Mark a journal entry as posted and add its lines to the period balances.
+    Posting an already posted entry is a no-op.
+    """
+    entry = JournalEntry.objects.select_for_update().get(pk=entry.pk)
+    if entry.posted:
+        return entry
+
+    _ensure_fiscal_year_open(entry.fiscal_year_id)
+    if not entry.is_balanced:
+        raise ValidationError(_("القيد غير متوازن."))
+
+    entry.posted = True
+    entry.posted_at = timezone.now()
+    entry.posted_by = user
+    entry.save(update_fields=["posted", "posted_at", "posted_by"])
+
+    apply_entry_to_balances(entry)
+    return entry
+
+
+@transaction.atomic
+def unpost_journal_entry(entry: JournalEntry) -> JournalEntry:
+    """
+    Mark a journal entry as draft again and remove its lines from the period balances.
+    Unposting a draft entry is a no-op.
+    """
+    entry = JournalEntry.objects.select_for_update().get(pk=entry.pk)
+    if not entry.posted:
+        return entry
+
+    _ensure_fiscal_year_open(entry.fiscal_year_id)
+    entry.posted = False
+    entry.save(update_fields=["posted"])
+
+    apply_entry_to_balances(entry, sign=-1)
+    return entry
+
+
+def _ensure_fiscal_year_open(fiscal_year_id) -> None:
+    """
+    Closed years are frozen: their entries and period balances never change.
+
+    is_closed is read from the database, not from FiscalYear.objects.index():
+    a year closed a moment ago (in any worker) must refuse postings at once.
+    """
+    if fiscal_year_id and FiscalYear.objects.filter(pk=fiscal_year_id, is_closed=True).exists():
+        raise ValidationError(_("السنة المالية لهذا القيد مقفلة."))
+
+
+# =====================================================================
+# Account Period Balances
+# =====================================================================
+
+def month_start(value: date) -> date:
+    return value.replace(day=1)
+
+
+def next_month_start(value: date) -> date:
+    if value.month == 12:
+        return date(value.year + 1, 1, 1)
+    return date(value.year, value.month + 1, 1)
+
+
+def _as_date(value) -> date:
+    """
+    JournalEntry.date defaults to timezone.now, so unsaved/unrefreshed
+    instances may still hold a datetime. Normalize it like the DB would.
+    """
+    return JournalEntry._meta.get_field("date").to_python(value)
+
+
+def _upsert_period_balances(deltas: dict) -> None:
+    """
+    Add debit/credit deltas into AccountPeriodBalance rows.
+
+    deltas:
+        {(account_id, fiscal_year_id, period): (debit, credit), ...}
+
+    Existing rows are locked in one query, missing rows are bulk-created.
+    Must be called inside a transaction.
+    """
+    deltas = {k: v for k, v in deltas.items() if v[0] or v[1]}
+    if not deltas:
+        return
+    for fiscal_year_id in {key[1] for key in deltas}:
+        _ensure_fiscal_year_open(fiscal_year_id)
+
+    account_ids = {key[0] for key in deltas}
+    periods = {key[2] for key in deltas}
+
+    existing = {
+        (row.account_id, row.fiscal_year_id, row.period): row
+        for row in AccountPeriodBalance.objects.select_for_update()
+        .filter(account_id__in=account_ids, period__in=periods)
+        .order_by("pk")
+    }
+
+    now = timezone.now()
+    to_create: list[AccountPeriodBalance] = []
+    to_update: list[AccountPeriodBalance] = []
+
+    for (account_id, fiscal_year_id, period), (dr, cr) in deltas.items():
+        row = existing.get((account_id, fiscal_year_id, period))
+        if row is None:
+            to_create.append(
+                AccountPeriodBalance(
+                    account_id=account_id,
+                    fiscal_year_id=fiscal_year_id,
+                    period=period,
+                    debit=dr,
+                    credit=cr,
+                )
+            )
+        else:
+            row.debit += dr
+            row.credit += cr
+            row.updated_at = now
+            to_update.append(row)
+
+    if to_create:
+        AccountPeriodBalance.objects.bulk_create(to_create)
+    if to_update:
+        AccountPeriodBalance.objects.bulk_update(to_update, ["debit", "credit", "updated_at"])
+    bump_ledger_version()
+
+
+def _entry_balance_deltas(entry: JournalEntry, *, sign: int = 1) -> dict:
+    period = month_start(_as_date(entry.date))
+    rows = (
+        JournalLine.objects.filter(entry=entry)
+        .values("account_id")
+        .annotate(dr=Sum("debit"), cr=Sum("credit"))
+        .order_by()
+    )
+    return {
+        (row["account_id"], entry.fiscal_year_id, period): (
+            (row["dr"] or DECIMAL_ZERO) * sign,
+            (row["cr"] or DECIMAL_ZERO) * sign,
+        )
+        for row in rows
+    }
+
+
+def _lines_balance_deltas(entries, lines, *, sign: int = 1) -> dict:
+    """
+    Same as _entry_balance_deltas but for entries/lines already in memory
+    (e.g. right after bulk_create), so no query is needed.
+    """
+    entries_by_id = {entry.pk: entry for entry in entries}
+    deltas = defaultdict(lambda: (DECIMAL_ZERO, DECIMAL_ZERO))
+    for line in lines:
+        entry = entries_by_id[line.entry_id]
+        key = (line.account_id, entry.fiscal_year_id, month_start(_as_date(entry.date)))
+        dr, cr = deltas[key]
+        deltas[key] = (dr + (line.debit or DECIMAL_ZERO) * sign, cr + (line.credit or DECIMAL_ZERO) * sign)
+    return dict(deltas)
+
+
+def apply_entry_to_balances(entry: JournalEntry, *, sign: int = 1) -> None:
+    """
+    Add (sign=1) or remove (sign=-1) a journal entry's lines from the period balances.
+    """
+    with transaction.atomic():
+        _upsert_period_balances(_entry_balance_deltas(entry, sign=sign))
+
+
+@transaction.atomic
+def rebuild_account_balances(*, fiscal_year: FiscalYear | None = None) -> int:
+    """
+    Recompute AccountPeriodBalance from posted journal lines
+    (all years, or only `fiscal_year` if given).
+    Closed years keep their frozen snapshot and are skipped.
+
+    Returns:
+        int: number of balance rows written.
+    """
+    lines = JournalLine.objects.filter(entry__posted=True).exclude(entry__fiscal_year__is_closed=True)
+    balances = AccountPeriodBalance.objects.exclude(fiscal_year__is_closed=True)
+    if fiscal_year is not None:
+        lines = lines.filter(entry__fiscal_year=fiscal_year)
+        balances = balances.filter(fiscal_year=fiscal_year)
+
+    balances.delete()
+
+    rows = (
+        lines.annotate(period=TruncMonth("entry__date"))
+        .values("account_id", "entry__fiscal_year_id", "period")
+        .annotate(dr=Sum("debit"), cr=Sum("credit"))
+        .order_by()
+    )
+
+    objs = [
+        AccountPeriodBalance(
+            account_id=row["account_id"],
+            fiscal_year_id=row["entry__fiscal_year_id"],
+            period=row["period"],
+            debit=row["dr"] or DECIMAL_ZERO,
+            credit=row["cr"] or DECIMAL_ZERO,
+        )
+        for row in rows.iterator()
+    ]
+    AccountPeriodBalance.objects.bulk_create(objs, batch_size=1000)
+    bump_ledger_version()
+    return len(objs)
+
+
+def _split_by_whole_months(date_from: date | None, date_to: date | None):
+    """
+    Split [date_from, date_to] into:
+      - a whole-month window [full_from, full_to) readable from the balances table
+        (None bounds mean open-ended; (False, False) means no whole month)
+      - partial-month edge ranges that must be read from raw lines.
+    """
+    full_from = month_start(date_from) if date_from else None
+    if date_from and date_from.day != 1:
+        full_from = next_month_start(date_from)
+
+    full_to = next_month_start(date_to) if date_to else None
+    if date_to and next_month_start(date_to) - timedelta(days=1) != date_to:
+        full_to = month_start(date_to)
+
+    if full_from and full_to and full_from >= full_to:
+        return False, False, [(date_from, date_to)]
+
+    edges = []
+    if date_from and date_from.day != 1:
+        edges.append((date_from, full_from - timedelta(days=1)))
+    if date_to and full_to != next_month_start(date_to):
+        edges.append((full_to, date_to))
+    return full_from, full_to, edges
+
+
+def get_account_totals(
+    *,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    fiscal_year: FiscalYear | None = None,
+    account_ids=None,
+    subtree: Account | None = None,
+) -> dict[int, tuple[Decimal, Decimal]]:
+    """
+    Posted (debit, credit) totals per account_id for [date_from, date_to].
+
+    Whole months come from AccountPeriodBalance; only partial months at the
+    edges of the range are aggregated from JournalLine.
+    `subtree` limits the result to an account and its descendants
+    (prefix filter on the materialized path).
+
+    Without date_from (and fiscal_year) the sum starts after the last closed
+    year that was carried forward: its opening entry already holds all
+    earlier history, see close_fiscal_year().
+    """
+    if date_from is None and fiscal_year is None:
+        date_from = FiscalYear.objects.index().carry_forward_start(date_to)
+
+    totals: dict[int, list[Decimal]] = defaultdict(lambda: [DECIMAL_ZERO, DECIMAL_ZERO])
+    full_from, full_to, edges = _split_by_whole_months(date_from, date_to)
+
+    if full_from is not False:
+        balances = AccountPeriodBalance.objects.all()
+        if fiscal_year is not None:
+            balances = balances.filter(fiscal_year=fiscal_year)
+        if account_ids is not None:
+            balances = balances.filter(account_id__in=account_ids)
+        if subtree is not None:
+            balances = balances.filter(account__path__startswith=subtree.path)
+        if full_from:
+            balances = balances.filter(period__gte=full_from)
+        if full_to:
+            balances = balances.filter(period__lt=full_to)
+
+        for row in balances.values("account_id").annotate(dr=Sum("debit"), cr=Sum("credit")).order_by():
+            totals[row["account_id"]][0] += row["dr"] or DECIMAL_ZERO
+            totals[row["account_id"]][1] += row["cr"] or DECIMAL_ZERO
+
+    for edge_from, edge_to in edges:
+        lines = JournalLine.objects.posted().within_period(edge_from, edge_to)
+        if fiscal_year is not None:
+            lines = lines.filter(entry__fiscal_year=fiscal_year)
+        if account_ids is not None:
+            lines = lines.filter(account_id__in=account_ids)
+        if subtree is not None:
+            lines = lines.filter(account__path__startswith=subtree.path)
+
+        for row in lines.values("account_id").annotate(dr=Sum("debit"), cr=Sum("credit")).order_by():
+            totals[row["account_id"]][0] += row["dr"] or DECIMAL_ZERO
+            totals[row["account_id"]][1] += row["cr"] or DECIMAL_ZERO
+
+    return {account_id: (dr, cr) for account_id, (dr, cr) in totals.items()}
+
+
+def get_closing_entry_totals(span: Q | None = None) -> dict[tuple[int, date], tuple[Decimal, Decimal]]:
+    """
+    (debit, credit) of the year-end closing entries per (account_id, period),
+    optionally limited by a Q on `period`.
+
+    Closing entries stay in AccountPeriodBalance (the balance sheet, the
+    ledger and the next carry-forward need them); profit-and-loss reporting
+    subtracts these totals so a closed year's last month keeps its result.
+    """
+    lines = (
+        JournalLine.objects.filter(
+            entry__in=FiscalYear.objects.filter(closing_entry__isnull=False).values("closing_entry")
+        )
+        .annotate(period=TruncMonth("entry__date"))
+    )
+    if span is not None:
+        lines = lines.filter(span)
+    return {
+        (row["account_id"], row["period"]): (row["dr"] or DECIMAL_ZERO, row["cr"] or DECIMAL_ZERO)
+        for row in lines.values("account_id", "period").annotate(dr=Sum("debit"), cr=Sum("credit")).order_by()
+    }
+
+
+def get_subtree_totals(account: Account, **filters) -> tuple[Decimal, Decimal]:
+    """
+    (debit, credit) of an account including all its descendants.
+    """
+    dr = cr = DECIMAL_ZERO
+    for line_dr, line_cr in get_account_totals(subtree=account, **filters).values():
+        dr += line_dr
+        cr += line_cr
+    return dr, cr
+
+
 # =====================================================================
 # Chart of Accounts Services
 # =====================================================================
 
+def rebuild_account_paths() -> int:
+    """
+    Recompute Account.path / level for the whole chart in memory and write
+    only the rows that changed (bulk_update). A parent cycle (bad data) is
+    cut by treating the account where it is detected as a root.
+
+    Returns:
+        int: number of accounts whose path changed.
+    """
+    nodes = {
+        pk: (code, parent_id)
+        for pk, code, parent_id in Account.objects.values_list("pk", "code", "parent_id")
+    }
+    paths: dict[int, str] = {}
+
+    def resolve(pk: int) -> str:
+        chain = []
+        current = pk
+        while current is not None and current not in paths:
+            if current in chain:
+                break  # cycle
+            chain.append(current)
+            current = nodes[current][1] if nodes[current][1] in nodes else None
+
+        parent_path = paths.get(current, "") if current is not None and current not in chain else ""
+        for node_pk in reversed(chain):
+            parent_path = Account.build_path(nodes[node_pk][0], parent_path)
+            paths[node_pk] = parent_path
+        return paths[pk]
+
+    changed = []
+    for account in Account.objects.only("pk", "path", "level").iterator(chunk_size=CHART_IMPORT_CHUNK_SIZE):
+        path = resolve(account.pk)
+        if account.path != path:
+            account.path = path
+            account.level = Account.level_of(path)
+            changed.append(account)
+
+    Account.objects.bulk_update(changed, ["path", "level"], batch_size=CHART_IMPORT_CHUNK_SIZE)
+    return len(changed)
+
+
 def ensure_default_chart_of_accounts() -> int:
     """
     Create a minimal default chart of accounts if no accounts exist.
@@ -156,11 +648,109 @@ def _parse_bool(value):
     return s in {"1", "true", "yes", "y", "نعم", "صح"}
 
 
+CHART_IMPORT_CHUNK_SIZE = 1000
+
+_CHART_TYPE_MAP = {
+    "asset": Account.Type.ASSET,
+    "liability": Account.Type.LIABILITY,
+    "equity": Account.Type.EQUITY,
+    "revenue": Account.Type.REVENUE,
+    "expense": Account.Type.EXPENSE,
+}
+
+
+def _read_chart_rows(file_obj):
+    """
+    Stream the chart rows from the active sheet (read-only mode, values only).
+
+    Returns:
+        (rows, errors) where rows is a list of dicts keyed by code
+        (a code repeated later in the file overrides the earlier row).
+    """
+    wb = load_workbook(file_obj, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        row_iter = ws.iter_rows(values_only=True)
+
+        # --- header mapping ---
+        header_map: dict[str, int] = {}
+        for idx, raw in enumerate(next(row_iter, None) or ()):
+            if raw is None:
+                continue
+            name = str(raw).strip().lower()
+            if name:
+                header_map[name] = idx
+
+        required = ["code", "name", "type"]
+        missing = [h for h in required if h not in header_map]
+        if missing:
+            raise ValidationError(
+                _("Missing required columns in Excel: %(cols)s")
+                % {"cols": ", ".join(missing)}
+            )
+
+        def cell(values, column):
+            idx = header_map.get(column)
+            if idx is None or idx >= len(values):
+                return None
+            return values[idx]
+
+        rows: dict[str, dict] = {}
+        errors: list[str] = []
+
+        # --- read rows ---
+        for row_idx, values in enumerate(row_iter, start=2):
+            code_val = cell(values, "code")
+            if code_val is None or str(code_val).strip() == "":
+                continue
+
+            code = str(code_val).strip()
+            name = str(cell(values, "name") or "").strip()
+            type_raw = cell(values, "type")
+
+            if not name or not type_raw:
+                continue
+
+            type_str = str(type_raw).strip().lower()
+            if type_str not in _CHART_TYPE_MAP:
+                errors.append(f"Row {row_idx}: invalid type '{type_str}'")
+                continue
+
+            parent_cell = cell(values, "parent_code")
+            parent_code = None
+            if parent_cell is not None:
+                parent_code = str(parent_cell).strip() or None
+
+            try:
+                opening_debit = Decimal(str(cell(values, "opening_debit") or 0))
+                opening_credit = Decimal(str(cell(values, "opening_credit") or 0))
+            except ArithmeticError:
+                errors.append(f"Row {row_idx}: invalid opening balance")
+                continue
+
+            rows[code] = {
+                "row_idx": row_idx,
+                "code": code,
+                "name": name,
+                "type": _CHART_TYPE_MAP[type_str],
+                "parent_code": parent_code,
+                "allow_settlement": _parse_bool(cell(values, "allow_settlement")),
+                "is_active": _parse_bool(cell(values, "is_active")),
+                "opening_debit": opening_debit,
+                "opening_credit": opening_credit,
+            }
+    finally:
+        wb.close()
+
+    return list(rows.values()), errors
+
+
 def import_chart_of_accounts_from_excel(
     file_obj,
     *,
     replace_existing: bool = False,
     fiscal_year: FiscalYear | None = None,
+    dry_run: bool = False,
 ):
     """
     Import chart of accounts from an Excel (.xlsx) file.
@@ -180,190 +770,130 @@ def import_chart_of_accounts_from_excel(
     If opening balances exist and 'fiscal_year' is provided:
       - a single opening JournalEntry is created with balanced lines.
 
+    The sheet is streamed (read-only mode) and all writes are done with
+    bulk_create / bulk_update in chunks; parents are resolved in memory.
+
+    dry_run=True validates everything and returns the diff without opening
+    a write transaction.
+
     Returns:
-        dict: {"created": int, "updated": int, "deactivated": int, "errors": list[str]}
+        dict: {"created": int, "updated": int, "deactivated": int,
+               "errors": list[str], "diff": list[dict], "dry_run": bool}
     """
-    wb = load_workbook(file_obj, data_only=True)
-    ws = wb.active
+    rows, errors = _read_chart_rows(file_obj)
+    seen_codes = {row["code"] for row in rows}
 
-    # --- header mapping ---
-    header_map: dict[str, int] = {}
-    for col in range(1, ws.max_column + 1):
-        raw = ws.cell(row=1, column=col).value
-        if raw is None:
-            continue
-        name = str(raw).strip().lower()
-        if not name:
+    # --- opening balances are validated before any write ---
+    opening_rows = [r for r in rows if r["opening_debit"] > 0 or r["opening_credit"] > 0]
+    if opening_rows:
+        if not fiscal_year:
+            raise ValidationError(
+                _("يجب تحديد سنة مالية لاستيراد الأرصدة الافتتاحية.")
+            )
+        tot_dr = sum((r["opening_debit"] for r in opening_rows), DECIMAL_ZERO)
+        tot_cr = sum((r["opening_credit"] for r in opening_rows), DECIMAL_ZERO)
+        if tot_dr != tot_cr:
+            raise ValidationError(_("القيد الافتتاحي غير متوازن."))
+
+    # --- in-memory diff against current accounts ---
+    existing = {a.code: a for a in Account.objects.all()}
+    code_by_id = {a.pk: a.code for a in existing.values()}
+
+    diff: list[dict] = []
+    new_accounts: list[Account] = []
+    changed_accounts: list[Account] = []
+    parent_codes: dict[str, str | None] = {}
+
+    for row in rows:
+        code = row["code"]
+        parent_code = row["parent_code"]
+        if parent_code == code or (parent_code not in seen_codes and parent_code not in existing):
+            parent_code = None
+        parent_codes[code] = parent_code
+
+        values = {"name": row["name"], "type": row["type"]}
+        if row["allow_settlement"] is not None:
+            values["allow_settlement"] = row["allow_settlement"]
+        if row["is_active"] is not None:
+            values["is_active"] = row["is_active"]
+
+        acc = existing.get(code)
+        if acc is None:
+            new_accounts.append(Account(code=code, **values))
+            diff.append({"code": code, "action": "create", "changes": {**values, "parent": parent_code}})
             continue
-        header_map[name] = col
-
-    required = ["code", "name", "type"]
-    missing = [h for h in required if h not in header_map]
-    if missing:
-        raise ValidationError(
-            _("Missing required columns in Excel: %(cols)s")
-            % {"cols": ", ".join(missing)}
-        )
 
-    rows: list[dict] = []
-    seen_codes: set[str] = set()
-    errors: list[str] = []
-
-    type_map = {
-        "asset": Account.Type.ASSET,
-        "liability": Account.Type.LIABILITY,
-        "equity": Account.Type.EQUITY,
-        "revenue": Account.Type.REVENUE,
-        "expense": Account.Type.EXPENSE,
+        changes = {
+            field: (getattr(acc, field), value)
+            for field, value in values.items()
+            if getattr(acc, field) != value
+        }
+        current_parent = code_by_id.get(acc.parent_id)
+        if current_parent != parent_code:
+            changes["parent"] = (current_parent, parent_code)
+
+        if changes:
+            for field, value in values.items():
+                setattr(acc, field, value)
+            changed_accounts.append(acc)
+            diff.append({"code": code, "action": "update", "changes": changes})
+
+    deactivate_qs = Account.objects.none()
+    if replace_existing:
+        deactivate_qs = Account.objects.exclude(code__in=seen_codes).filter(is_active=True)
+
+    result = {
+        "created": len(new_accounts),
+        "updated": len(changed_accounts),
+        "deactivated": 0,
+        "errors": errors,
+        "diff": diff,
+        "dry_run": dry_run,
     }
 
-    # --- read rows ---
-    for row_idx in range(2, ws.max_row + 1):
-        code_val = ws.cell(row=row_idx, column=header_map["code"]).value
-        if code_val is None or str(code_val).strip() == "":
-            continue
-
-        code = str(code_val).strip()
-        name = str(
-            ws.cell(row=row_idx, column=header_map["name"]).value or ""
-        ).strip()
-        type_raw = ws.cell(row=row_idx, column=header_map["type"]).value
-
-        if not name or not type_raw:
-            continue
-
-        type_str = str(type_raw).strip().lower()
-        if type_str not in type_map:
-            errors.append(f"Row {row_idx}: invalid type '{type_str}'")
-            continue
-
-        parent_code = None
-        if "parent_code" in header_map:
-            parent_cell = ws.cell(
-                row=row_idx,
-                column=header_map["parent_code"],
-            ).value
-            if parent_cell is not None:
-                parent_code = str(parent_cell).strip() or None
-
-        allow_settlement = None
-        if "allow_settlement" in header_map:
-            val = ws.cell(
-                row=row_idx,
-                column=header_map["allow_settlement"],
-            ).value
-            allow_settlement = _parse_bool(val)
-
-        is_active = None
-        if "is_active" in header_map:
-            val = ws.cell(
-                row=row_idx,
-                column=header_map["is_active"],
-            ).value
-            is_active = _parse_bool(val)
-
-        opening_debit = DECIMAL_ZERO
-        opening_credit = DECIMAL_ZERO
-        if "opening_debit" in header_map:
-            val = ws.cell(
-                row=row_idx,
-                column=header_map["opening_debit"],
-            ).value
-            if val:
-                opening_debit = Decimal(str(val))
-        if "opening_credit" in header_map:
-            val = ws.cell(
-                row=row_idx,
-                column=header_map["opening_credit"],
-            ).value
-            if val:
-                opening_credit = Decimal(str(val))
-
-        rows.append(
-            {
-                "row_idx": row_idx,
-                "code": code,
-                "name": name,
-                "type": type_map[type_str],
-                "parent_code": parent_code,
-                "allow_settlement": allow_settlement,
-                "is_active": is_active,
-                "opening_debit": opening_debit,
-                "opening_credit": opening_credit,
-            }
-        )
-        seen_codes.add(code)
-
-    created = 0
-    updated = 0
-    deactivated = 0
+    if dry_run:
+        result["deactivated"] = deactivate_qs.count()
+        return result
 
     with transaction.atomic():
-        accounts_by_code = {a.code: a for a in Account.objects.all()}
-
-        # 1) Create / Update accounts
-        for row in rows:
-            code = row["code"]
-            defaults = {
-                "name": row["name"],
-                "type": row["type"],
-            }
-            if row["allow_settlement"] is not None:
-                defaults["allow_settlement"] = row["allow_settlement"]
-            if row["is_active"] is not None:
-                defaults["is_active"] = row["is_active"]
-
-            if code in accounts_by_code:
-                acc = accounts_by_code[code]
-                for k, v in defaults.items():
-                    setattr(acc, k, v)
-                # reset parent temporarily – will be set in next loop
-                acc.parent = None
-                acc.save()
-                updated += 1
-            else:
-                acc = Account.objects.create(code=code, parent=None, **defaults)
-                accounts_by_code[code] = acc
-                created += 1
-
-        # 2) Set parents
-        for row in rows:
-            if row["parent_code"]:
-                acc = accounts_by_code.get(row["code"])
-                parent = accounts_by_code.get(row["parent_code"])
-                if acc and parent and acc != parent:
-                    acc.parent = parent
-                    acc.save(update_fields=["parent"])
+        # 1) Create new accounts (without parent), then link all parents in memory
+        Account.objects.bulk_create(new_accounts, batch_size=CHART_IMPORT_CHUNK_SIZE)
+        accounts_by_code = {**existing, **{a.code: a for a in new_accounts}}
+
+        relinked = []
+        for code, parent_code in parent_codes.items():
+            acc = accounts_by_code[code]
+            parent = accounts_by_code.get(parent_code) if parent_code else None
+            parent_id = parent.pk if parent else None
+            if acc.parent_id != parent_id:
+                acc.parent_id = parent_id
+                relinked.append(acc)
+
+        # 2) Write changed existing accounts + parent links in chunks
+        to_update = {acc.pk: acc for acc in changed_accounts + relinked}
+        if to_update:
+            Account.objects.bulk_update(
+                list(to_update.values()),
+                ["name", "type", "allow_settlement", "is_active", "parent"],
+                batch_size=CHART_IMPORT_CHUNK_SIZE,
+            )
 
         # 3) Deactivate accounts not present in import
         if replace_existing:
-            deactivated = Account.objects.exclude(code__in=seen_codes).update(
-                is_active=False
-            )
+            result["deactivated"] = deactivate_qs.update(is_active=False)
 
-        # 4) Opening balances
-        opening_lines: list[tuple[Account, Decimal, Decimal]] = []
-        tot_dr = DECIMAL_ZERO
-        tot_cr = DECIMAL_ZERO
-
-        for row in rows:
-            if row["opening_debit"] > 0 or row["opening_credit"] > 0:
-                acc = accounts_by_code[row["code"]]
-                opening_lines.append(
-                    (acc, row["opening_debit"], row["opening_credit"])
-                )
-                tot_dr += row["opening_debit"]
-                tot_cr += row["opening_credit"]
+        # bulk writes skip Account.save(), so recompute the tree paths here
+        rebuild_account_paths()
+        bump_ledger_version()
 
-        if opening_lines:
-            if not fiscal_year:
-                raise ValidationError(
-                    _("يجب تحديد سنة مالية لاستيراد الأرصدة الافتتاحية.")
-                )
+        # bulk writes skip post_save, so refresh the cached settings explicitly
+        LedgerSettings.invalidate_solo()
+        from .reports import invalidate_dashboard_metrics  # local import to avoid circular
 
-            if tot_dr != tot_cr:
-                raise ValidationError(_("القيد الافتتاحي غير متوازن."))
+        invalidate_dashboard_metrics()
 
+        # 4) Opening balances
+        if opening_rows:
             settings_obj = LedgerSettings.get_solo()
             journal = (
                 settings_obj.opening_balance_journal
@@ -372,7 +902,10 @@ def import_chart_of_accounts_from_excel(
 
             ref = f"OPENING-{fiscal_year.year}"
             # Remove previous imported opening entry for this year/journal
-            JournalEntry.objects.filter(journal=journal, reference=ref).delete()
+            previous = JournalEntry.objects.filter(journal=journal, reference=ref)
+            for old_entry in previous.filter(posted=True):
+                apply_entry_to_balances(old_entry, sign=-1)
+            previous.delete()
 
             # Entry date: one day before fiscal year start
             op_date = fiscal_year.start_date - timedelta(days=1)
@@ -387,21 +920,21 @@ def import_chart_of_accounts_from_excel(
                 posted_at=timezone.now(),
             )
 
-            for idx, (acc, dr, cr) in enumerate(opening_lines, 1):
-                JournalLine.objects.create(
+            lines = [
+                JournalLine(
                     entry=entry,
-                    account=acc,
-                    debit=dr,
-                    credit=cr,
+                    account=accounts_by_code[row["code"]],
+                    debit=row["opening_debit"],
+                    credit=row["opening_credit"],
                     order=idx,
                 )
+                for idx, row in enumerate(opening_rows, 1)
+            ]
+            JournalLine.objects.bulk_create(lines, batch_size=CHART_IMPORT_CHUNK_SIZE)
 
-    return {
-        "created": created,
-        "updated": updated,
-        "deactivated": deactivated,
-        "errors": errors,
-    }
+            _upsert_period_balances(_lines_balance_deltas([entry], lines))
+
+    return result
 
 
 # =====================================================================
@@ -441,38 +974,159 @@ def post_sales_invoice_to_ledger(invoice, *, user=None):
         raise ValueError(_("لا توجد سنة مالية لهذه الفاتورة."))
 
     with transaction.atomic():
-        entry = JournalEntry.objects.create(
-            fiscal_year=fiscal_year,
-            journal=journal,
-            date=invoice.issued_at,
-            reference=invoice.display_number,
-            description=f"Sales Invoice: {invoice.display_number} - {invoice.customer.name}",
-            posted=True,
-            posted_at=timezone.now(),
-            posted_by=user,
+        entry = _build_sales_invoice_entry(
+            invoice, journal=journal, fiscal_year=fiscal_year, user=user, posted_at=timezone.now()
         )
+        entry.save()
+
+        lines = _build_sales_invoice_lines(invoice, entry, ar_account=ar_account, rev_account=rev_account)
+        JournalLine.objects.bulk_create(lines)
+
+        _upsert_period_balances(_lines_balance_deltas([entry], lines))
 
-        # Debit AR
-        JournalLine.objects.create(
+        invoice.ledger_entry = entry
+        invoice.save(update_fields=["ledger_entry"])
+
+        return entry
+
+
+def _build_sales_invoice_entry(invoice, *, journal, fiscal_year, user, posted_at) -> JournalEntry:
+    return JournalEntry(
+        fiscal_year=fiscal_year,
+        journal=journal,
+        date=invoice.issued_at,
+        reference=invoice.display_number,
+        description=f"Sales Invoice: {invoice.display_number} - {invoice.customer.name}",
+        posted=True,
+        posted_at=posted_at,
+        posted_by=user,
+    )
+
+
+def _build_sales_invoice_lines(invoice, entry, *, ar_account, rev_account) -> list[JournalLine]:
+    """Debit AR / Credit Revenue."""
+    return [
+        JournalLine(
             entry=entry,
             account=ar_account,
             debit=invoice.total_amount,
             credit=0,
             description=f"Inv {invoice.display_number} - Receivable",
-        )
-        # Credit Revenue
-        JournalLine.objects.create(
+            order=1,
+        ),
+        JournalLine(
             entry=entry,
             account=rev_account,
             debit=0,
             credit=invoice.total_amount,
             description=f"Inv {invoice.display_number} - Revenue",
+            order=2,
+        ),
+    ]
+
+
+def post_invoices_to_ledger(invoices, *, user=None, chunk_size: int = 500):
+    """
+    Post many sales invoices to the ledger in batches.
+
+    - LedgerSettings and fiscal years are resolved once for the whole run
+      (fiscal years through the in-memory FiscalYearIndex).
+    - Each chunk is its own short transaction: entries and lines are
+      bulk-created, period balances are upserted once, and ledger_entry
+      is linked with bulk_update.
+    - Invoices that cannot be posted (zero total, no fiscal year) are
+      reported in "errors" and do not abort the batch.
+
+    Returns:
+        dict: {"posted": int, "skipped": int, "errors": list[str]}
+    """
+    settings = LedgerSettings.get_solo()
+    journal = settings.sales_journal
+    ar_account = settings.sales_receivable_account
+    rev_account = settings.sales_revenue_0_account
+
+    if not all([journal, ar_account, rev_account]):
+        raise ValueError(
+            _("يرجى ضبط إعدادات دفتر المبيعات وحسابات العملاء والمبيعات.")
         )
 
-        invoice.ledger_entry = entry
-        invoice.save(update_fields=["ledger_entry"])
+    fiscal_years = FiscalYear.objects.index()
 
-        return entry
+    result = {"posted": 0, "skipped": 0, "errors": []}
+    pending_ids = list(
+        invoices.filter(type=Invoice.InvoiceType.SALES)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+    for start in range(0, len(pending_ids), chunk_size):
+        chunk_ids = pending_ids[start:start + chunk_size]
+
+        with transaction.atomic():
+            chunk = list(
+                Invoice.objects.select_for_update()
+                .filter(pk__in=chunk_ids)
+                .select_related("customer")
+                .order_by("pk")
+            )
+
+            # is_closed من قاعدة البيانات (مثل _ensure_fiscal_year_open) وليس من الفهرس المخزّن
+            closed_year_ids = set(
+                FiscalYear.objects.filter(is_closed=True).values_list("pk", flat=True)
+            )
+            posted_at = timezone.now()
+            to_post: list[tuple[Invoice, JournalEntry]] = []
+            for invoice in chunk:
+                if invoice.ledger_entry_id:
+                    result["skipped"] += 1
+                    continue
+                if invoice.total_amount <= 0:
+                    result["errors"].append(
+                        _("%(inv)s: لا يمكن ترحيل فاتورة إجماليها صفر.") % {"inv": invoice.display_number}
+                    )
+                    continue
+                fiscal_year = fiscal_years.containing(invoice.issued_at)
+                if fiscal_year is None:
+                    result["errors"].append(
+                        _("%(inv)s: لا توجد سنة مالية لهذه الفاتورة.") % {"inv": invoice.display_number}
+                    )
+                    continue
+                if fiscal_year.pk in closed_year_ids:
+                    result["errors"].append(
+                        _("%(inv)s: السنة المالية لهذه الفاتورة مقفلة.") % {"inv": invoice.display_number}
+                    )
+                    continue
+                to_post.append((
+                    invoice,
+                    _build_sales_invoice_entry(
+                        invoice, journal=journal, fiscal_year=fiscal_year, user=user, posted_at=posted_at
+                    ),
+                ))
+
+            if not to_post:
+                continue
+
+            entries = JournalEntry.objects.bulk_create([entry for _inv, entry in to_post])
+
+            lines = []
+            for (invoice, _entry), entry in zip(to_post, entries):
+                lines.extend(
+                    _build_sales_invoice_lines(invoice, entry, ar_account=ar_account, rev_account=rev_account)
+                )
+                invoice.ledger_entry = entry
+            JournalLine.objects.bulk_create(lines, batch_size=chunk_size)
+
+            _upsert_period_balances(_lines_balance_deltas(entries, lines))
+
+            Invoice.objects.bulk_update([invoice for invoice, _entry in to_post], ["ledger_entry"])
+            result["posted"] += len(to_post)
+
+    if result["posted"]:
+        from .reports import invalidate_dashboard_metrics  # local import to avoid circular
+
+        invalidate_dashboard_metrics()
+
+    return result
 
 
 def unpost_sales_invoice_from_ledger(invoice, reversal_date=None, user=None):
@@ -510,14 +1164,18 @@ def unpost_sales_invoice_from_ledger(invoice, reversal_date=None, user=None):
             posted_by=user,
         )
 
-        for line in original.lines.all():
-            JournalLine.objects.create(
-                entry=rev_entry,
-                account=line.account,
-                debit=line.credit,  # swap
-                credit=line.debit,  # swap
-                description=f"Reversal of line {line.pk}",
-            )
+        write_journal_lines(rev_entry, [
+            {
+                "account_id": line.account_id,
+                "debit": line.credit,  # swap
+                "credit": line.debit,  # swap
+                "description": f"Reversal of line {line.pk}",
+                "order": line.order,
+            }
+            for line in original.lines.all()
+        ])
+
+        apply_entry_to_balances(rev_entry)
 
         invoice.ledger_entry = None
         invoice.status = invoice.Status.DRAFT
@@ -526,6 +1184,218 @@ def unpost_sales_invoice_from_ledger(invoice, reversal_date=None, user=None):
         return rev_entry
 
 
+# =====================================================================
+# Fiscal Year Closing
+# =====================================================================
+
+CLOSING_ACCOUNT_TYPES = (Account.Type.REVENUE, Account.Type.EXPENSE)
+CARRY_FORWARD_ACCOUNT_TYPES = (Account.Type.ASSET, Account.Type.LIABILITY, Account.Type.EQUITY)
+
+
+def _net_lines(entry: JournalEntry, nets, *, reverse: bool = False) -> list[JournalLine]:
+    """
+    One JournalLine per (account_id, debit - credit); reverse=True swaps sides.
+    """
+    lines = []
+    for order, (account_id, net) in enumerate(nets, 1):
+        if reverse:
+            net = -net
+        if not net:
+            continue
+        lines.append(JournalLine(
+            entry=entry,
+            account_id=account_id,
+            debit=net if net > 0 else DECIMAL_ZERO,
+            credit=-net if net < 0 else DECIMAL_ZERO,
+            order=order,
+        ))
+    return lines
+
+
+def _net_balances(balances) -> list[tuple[int, Decimal]]:
+    rows = (
+        balances.values("account_id", "account__code")
+        .annotate(dr=Sum("debit"), cr=Sum("credit"))
+        .order_by("account__code")
+    )
+    return [
+        (row["account_id"], (row["dr"] or DECIMAL_ZERO) - (row["cr"] or DECIMAL_ZERO))
+        for row in rows
+    ]
+
+
+def _carry_forward_entries(next_year: FiscalYear):
+    """Opening (carry-forward) entries already written into `next_year`."""
+    return JournalEntry.objects.filter(fiscal_year=next_year).filter(
+        Q(reference=f"CARRY-FORWARD-{next_year.year}")
+        | Q(pk__in=FiscalYear.objects.filter(opening_entry__isnull=False).values("opening_entry"))
+    )
+
+
+@transaction.atomic
+def close_fiscal_year(fiscal_year: FiscalYear, *, user=None, carry_forward: bool = True) -> dict:
+    """
+    Year-end closing, set-based:
+
+      1) Rebuild the year's AccountPeriodBalance once (the snapshot that
+         gets frozen) and refuse if draft entries are left in the year.
+      2) Closing entry (dated end_date): one aggregate gives the net of every
+         revenue / expense account; each is reversed and the difference goes
+         to LedgerSettings.retained_earnings_account. Its lines stay in the
+         period balances; P&L reports subtract them (get_closing_entry_totals).
+      3) Opening entry of the next fiscal year (dated its start_date): one
+         aggregate gives the net of every balance-sheet account since the
+         last carry-forward (closing entry included).
+      4) Headers and lines are written with bulk_create, balances updated
+         from memory, then the year is marked closed: posting, unposting and
+         balance rebuilds are refused for it from now on.
+
+    This (and reopen_fiscal_year) is the only way is_closed changes: a second
+    carry-forward entry in the next year would be counted twice by every
+    carry_forward_start()-based balance, so closing is refused while one exists.
+
+    Returns:
+        {"closing_entry", "opening_entry", "closing_lines", "opening_lines"}
+    """
+    fiscal_year = FiscalYear.objects.select_for_update().get(pk=fiscal_year.pk)
+    if fiscal_year.is_closed:
+        raise ValidationError(_("السنة المالية مقفلة مسبقاً."))
+    if fiscal_year.closing_entry_id or fiscal_year.opening_entry_id:
+        raise ValidationError(_("لهذه السنة قيود إقفال سابقة. أعد فتحها عبر إعادة الفتح لحذفها أولاً."))
+
+    settings_obj = LedgerSettings.get_solo()
+    retained = settings_obj.retained_earnings_account
+    if retained is None:
+        raise ValidationError(_("يجب تحديد حساب الأرباح المبقاة في إعدادات الدفاتر قبل الإقفال."))
+
+    next_year = None
+    if carry_forward:
+        next_start = fiscal_year.end_date + timedelta(days=1)
+        next_year = FiscalYear.objects.filter(start_date__lte=next_start, end_date__gte=next_start).first()
+        if next_year is None:
+            raise ValidationError(_("يجب إنشاء السنة المالية التالية قبل الإقفال (لترحيل الأرصدة الافتتاحية)."))
+        if next_year.is_closed:
+            raise ValidationError(_("السنة المالية التالية مقفلة."))
+        if _carry_forward_entries(next_year).exists():
+            raise ValidationError(_("السنة المالية التالية فيها قيد أرصدة افتتاحية مرحّل مسبقاً."))
+
+    drafts = JournalEntry.objects.filter(fiscal_year=fiscal_year, posted=False).count()
+    if drafts:
+        raise ValidationError(
+            _("يوجد %(count)d قيد غير مرحّل في هذه السنة. رحّلها أو احذفها قبل الإقفال.") % {"count": drafts}
+        )
+
+    # 1) Snapshot of the year (one pass over its lines)
+    rebuild_account_balances(fiscal_year=fiscal_year)
+
+    closing_journal = settings_obj.closing_journal or Journal.objects.get_default_for_manual_entry()
+    opening_journal = settings_obj.opening_balance_journal or closing_journal
+    now = timezone.now()
+
+    # 2) Closing entry: reverse every P&L account into retained earnings
+    pl_nets = _net_balances(
+        AccountPeriodBalance.objects.filter(fiscal_year=fiscal_year, account__type__in=CLOSING_ACCOUNT_TYPES)
+    )
+    closing_entry = JournalEntry(
+        fiscal_year=fiscal_year,
+        journal=closing_journal,
+        date=fiscal_year.end_date,
+        reference=f"CLOSING-{fiscal_year.year}",
+        description=_("قيد إقفال السنة المالية %(year)s") % {"year": fiscal_year.year},
+        posted=True,
+        posted_at=now,
+        posted_by=user,
+    )
+    JournalEntry.objects.bulk_create([closing_entry])
+
+    closing_lines = _net_lines(closing_entry, pl_nets, reverse=True)
+    net_income = sum((net for _account_id, net in pl_nets), DECIMAL_ZERO) * -1  # credit - debit
+    closing_lines += _net_lines(closing_entry, [(retained.pk, -net_income)])
+    JournalLine.objects.bulk_create(closing_lines, batch_size=1000)
+    _upsert_period_balances(_lines_balance_deltas([closing_entry], closing_lines))
+
+    # 3) Opening entry of the next year
+    opening_entry, opening_lines = None, []
+    if next_year is not None:
+        carried = AccountPeriodBalance.objects.filter(
+            account__type__in=CARRY_FORWARD_ACCOUNT_TYPES,
+            period__lte=fiscal_year.end_date,
+        )
+        since = FiscalYear.objects.index().carry_forward_start(fiscal_year.end_date)
+        if since:
+            carried = carried.filter(period__gte=since)
+
+        opening_entry = JournalEntry(
+            fiscal_year=next_year,
+            journal=opening_journal,
+            date=next_year.start_date,
+            reference=f"CARRY-FORWARD-{next_year.year}",
+            description=_("الأرصدة الافتتاحية المرحّلة من سنة %(year)s") % {"year": fiscal_year.year},
+            posted=True,
+            posted_at=now,
+            posted_by=user,
+        )
+        JournalEntry.objects.bulk_create([opening_entry])
+        opening_lines = _net_lines(opening_entry, _net_balances(carried))
+        JournalLine.objects.bulk_create(opening_lines, batch_size=1000)
+        _upsert_period_balances(_lines_balance_deltas([opening_entry], opening_lines))
+
+    # 4) Freeze
+    fiscal_year.is_closed = True
+    fiscal_year.closed_at = now
+    fiscal_year.closing_entry = closing_entry
+    fiscal_year.opening_entry = opening_entry
+    fiscal_year.save(update_fields=["is_closed", "closed_at", "closing_entry", "opening_entry"])
+
+    return {
+        "closing_entry": closing_entry,
+        "opening_entry": opening_entry,
+        "closing_lines": len(closing_lines),
+        "opening_lines": len(opening_lines),
+    }
+
+
+@transaction.atomic
+def reopen_fiscal_year(fiscal_year: FiscalYear) -> int:
+    """
+    Undo close_fiscal_year():
+
+      - refused while a later year is closed (its opening entry / snapshot
+        were built on this year's balances);
+      - also cleans up a year that is open but still points to closing
+        entries (closed, then unticked from the old fiscal year form);
+      - the year is marked open first, so its period balances may change;
+      - the closing entry and the next year's opening entry are taken out of
+        the period balances and deleted, so a new close starts from scratch.
+
+    Returns:
+        int: number of deleted entries (closing + opening).
+    """
+    fiscal_year = FiscalYear.objects.select_for_update().get(pk=fiscal_year.pk)
+    if not (fiscal_year.is_closed or fiscal_year.closing_entry_id or fiscal_year.opening_entry_id):
+        raise ValidationError(_("السنة المالية غير مقفلة."))
+    if FiscalYear.objects.filter(start_date__gt=fiscal_year.end_date, is_closed=True).exists():
+        raise ValidationError(_("لا يمكن إعادة فتح السنة قبل إعادة فتح السنوات المقفلة التي بعدها."))
+
+    entries = [
+        entry for entry in (fiscal_year.closing_entry, fiscal_year.opening_entry)
+        if entry is not None
+    ]
+
+    fiscal_year.is_closed = False
+    fiscal_year.closed_at = None
+    fiscal_year.closing_entry = None
+    fiscal_year.opening_entry = None
+    fiscal_year.save(update_fields=["is_closed", "closed_at", "closing_entry", "opening_entry"])
+
+    for entry in entries:
+        if entry.posted:
+            apply_entry_to_balances(entry, sign=-1)
+        entry.delete()
+
+    return len(entries)
+
+
 # =====================================================================
 # Orders → Invoices
 # =====================================================================
@@ -565,10 +1435,9 @@ def convert_order_to_invoice(order, *, issued_at=None):
                 )
             )
 
-        InvoiceItemModel.objects.bulk_create(items_to_create)
-
-        # Recalculate invoice total from items
-        invoice.recalculate_totals()
+        # Invoice total is computed once (one SUM) when the block exits
+        with invoice.deferred_totals():
+            InvoiceItemModel.objects.bulk_create(items_to_create)
 
         # Link order → invoice
         order.invoice = invoice
@@ -586,6 +1455,50 @@ def convert_order_to_invoice(order, *, issued_at=None):
 # =====================================================================
 # Payment Allocation
 # =====================================================================
+def refresh_invoice_allocation_totals(invoice_ids=None) -> int:
+    """
+    يعيد احتساب allocated_total / balance / status للفواتير المحددة
+    من مجموع التسويات (استعلام GROUP BY واحد).
+
+    - يجب استدعاؤها داخل transaction، والفواتير تُقفل بـ select_for_update.
+    - invoice_ids=None يعني كل الفواتير (يستخدمه أمر الفحص/الإصلاح).
+
+    Returns:
+        int: عدد الفواتير التي تغيّرت قيمها.
+    """
+    with transaction.atomic():
+        invoices = Invoice.objects.select_for_update().order_by("pk")
+        allocations = PaymentReconciliation.objects.all()
+        if invoice_ids is not None:
+            invoice_ids = list(invoice_ids)
+            invoices = invoices.filter(pk__in=invoice_ids)
+            allocations = allocations.filter(invoice_id__in=invoice_ids)
+
+        sums = dict(
+            allocations.values("invoice_id")
+            .annotate(total=Sum("amount"))
+            .values_list("invoice_id", "total")
+        )
+
+        changed = 0
+        for invoice in invoices:
+            allocated = sums.get(invoice.pk) or DECIMAL_ZERO
+            old_status = invoice.status
+            if allocated == invoice.allocated_total and invoice.balance == invoice.total_amount - allocated:
+                continue
+
+            invoice.allocated_total = allocated
+            invoice.update_payment_status(commit=False)
+            fields = ["allocated_total"]
+            if invoice.status != old_status:
+                fields.append("status")
+            # save() يضيف balance تلقائياً ويشغّل hooks تغيير الحالة
+            invoice.save(update_fields=fields)
+            changed += 1
+
+    return changed
+
+
 @transaction.atomic
 def allocate_payment_to_invoices(payment: Payment, allocations: Dict[int, Decimal]) -> None:
     """
@@ -602,8 +1515,19 @@ def allocate_payment_to_invoices(payment: Payment, allocations: Dict[int, Decima
     ملاحظات:
     - لا يتم إنشاء Payment جديد نهائياً.
     - فقط يتم إنشاء/تحديث/حذف أسطر PaymentReconciliation.
+    - الدفعة والفواتير تُقفل (select_for_update) ثم تُحدّث allocated_total / balance.
     """
 
+    # 0) قفل الدفعة والفواتير المعنية (استعلام واحد لكل منهما)
+    payment = Payment.objects.select_for_update().get(pk=payment.pk)
+    invoices = Invoice.objects.select_for_update().in_bulk(list(allocations.keys()))
+
+    existing = dict(
+        PaymentReconciliation.objects.filter(payment=payment)
+        .values_list("invoice_id", "amount")
+    )
+    unallocated = payment.amount - sum(existing.values(), DECIMAL_ZERO)
+
     # 1) التحقق من المجموع الكلي للمبالغ
     total_alloc = sum(allocations.values())
     if total_alloc > payment.amount:
@@ -615,49 +1539,51 @@ def allocate_payment_to_invoices(payment: Payment, allocations: Dict[int, Decima
             # بنسمح بقيم <= صفر كإشارة للحذف لاحقاً
             continue
 
-        try:
-            invoice = Invoice.objects.get(pk=invoice_id)
-        except Invoice.DoesNotExist:
+        invoice = invoices.get(invoice_id)
+        if invoice is None:
             raise ValidationError(_("الفاتورة برقم %(inv)s غير موجودة.") % {"inv": invoice_id})
 
         # الطرف لازم يكون نفسه
-        if invoice.customer != payment.contact:
+        if invoice.customer_id != payment.contact_id:
             raise ValidationError(
                 _("الفاتورة %(inv)s ليست لنفس الطرف المرتبط بالدفعة.")
                 % {"inv": invoice.display_number}
             )
 
-        # لا يتجاوز الرصيد المتبقي على الفاتورة
-        if amount > invoice.balance:
+        # لا يتجاوز الرصيد المتبقي على الفاتورة (مع استرجاع التسوية الحالية لنفس الدفعة)
+        current = existing.get(invoice_id, DECIMAL_ZERO)
+        if amount > invoice.balance + current:
             raise ValidationError(
                 _("المبلغ المخصص للفاتورة %(inv)s أكبر من رصيدها المتبقي.")
                 % {"inv": invoice.display_number}
             )
 
         # لا يتجاوز المبلغ غير المخصص من الدفعة (تحقق إضافي)
-        if amount > payment.unallocated_amount:
+        if amount > unallocated + current:
             raise ValidationError(
                 _("المبلغ المخصص أكبر من المبلغ غير المخصص المتبقي في الدفعة.")
             )
 
     # 3) إنشاء/تحديث/حذف التسويات
     for invoice_id, amount in allocations.items():
-        invoice = Invoice.objects.get(pk=invoice_id)
-
         if amount <= 0:
             # لو صفر أو أقل: نحذف أي تسوية موجودة لهذه الفاتورة مع هذه الدفعة
-            PaymentReconciliation.objects.filter(payment=payment, invoice=invoice).delete()
+            if invoice_id in existing:
+                PaymentReconciliation.objects.filter(payment=payment, invoice_id=invoice_id).delete()
+            continue
+
+        if existing.get(invoice_id) == amount:
             continue
 
         # update_or_create: يعدّل لو موجود، ينشئ لو جديد
         PaymentReconciliation.objects.update_or_create(
             payment=payment,
-            invoice=invoice,
+            invoice_id=invoice_id,
             defaults={"amount": amount},
         )
 
-        # بعد كل تعديل، ممكن تختار تحدث حالة الفاتورة:
-        invoice.update_payment_status()
+    # 4) تحديث المجاميع المخزنة وحالة الفواتير
+    refresh_invoice_allocation_totals(invoices.keys())
 
 
 @transaction.atomic
@@ -668,10 +1594,33 @@ def clear_payment_allocations(payment: Payment) -> None:
     """
     qs = PaymentReconciliation.objects.filter(payment=payment)
 
-    # نحفظ قائمة الفواتير لتحديث حالتها بعد الحذف
-    invoices = list({alloc.invoice for alloc in qs})
+    # نحفظ قائمة الفواتير لتحديث مجاميعها وحالتها بعد الحذف
+    invoice_ids = list(qs.values_list("invoice_id", flat=True).distinct())
+
+    # قفل الفواتير قبل الحذف
+    list(Invoice.objects.select_for_update().filter(pk__in=invoice_ids).values_list("pk", flat=True))
 
     qs.delete()
 
-    for invoice in invoices:
-        invoice.update_payment_status()
+    refresh_invoice_allocation_totals(invoice_ids)
+
+
+@transaction.atomic
+def delete_payment(payment: Payment) -> None:
+    """
+    حذف دفعة مع تحديث الفواتير التي كانت مسوّاة معها.
+
+    الحذف يمسح أسطر PaymentReconciliation (CASCADE)، لذلك نجمع الفواتير
+    المتأثرة ونقفلها قبل الحذف، ثم نعيد احتساب allocated_total / balance / status
+    في نفس الـ transaction.
+    """
+    invoice_ids = list(
+        PaymentReconciliation.objects.filter(payment=payment)
+        .values_list("invoice_id", flat=True)
+        .distinct()
+    )
+    list(Invoice.objects.select_for_update().filter(pk__in=invoice_ids).values_list("pk", flat=True))
+
+    payment.delete()
+
+    refresh_invoice_allocation_totals(invoice_ids)
@@ -0,0 +1,49 @@
+# accounting/signals/dashboard.py
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from accounting.models import Account, Invoice, JournalEntry, Payment, PaymentReconciliation
+from accounting.reports import invalidate_aging_reports, invalidate_dashboard_metrics
+from accounting.services import bump_ledger_version
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+@receiver(post_save, sender=PaymentReconciliation)
+@receiver(post_delete, sender=PaymentReconciliation)
+@receiver(post_save, sender=JournalEntry)
+@receiver(post_delete, sender=JournalEntry)
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def invalidate_dashboard_on_change(sender, **kwargs):
+    """
+    Drop the cached dashboard snapshot when any row it summarizes changes.
+    (Bulk writes in services call invalidate_dashboard_metrics() directly.)
+    """
+    invalidate_dashboard_metrics()
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+@receiver(post_save, sender=PaymentReconciliation)
+@receiver(post_delete, sender=PaymentReconciliation)
+def invalidate_aging_on_change(sender, **kwargs):
+    """
+    Cached aging reports depend on invoices, payment dates and allocations only.
+    """
+    invalidate_aging_reports()
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def bump_ledger_version_on_account_change(sender, **kwargs):
+    """
+    Cached trial balances show account codes/names; period balance writes
+    bump the version themselves (see services._upsert_period_balances).
+    """
+    bump_ledger_version()
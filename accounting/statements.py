@@ -0,0 +1,293 @@
+# accounting/statements.py
+
+from __future__ import annotations
+
+import calendar
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import Decimal
+from typing import Iterator
+
+from django.db.models import Q, Sum
+from django.utils.translation import gettext_lazy as _
+
+from .models import DECIMAL_ZERO, Account, AccountPeriodBalance, FiscalYear
+from .services import get_closing_entry_totals
+
+INCOME_STATEMENT = "income"
+BALANCE_SHEET = "balance"
+
+COMPARE_MONTHS = "mom"  # month over month
+COMPARE_YEARS = "yoy"   # same month, previous years
+
+MAX_STATEMENT_COLUMNS = 12
+
+
+# =====================================================================
+# Columns (comparative periods)
+# =====================================================================
+
+@dataclass(frozen=True)
+class StatementColumn:
+    """
+    One comparative column. Both ends are whole months, matching the
+    granularity of AccountPeriodBalance.
+    """
+    label: str
+    date_from: date
+    date_to: date
+
+
+def _month_end(year: int, month: int) -> date:
+    return date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _shift_month(year: int, month: int, delta: int) -> tuple[int, int]:
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+def monthly_columns(year: int, month: int, count: int = 3) -> list[StatementColumn]:
+    """
+    `count` consecutive months ending at (year, month), newest first.
+    """
+    columns = []
+    for offset in range(min(count, MAX_STATEMENT_COLUMNS)):
+        y, m = _shift_month(year, month, -offset)
+        columns.append(StatementColumn(f"{y}-{m:02d}", date(y, m, 1), _month_end(y, m)))
+    return columns
+
+
+def yearly_columns(year: int, month: int, count: int = 2) -> list[StatementColumn]:
+    """
+    The same month in `count` consecutive years ending at `year`, newest first.
+    """
+    return [
+        StatementColumn(f"{year - offset}-{month:02d}", date(year - offset, month, 1), _month_end(year - offset, month))
+        for offset in range(min(count, MAX_STATEMENT_COLUMNS))
+    ]
+
+
+def comparative_columns(compare: str, year: int, month: int, count: int) -> list[StatementColumn]:
+    if compare == COMPARE_YEARS:
+        return yearly_columns(year, month, count)
+    return monthly_columns(year, month, count)
+
+
+# =====================================================================
+# Statement structure
+# =====================================================================
+
+@dataclass
+class StatementLine:
+    account_id: int | None
+    code: str
+    name: str
+    amounts: list[Decimal]
+    level: int = 0
+
+
+@dataclass
+class StatementSection:
+    key: str
+    title: str
+    lines: list[StatementLine] = field(default_factory=list)
+    totals: list[Decimal] = field(default_factory=list)
+
+
+@dataclass
+class FinancialStatement:
+    kind: str
+    title: str
+    columns: list[StatementColumn]
+    sections: list[StatementSection]
+    # Bottom lines, e.g. net income or the balance check: [(label, amounts)]
+    summary: list[tuple[str, list[Decimal]]] = field(default_factory=list)
+
+    def header(self) -> list[str]:
+        return [str(_("الكود")), str(_("البند"))] + [column.label for column in self.columns]
+
+    def iter_rows(self) -> Iterator[list]:
+        """
+        Flat rows for XLSX/CSV export: section title, lines, section total.
+        """
+        blank = [""] * len(self.columns)
+        for section in self.sections:
+            yield ["", str(section.title)] + blank
+            for line in section.lines:
+                yield [line.code, line.name] + line.amounts
+            yield ["", str(_("إجمالي %(section)s") % {"section": section.title})] + section.totals
+        for label, amounts in self.summary:
+            yield ["", str(label)] + amounts
+
+
+# =====================================================================
+# Engine
+# =====================================================================
+
+# Sign per account type: amounts are shown positive on their natural side
+_NATURAL_DEBIT = {Account.Type.ASSET, Account.Type.EXPENSE}
+
+_SECTION_TITLES = {
+    Account.Type.REVENUE: _("الإيرادات"),
+    Account.Type.EXPENSE: _("المصروفات"),
+    Account.Type.ASSET: _("الأصول"),
+    Account.Type.LIABILITY: _("الالتزامات"),
+    Account.Type.EQUITY: _("حقوق الملكية"),
+}
+
+
+def _column_balances(conditions: list[Q], account_types) -> list[dict]:
+    """
+    One GROUP BY over AccountPeriodBalance (joined to Account, in tree
+    order): for every account of `account_types`, a (debit, credit) pair
+    per column via conditional SUMs.
+    """
+    aggregates = {}
+    for i, condition in enumerate(conditions):
+        aggregates[f"dr_{i}"] = Sum("debit", filter=condition)
+        aggregates[f"cr_{i}"] = Sum("credit", filter=condition)
+
+    rows = list(
+        AccountPeriodBalance.objects.filter(account__type__in=account_types)
+        .values("account_id", "account__code", "account__name", "account__type", "account__level", "account__path")
+        .annotate(**aggregates)
+        .order_by("account__path")
+    )
+    for row in rows:
+        row["pairs"] = [
+            (row[f"dr_{i}"] or DECIMAL_ZERO, row[f"cr_{i}"] or DECIMAL_ZERO)
+            for i in range(len(conditions))
+        ]
+
+    return rows
+
+
+def _exclude_closing_entries(rows: list[dict], columns: list[StatementColumn]) -> None:
+    """
+    Subtract the year-end closing entries from each column's pairs, so a
+    closed year's last month shows its result instead of the reversal into
+    retained earnings (see services.get_closing_entry_totals).
+    """
+    span = Q()
+    for column in columns:
+        span |= Q(period__gte=column.date_from, period__lte=column.date_to)
+    closing = get_closing_entry_totals(span)
+    if not closing:
+        return
+
+    rows_by_account = {row["account_id"]: row for row in rows}
+    for (account_id, period), (closing_dr, closing_cr) in closing.items():
+        row = rows_by_account.get(account_id)
+        if row is None:
+            continue
+        for i, column in enumerate(columns):
+            if column.date_from <= period <= column.date_to:
+                dr, cr = row["pairs"][i]
+                row["pairs"][i] = (dr - closing_dr, cr - closing_cr)
+
+
+def _natural_amounts(row: dict) -> list[Decimal]:
+    if row["account__type"] in _NATURAL_DEBIT:
+        return [dr - cr for dr, cr in row["pairs"]]
+    return [cr - dr for dr, cr in row["pairs"]]
+
+
+def _build_sections(rows: list[dict], account_types, width: int) -> dict[str, StatementSection]:
+    sections = {
+        account_type: StatementSection(
+            key=account_type,
+            title=_SECTION_TITLES[account_type],
+            totals=[DECIMAL_ZERO] * width,
+        )
+        for account_type in account_types
+    }
+    for row in rows:
+        section = sections.get(row["account__type"])
+        amounts = _natural_amounts(row)
+        if section is None or not any(amounts):
+            continue
+        section.lines.append(StatementLine(
+            row["account_id"], row["account__code"], row["account__name"], amounts, row["account__level"],
+        ))
+        section.totals = [total + amount for total, amount in zip(section.totals, amounts)]
+    return sections
+
+
+def income_statement(columns: list[StatementColumn]) -> FinancialStatement:
+    """
+    Revenue and expenses for each column's period, plus net income.
+    Year-end closing entries are left out: closing does not change the result
+    reported for a closed year.
+    """
+    conditions = [Q(period__gte=c.date_from, period__lte=c.date_to) for c in columns]
+    types = [Account.Type.REVENUE, Account.Type.EXPENSE]
+    rows = _column_balances(conditions, types)
+    _exclude_closing_entries(rows, columns)
+    sections = _build_sections(rows, types, len(columns))
+
+    revenue, expense = sections[Account.Type.REVENUE], sections[Account.Type.EXPENSE]
+    net_income = [r - e for r, e in zip(revenue.totals, expense.totals)]
+
+    return FinancialStatement(
+        kind=INCOME_STATEMENT,
+        title=_("قائمة الدخل"),
+        columns=columns,
+        sections=[revenue, expense],
+        summary=[(_("صافي الربح / (الخسارة)"), net_income)],
+    )
+
+
+def balance_sheet(columns: list[StatementColumn]) -> FinancialStatement:
+    """
+    Cumulative balances as of each column's end date. Profit and loss not yet
+    closed into equity is shown as a separate equity line, so the statement
+    balances without closing entries. Each column sums from the last
+    carry-forward (see FiscalYearIndex.carry_forward_start) so closed years
+    are not counted twice.
+    """
+    index = FiscalYear.objects.index()
+    conditions = []
+    for column in columns:
+        condition = Q(period__lte=column.date_to)
+        since = index.carry_forward_start(column.date_to)
+        if since:
+            condition &= Q(period__gte=since)
+        conditions.append(condition)
+    types = [Account.Type.ASSET, Account.Type.LIABILITY, Account.Type.EQUITY]
+    pl_types = [Account.Type.REVENUE, Account.Type.EXPENSE]
+
+    rows = _column_balances(conditions, types + pl_types)
+    sections = _build_sections(rows, types, len(columns))
+
+    # Revenue - expense to date (credit nature)
+    earnings = [DECIMAL_ZERO] * len(columns)
+    for row in rows:
+        if row["account__type"] in pl_types:
+            earnings = [total + (cr - dr) for total, (dr, cr) in zip(earnings, row["pairs"])]
+
+    equity = sections[Account.Type.EQUITY]
+    if any(earnings):
+        equity.lines.append(StatementLine(None, "", str(_("أرباح (خسائر) الفترة غير المقفلة")), earnings))
+        equity.totals = [total + amount for total, amount in zip(equity.totals, earnings)]
+
+    assets = sections[Account.Type.ASSET]
+    liabilities = sections[Account.Type.LIABILITY]
+    liabilities_and_equity = [lia + eq for lia, eq in zip(liabilities.totals, equity.totals)]
+
+    return FinancialStatement(
+        kind=BALANCE_SHEET,
+        title=_("الميزانية العمومية"),
+        columns=columns,
+        sections=[assets, liabilities, equity],
+        summary=[
+            (_("إجمالي الالتزامات وحقوق الملكية"), liabilities_and_equity),
+            (_("الفرق"), [a - le for a, le in zip(assets.totals, liabilities_and_equity)]),
+        ],
+    )
+
+
+def build_statement(kind: str, columns: list[StatementColumn]) -> FinancialStatement:
+    if kind == BALANCE_SHEET:
+        return balance_sheet(columns)
+    return income_statement(columns)
@@ -0,0 +1,1268 @@
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.translation import gettext_lazy
+from openpyxl import Workbook, load_workbook
+
+from accounting.models import (
+    Account,
+    AccountPeriodBalance,
+    FiscalYear,
+    Invoice,
+    InvoiceItem,
+    Journal,
+    JournalEntry,
+    JournalLine,
+    LedgerSettings,
+    Payment,
+    PaymentMethod,
+    PaymentReconciliation,
+)
+from accounting import ledger_export, reports, services, statements
+from accounting.allocation import AllocationStrategy, auto_allocate_payments
+from accounting.forms import FiscalYearForm
+from accounting.reports import AccountLedger
+from contacts.models import Contact
+from core.services import exports
+
+
+class BaseAccountingTestCase(TestCase):
+    def setUp(self):
+        # Cached singletons survive the per-test rollback
+        cache.clear()
+
+        self.fy = FiscalYear.objects.create(
+            year=2025,
+            start_date=date(2025, 1, 1),
+            end_date=date(2025, 12, 31),
+        )
+        self.journal = Journal.objects.create(code="GEN", name="General")
+
+        self.cash = Account.objects.create(code="1000", name="Cash", type=Account.Type.ASSET)
+        self.revenue = Account.objects.create(code="4000", name="Sales", type=Account.Type.REVENUE)
+
+    @contextmanager
+    def assertNumQueriesOutsideCache(self, num: int):
+        """
+        assertNumQueries() that ignores lookups / writes in the shared
+        database cache (version keys, cached reports).
+        """
+        with CaptureQueriesContext(connection) as ctx:
+            yield
+        queries = [
+            q["sql"] for q in ctx.captured_queries
+            if "django_cache" not in q["sql"] and "SAVEPOINT" not in q["sql"]
+        ]
+        self.assertEqual(len(queries), num, "\n".join(queries))
+
+    def make_entry(self, day: date, amount: str, *, posted: bool = False) -> JournalEntry:
+        entry = JournalEntry.objects.create(
+            fiscal_year=self.fy,
+            journal=self.journal,
+            date=day,
+            posted=False,
+        )
+        JournalLine.objects.create(entry=entry, account=self.cash, debit=Decimal(amount))
+        JournalLine.objects.create(entry=entry, account=self.revenue, credit=Decimal(amount))
+        if posted:
+            services.post_journal_entry(entry)
+        return entry
+
+
+class AccountPeriodBalanceTests(BaseAccountingTestCase):
+    def test_post_and_unpost_maintain_balances(self):
+        entry = self.make_entry(date(2025, 3, 10), "100.000")
+        self.assertFalse(AccountPeriodBalance.objects.exists())
+
+        services.post_journal_entry(entry)
+        row = AccountPeriodBalance.objects.get(account=self.cash)
+        self.assertEqual(row.period, date(2025, 3, 1))
+        self.assertEqual(row.fiscal_year, self.fy)
+        self.assertEqual(row.debit, Decimal("100.000"))
+
+        # Posting twice is a no-op
+        services.post_journal_entry(entry)
+        row.refresh_from_db()
+        self.assertEqual(row.debit, Decimal("100.000"))
+
+        services.unpost_journal_entry(entry)
+        row.refresh_from_db()
+        self.assertEqual(row.debit, Decimal("0.000"))
+
+    def test_rebuild_matches_incremental(self):
+        self.make_entry(date(2025, 1, 5), "10.000", posted=True)
+        self.make_entry(date(2025, 1, 20), "15.000", posted=True)
+        self.make_entry(date(2025, 2, 3), "7.000", posted=True)
+        self.make_entry(date(2025, 2, 4), "99.000")  # draft, ignored
+
+        incremental = set(
+            AccountPeriodBalance.objects.values_list("account_id", "period", "debit", "credit")
+        )
+        count = services.rebuild_account_balances()
+        rebuilt = set(
+            AccountPeriodBalance.objects.values_list("account_id", "period", "debit", "credit")
+        )
+
+        self.assertEqual(count, 4)
+        self.assertEqual(incremental, rebuilt)
+
+    def test_account_totals_combine_months_and_partial_edges(self):
+        self.make_entry(date(2025, 1, 5), "10.000", posted=True)
+        self.make_entry(date(2025, 2, 10), "20.000", posted=True)
+        self.make_entry(date(2025, 3, 15), "30.000", posted=True)
+        self.make_entry(date(2025, 3, 25), "40.000", posted=True)
+
+        totals = services.get_account_totals(date_from=date(2025, 1, 6), date_to=date(2025, 3, 20))
+        self.assertEqual(totals[self.cash.pk], (Decimal("50.000"), Decimal("0.000")))
+        self.assertEqual(totals[self.revenue.pk], (Decimal("0.000"), Decimal("50.000")))
+
+        totals = services.get_account_totals(date_from=date(2025, 3, 1), date_to=date(2025, 3, 31))
+        self.assertEqual(totals[self.cash.pk][0], Decimal("70.000"))
+
+        totals = services.get_account_totals(date_from=date(2025, 3, 16), date_to=date(2025, 3, 24))
+        self.assertNotIn(self.cash.pk, totals)
+
+
+class AccountLedgerTests(BaseAccountingTestCase):
+    def test_keyset_pages_carry_running_balance(self):
+        for day, amount in [(3, "10.000"), (5, "20.000"), (5, "30.000"), (9, "40.000"), (12, "50.000")]:
+            self.make_entry(date(2025, 4, day), amount, posted=True)
+        self.make_entry(date(2025, 4, 20), "999.000")  # draft, ignored
+
+        ledger = AccountLedger(self.cash)
+        first = ledger.page(limit=2)
+        self.assertTrue(first.has_more)
+        self.assertEqual([l["balance"] for l in first.lines], [Decimal("10.000"), Decimal("30.000")])
+
+        second = ledger.page(first.next_cursor, limit=2)
+        self.assertEqual([l["balance"] for l in second.lines], [Decimal("60.000"), Decimal("100.000")])
+
+        third = ledger.page(second.next_cursor, limit=2)
+        self.assertFalse(third.has_more)
+        self.assertEqual([l["balance"] for l in third.lines], [Decimal("150.000")])
+        self.assertEqual(third.totals["closing_balance"], Decimal("150.000"))
+
+        streamed = [l["balance"] for l in ledger.iter_lines(chunk_size=2)]
+        self.assertEqual(streamed[-1], Decimal("150.000"))
+        self.assertEqual(len(streamed), 5)
+
+    def test_opening_balance_and_credit_nature(self):
+        self.make_entry(date(2025, 1, 10), "100.000", posted=True)
+        self.make_entry(date(2025, 2, 10), "25.000", posted=True)
+
+        ledger = AccountLedger(self.revenue, date_from=date(2025, 2, 1))
+        page = ledger.page()
+        self.assertEqual(page.opening_balance, Decimal("100.000"))
+        self.assertEqual(page.lines[0]["balance"], Decimal("125.000"))
+
+    def test_foreign_cursor_restarts_from_top(self):
+        self.make_entry(date(2025, 4, 1), "10.000", posted=True)
+        self.make_entry(date(2025, 4, 2), "10.000", posted=True)
+
+        cursor = AccountLedger(self.revenue).page(limit=1).next_cursor
+        page = AccountLedger(self.cash).page(cursor, limit=1)
+        self.assertEqual(page.lines[0]["balance"], Decimal("10.000"))
+        self.assertEqual(AccountLedger(self.cash).page("garbage", limit=1).lines[0]["date"], date(2025, 4, 1))
+
+    def test_export_streams_csv(self):
+        self.make_entry(date(2025, 4, 1), "10.000", posted=True)
+        user = get_user_model().objects.create_user("acc", password="x", is_staff=True)
+        self.client.force_login(user)
+
+        url = reverse("accounting:account_ledger_export")
+        response = self.client.get(url, {"account": self.cash.pk, "format": "csv"})
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content).decode("utf-8")
+        self.assertIn("10.000", content)
+
+        response = self.client.get(reverse("accounting:account_ledger"), {"account": self.cash.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["lines"]), 1)
+
+
+class BaseInvoiceTestCase(BaseAccountingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = Contact.objects.create(name="Customer", is_customer=True)
+        self.method = PaymentMethod.objects.create(name="Cash", code="CASH")
+        self.invoice = Invoice.objects.create(
+            customer=self.customer,
+            total_amount=Decimal("100.000"),
+            status=Invoice.Status.SENT,
+        )
+        self.payment = Payment.objects.create(
+            contact=self.customer,
+            method=self.method,
+            amount=Decimal("150.000"),
+        )
+
+
+class InvoiceAllocationTotalsTests(BaseInvoiceTestCase):
+    def test_allocate_and_clear_maintain_columns(self):
+        self.assertEqual(self.invoice.balance, Decimal("100.000"))
+
+        services.allocate_payment_to_invoices(self.payment, {self.invoice.pk: Decimal("40.000")})
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.allocated_total, Decimal("40.000"))
+        self.assertEqual(self.invoice.balance, Decimal("60.000"))
+        self.assertEqual(self.invoice.status, Invoice.Status.PARTIALLY_PAID)
+        self.assertIn(self.invoice, Invoice.objects.open())
+
+        # Raising the same allocation counts the current amount as available
+        services.allocate_payment_to_invoices(self.payment, {self.invoice.pk: Decimal("100.000")})
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.balance, Decimal("0.000"))
+        self.assertEqual(self.invoice.status, Invoice.Status.PAID)
+        self.assertNotIn(self.invoice, Invoice.objects.open())
+
+        services.clear_payment_allocations(self.payment)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.allocated_total, Decimal("0.000"))
+        self.assertEqual(self.invoice.status, Invoice.Status.SENT)
+
+    def test_deleting_an_allocated_payment_reopens_invoices(self):
+        services.allocate_payment_to_invoices(self.payment, {self.invoice.pk: Decimal("100.000")})
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.status, Invoice.Status.PAID)
+
+        self.client.force_login(get_user_model().objects.create_user("acc", password="x", is_staff=True))
+        response = self.client.post(reverse("accounting:payment_delete", args=[self.payment.pk]))
+        self.assertRedirects(response, reverse("accounting:payment_list"), fetch_redirect_response=False)
+        self.assertFalse(Payment.objects.filter(pk=self.payment.pk).exists())
+
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.allocated_total, Decimal("0.000"))
+        self.assertEqual(self.invoice.balance, Decimal("100.000"))
+        self.assertEqual(self.invoice.status, Invoice.Status.SENT)
+        self.assertFalse(Invoice.objects.allocation_mismatches().exists())
+
+    def test_over_allocation_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            services.allocate_payment_to_invoices(self.payment, {self.invoice.pk: Decimal("120.000")})
+
+    def test_mismatch_checker_and_fix(self):
+        PaymentReconciliation.objects.create(
+            payment=self.payment, invoice=self.invoice, amount=Decimal("25.000")
+        )
+        self.assertEqual(list(Invoice.objects.allocation_mismatches()), [self.invoice])
+
+        out = StringIO()
+        call_command("check_invoice_balances", "--fix", stdout=out)
+        self.assertIn("Fixed 1", out.getvalue())
+        self.assertFalse(Invoice.objects.allocation_mismatches().exists())
+
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.balance, Decimal("75.000"))
+
+
+class AutoAllocationTests(BaseInvoiceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.invoice.issued_at = date(2025, 3, 1)
+        self.invoice.due_date = date(2025, 6, 1)
+        self.invoice.save()
+        self.later = Invoice.objects.create(
+            customer=self.customer,
+            total_amount=Decimal("50.000"),
+            status=Invoice.Status.SENT,
+            issued_at=date(2025, 4, 1),
+            due_date=date(2025, 4, 15),
+        )
+
+    def test_fifo_fills_oldest_first(self):
+        result = auto_allocate_payments([self.payment], strategy=AllocationStrategy.FIFO)
+        self.assertEqual(result.total_amount, Decimal("150.000"))
+
+        self.invoice.refresh_from_db()
+        self.later.refresh_from_db()
+        self.assertEqual(self.invoice.status, Invoice.Status.PAID)
+        self.assertEqual(self.later.status, Invoice.Status.PAID)
+        self.assertFalse(Invoice.objects.allocation_mismatches().exists())
+
+    def test_due_date_and_dry_run(self):
+        self.payment.amount = Decimal("60.000")
+        self.payment.save()
+
+        preview = auto_allocate_payments([self.payment], strategy=AllocationStrategy.DUE_DATE, dry_run=True)
+        self.assertEqual(
+            [(inv, amount) for _p, inv, amount in preview.allocations],
+            [(self.later.pk, Decimal("50.000")), (self.invoice.pk, Decimal("10.000"))],
+        )
+        self.assertFalse(PaymentReconciliation.objects.exists())
+
+        auto_allocate_payments([self.payment], strategy=AllocationStrategy.DUE_DATE)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.balance, Decimal("90.000"))
+
+    def test_dry_run_takes_no_locks(self):
+        with mock.patch.object(QuerySet, "select_for_update", side_effect=AssertionError("locked")):
+            preview = auto_allocate_payments([self.payment], dry_run=True)
+        self.assertEqual(preview.total_amount, Decimal("150.000"))
+        self.assertFalse(PaymentReconciliation.objects.exists())
+
+    def test_exact_match_tops_up_existing_allocation(self):
+        services.allocate_payment_to_invoices(self.payment, {self.later.pk: Decimal("50.000")})
+
+        result = auto_allocate_payments([self.payment], strategy=AllocationStrategy.EXACT)
+        self.assertEqual(result.allocations, [(self.payment.pk, self.invoice.pk, Decimal("100.000"))])
+        self.assertEqual(PaymentReconciliation.objects.count(), 2)
+
+        # Nothing left to allocate on a second run
+        self.assertEqual(auto_allocate_payments([self.payment]).allocations, [])
+
+
+class InvoicePostingTests(BaseInvoiceTestCase):
+    def setUp(self):
+        super().setUp()
+        settings = LedgerSettings.get_solo()
+        settings.sales_journal = self.journal
+        settings.sales_receivable_account = self.cash
+        settings.sales_revenue_0_account = self.revenue
+        settings.save()
+
+        self.invoice.issued_at = date(2025, 5, 10)
+        self.invoice.save()
+
+    def test_batch_posting_reports_errors_without_aborting(self):
+        second = Invoice.objects.create(
+            customer=self.customer, total_amount=Decimal("30.000"),
+            status=Invoice.Status.SENT, issued_at=date(2025, 5, 20),
+        )
+        no_year = Invoice.objects.create(
+            customer=self.customer, total_amount=Decimal("5.000"),
+            status=Invoice.Status.SENT, issued_at=date(2030, 1, 1),
+        )
+
+        result = services.post_invoices_to_ledger(Invoice.objects.unposted(), chunk_size=2)
+        self.assertEqual(result["posted"], 2)
+        self.assertEqual(len(result["errors"]), 1)
+
+        second.refresh_from_db()
+        no_year.refresh_from_db()
+        self.assertIsNotNone(second.ledger_entry)
+        self.assertTrue(second.ledger_entry.is_balanced)
+        self.assertIsNone(no_year.ledger_entry)
+
+        totals = services.get_account_totals(date_from=date(2025, 5, 1), date_to=date(2025, 5, 31))
+        self.assertEqual(totals[self.cash.pk], (Decimal("130.000"), Decimal("0.000")))
+
+        # Re-running is idempotent
+        again = services.post_invoices_to_ledger(Invoice.objects.filter(pk=second.pk))
+        self.assertEqual((again["posted"], again["skipped"]), (0, 1))
+
+    def test_invoice_in_closed_year_does_not_abort_the_chunk(self):
+        closed = FiscalYear.objects.create(
+            year=2024, start_date=date(2024, 1, 1), end_date=date(2024, 12, 31),
+        )
+        old = Invoice.objects.create(
+            customer=self.customer, total_amount=Decimal("40.000"),
+            status=Invoice.Status.SENT, issued_at=date(2024, 6, 1),
+        )
+        FiscalYear.objects.index()  # warm the index before the year is closed
+        FiscalYear.objects.filter(pk=closed.pk).update(is_closed=True)
+
+        result = services.post_invoices_to_ledger(Invoice.objects.unposted(), chunk_size=10)
+        self.assertEqual(result["posted"], 1)
+        self.assertEqual(len(result["errors"]), 1)
+        self.assertIn(old.display_number, str(result["errors"][0]))
+
+        self.invoice.refresh_from_db()
+        old.refresh_from_db()
+        self.assertIsNotNone(self.invoice.ledger_entry)
+        self.assertIsNone(old.ledger_entry)
+        self.assertFalse(AccountPeriodBalance.objects.filter(fiscal_year=closed).exists())
+
+    def test_single_posting_matches_batch_lines(self):
+        entry = services.post_sales_invoice_to_ledger(self.invoice)
+        self.assertEqual(entry.lines.count(), 2)
+        self.assertEqual(
+            AccountPeriodBalance.objects.get(account=self.revenue).credit,
+            Decimal("100.000"),
+        )
+
+
+class CachedSettingsTests(BaseAccountingTestCase):
+    def test_get_solo_is_cached_and_invalidated_on_save(self):
+        settings = LedgerSettings.get_solo()
+        settings.sales_journal = self.journal
+        settings.save()
+
+        LedgerSettings.get_solo()  # warm
+        with self.assertNumQueries(1):  # the version lookup in the shared cache
+            cached = LedgerSettings.get_solo()
+            self.assertEqual(cached.sales_journal, self.journal)
+
+        # Changing a related row bumps the version too
+        self.journal.name = "Sales"
+        self.journal.save()
+        self.assertEqual(LedgerSettings.get_solo().sales_journal.name, "Sales")
+
+    def test_version_bumped_by_another_worker_is_seen(self):
+        self.assertNotIsInstance(caches["default"], LocMemCache)
+        LedgerSettings.get_solo()  # warm this process' copy
+
+        # Another worker saves the settings: the row changes and it bumps
+        # the version through its own cache connection.
+        LedgerSettings.objects.filter(pk=LedgerSettings.singleton_pk).update(sales_journal=self.journal)
+        other_worker = caches.create_connection("default")
+        other_worker.set(f"{LedgerSettings._solo_cache_prefix()}:version", "other-worker", timeout=None)
+
+        self.assertEqual(LedgerSettings.get_solo().sales_journal, self.journal)
+
+    def test_returned_copy_is_private(self):
+        first = LedgerSettings.get_solo()
+        first.sales_journal = self.journal  # not saved
+        self.assertIsNone(LedgerSettings.get_solo().sales_journal)
+
+
+class FiscalYearIndexTests(BaseAccountingTestCase):
+    def test_for_dates_resolves_without_queries(self):
+        fy_2026 = FiscalYear.objects.create(
+            year=2026, start_date=date(2026, 1, 1), end_date=date(2026, 12, 31)
+        )
+        FiscalYear.objects.index()  # warm
+
+        days = [date(2025, 1, 1), date(2025, 12, 31), date(2026, 6, 1), date(2024, 12, 31)]
+        with self.assertNumQueries(2):  # one shared-cache version lookup per call
+            resolved = FiscalYear.objects.for_dates(days, fallback_to_year=False)
+            by_datetime = FiscalYear.for_date(datetime(2026, 3, 1, 10, 0))
+
+        self.assertEqual(resolved[date(2025, 1, 1)], self.fy)
+        self.assertEqual(resolved[date(2025, 12, 31)], self.fy)
+        self.assertEqual(resolved[date(2026, 6, 1)], fy_2026)
+        self.assertIsNone(resolved[date(2024, 12, 31)])
+        self.assertEqual(by_datetime, fy_2026)
+
+    def test_index_is_rebuilt_after_save(self):
+        self.assertFalse(FiscalYear.for_date(date(2025, 5, 1)).is_closed)
+
+        self.fy.is_closed = True
+        self.fy.save()
+        self.assertTrue(FiscalYear.for_date(date(2025, 5, 1)).is_closed)
+
+        self.fy.end_date = date(2025, 6, 30)
+        self.fy.save()
+        self.assertIsNone(FiscalYear.for_date(date(2025, 7, 1)))
+        self.assertEqual(FiscalYear.objects.for_date(date(2025, 7, 1)), self.fy)  # calendar-year fallback
+
+    def test_posting_checks_closed_flag_in_database(self):
+        entry = self.make_entry(date(2025, 5, 1), "10.000")
+        FiscalYear.objects.index()  # warm: the year is open in this process
+
+        # Closed elsewhere (another worker): this process' index is not bumped
+        FiscalYear.objects.filter(pk=self.fy.pk).update(is_closed=True)
+        with self.assertRaises(ValidationError):
+            services.post_journal_entry(entry)
+
+
+class AccountTreeTests(BaseAccountingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.current = Account.objects.create(code="1100", name="Current", type=Account.Type.ASSET, parent=self.cash)
+        self.bank = Account.objects.create(code="1110", name="Bank", type=Account.Type.ASSET, parent=self.current)
+
+    def test_path_maintained_on_save_and_move(self):
+        self.assertEqual(self.bank.path, "1000/1100/1110/")
+        self.assertEqual(self.bank.level, 2)
+        self.assertEqual(
+            list(Account.objects.subtree(self.cash).tree_order().values_list("code", flat=True)),
+            ["1000", "1100", "1110"],
+        )
+
+        # Moving a group re-roots its whole subtree
+        self.current.parent = self.revenue
+        self.current.save()
+        self.bank.refresh_from_db()
+        self.assertEqual((self.bank.path, self.bank.level), ("4000/1100/1110/", 2))
+
+        self.revenue.parent = self.bank
+        with self.assertRaises(ValidationError):
+            self.revenue.save()
+
+    def test_rebuild_paths_after_bulk_writes(self):
+        Account.objects.filter(pk=self.bank.pk).update(path="", level=0)
+        self.assertEqual(services.rebuild_account_paths(), 1)
+        self.bank.refresh_from_db()
+        self.assertEqual(self.bank.path, "1000/1100/1110/")
+        self.assertEqual(services.rebuild_account_paths(), 0)
+
+    def test_tree_trial_balance_and_subtree_totals(self):
+        entry = JournalEntry.objects.create(fiscal_year=self.fy, journal=self.journal, date=date(2025, 5, 2))
+        JournalLine.objects.create(entry=entry, account=self.bank, debit=Decimal("70.000"))
+        JournalLine.objects.create(entry=entry, account=self.cash, debit=Decimal("30.000"))
+        JournalLine.objects.create(entry=entry, account=self.revenue, credit=Decimal("100.000"))
+        services.post_journal_entry(entry)
+
+        self.assertEqual(services.get_subtree_totals(self.cash), (Decimal("100.000"), Decimal("0.000")))
+        self.assertEqual(services.get_subtree_totals(self.current), (Decimal("70.000"), Decimal("0.000")))
+
+        tree = reports.build_trial_balance_tree(services.get_account_totals())
+        by_code = {node.code: node for node in tree}
+        self.assertEqual([node.code for node in tree], ["1000", "1100", "1110", "4000"])
+        self.assertEqual(by_code["1000"].debit, Decimal("30.000"))
+        self.assertEqual(by_code["1000"].total_debit, Decimal("100.000"))
+        self.assertTrue(by_code["1100"].is_group)
+        self.assertEqual(by_code["1100"].total_debit, Decimal("70.000"))
+
+        ledger = AccountLedger(self.cash, include_children=True)
+        self.assertEqual(len(ledger.page().lines), 2)
+        self.assertEqual(ledger.period_totals()["closing_balance"], Decimal("100.000"))
+
+        self.client.force_login(get_user_model().objects.create_user("acc", password="x", is_staff=True))
+        response = self.client.get(reverse("accounting:trial_balance"), {"as_tree": "on"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["tree"]), 4)
+        self.assertContains(response, 'data-path="1000/1100/"')
+
+
+class ChartOfAccountsImportTests(BaseAccountingTestCase):
+    HEADER = ["code", "name", "type", "parent_code", "opening_debit", "opening_credit"]
+
+    def make_workbook(self, rows):
+        wb = Workbook()
+        ws = wb.active
+        ws.append(self.HEADER)
+        for row in rows:
+            ws.append(row)
+        buf = BytesIO()
+        wb.save(buf)
+        buf.seek(0)
+        return buf
+
+    def test_bulk_import_with_parents_and_opening_balances(self):
+        file_obj = self.make_workbook([
+            ["1100", "Banks", "asset", "1000", 500, None],
+            ["3000", "Capital", "equity", None, None, 500],
+            ["1000", "Cash & Banks", "asset", None, None, None],
+            ["9999", "Bad", "nonsense", None, None, None],
+        ])
+
+        res = services.import_chart_of_accounts_from_excel(file_obj, fiscal_year=self.fy)
+        self.assertEqual((res["created"], res["updated"]), (2, 1))
+        self.assertEqual(len(res["errors"]), 1)
+
+        banks = Account.objects.get(code="1100")
+        self.assertEqual(banks.parent, self.cash)
+        self.assertEqual((banks.path, banks.level), ("1000/1100/", 1))
+        self.cash.refresh_from_db()
+        self.assertEqual(self.cash.name, "Cash & Banks")
+
+        entry = JournalEntry.objects.get(reference="OPENING-2025")
+        self.assertTrue(entry.is_balanced)
+        totals = services.get_account_totals(date_to=date(2024, 12, 31))
+        self.assertEqual(totals[banks.pk], (Decimal("500.000"), Decimal("0.000")))
+
+    def test_dry_run_returns_diff_without_writing(self):
+        file_obj = self.make_workbook([
+            ["1000", "Cash", "asset", None, None, None],
+            ["4000", "Revenue", "revenue", "1000", None, None],
+            ["5000", "Expenses", "expense", None, None, None],
+        ])
+
+        res = services.import_chart_of_accounts_from_excel(file_obj, replace_existing=True, dry_run=True)
+        self.assertTrue(res["dry_run"])
+        self.assertEqual((res["created"], res["updated"]), (1, 1))
+        changes = {row["code"]: row["changes"] for row in res["diff"]}
+        self.assertEqual(changes["4000"]["name"], ("Sales", "Revenue"))
+        self.assertEqual(changes["4000"]["parent"], (None, "1000"))
+        self.assertFalse(Account.objects.filter(code="5000").exists())
+        self.revenue.refresh_from_db()
+        self.assertEqual(self.revenue.name, "Sales")
+
+
+class ExportHelpersTests(BaseAccountingTestCase):
+    def test_queryset_rows_and_streaming_csv(self):
+        Account.objects.create(code="1100", name="Banks", type=Account.Type.ASSET, parent=self.cash)
+        rows = exports.queryset_rows(
+            Account.objects.order_by("code"),
+            ["code", "parent__code", "is_active"],
+            transform=lambda r: (r[0], r[1] or "", int(r[2])),
+            chunk_size=1,
+        )
+        response = exports.export_response("csv", "accounts", ["code", "parent_code", "is_active"], rows)
+        self.assertTrue(response.streaming)
+
+        content = b"".join(response.streaming_content).decode("utf-8").lstrip("\ufeff")
+        self.assertEqual(
+            content.splitlines(),
+            ["code,parent_code,is_active", "1000,,1", "1100,1000,1", "4000,,1"],
+        )
+
+    def test_xlsx_export_is_write_only_workbook(self):
+        rows = exports.queryset_rows(Account.objects.order_by("code"), ["code", "name"])
+        response = exports.export_response("xlsx", "accounts", ["code", "name"], rows, sheet_title="Accounts")
+        self.assertEqual(response["Content-Type"], exports.XLSX_CONTENT_TYPE)
+
+        wb = load_workbook(BytesIO(b"".join(response.streaming_content)), read_only=True)
+        values = list(wb["Accounts"].iter_rows(values_only=True))
+        self.assertEqual(values[0], ("code", "name"))
+        self.assertEqual(values[1], ("1000", "Cash"))
+
+    def test_xlsx_export_accepts_lazy_translations(self):
+        rows = [("1000", gettext_lazy("Cash"))]
+        response = exports.export_response("xlsx", "accounts", [gettext_lazy("Code"), gettext_lazy("Name")], rows)
+
+        wb = load_workbook(BytesIO(b"".join(response.streaming_content)), read_only=True)
+        values = list(wb.active.iter_rows(values_only=True))
+        self.assertEqual(values, [("Code", "Name"), ("1000", "Cash")])
+
+
+class DashboardMetricsTests(BaseInvoiceTestCase):
+    def test_single_pass_metrics_are_cached_and_invalidated(self):
+        Invoice.objects.create(
+            customer=self.customer, type=Invoice.InvoiceType.PURCHASE,
+            total_amount=Decimal("40.000"), status=Invoice.Status.SENT,
+        )
+
+        first = reports.get_dashboard_metrics()
+        self.assertFalse(first["dashboard_from_cache"])
+        self.assertEqual(first["invoices_count"], 2)
+        self.assertEqual(first["sales_total_amount"], Decimal("100.000"))
+        self.assertEqual(first["purchase_total_amount"], Decimal("40.000"))
+        self.assertEqual(first["payments_receipt_total"], Decimal("150.000"))
+        self.assertIn("dashboard_compute_ms", first)
+
+        with self.assertNumQueriesOutsideCache(0):
+            self.assertTrue(reports.get_dashboard_metrics()["dashboard_from_cache"])
+
+        self.invoice.total_amount = Decimal("120.000")
+        self.invoice.save()
+        refreshed = reports.get_dashboard_metrics()
+        self.assertFalse(refreshed["dashboard_from_cache"])
+        self.assertEqual(refreshed["sales_total_amount"], Decimal("120.000"))
+
+    def test_dashboard_view_renders_snapshot(self):
+        user = get_user_model().objects.create_user("acc", password="x", is_staff=True)
+        self.client.force_login(user)
+
+        response = self.client.get(reverse("accounting:dashboard"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("dashboard_compute_ms", response.context)
+
+
+class AgingReportTests(BaseInvoiceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.as_of = date(2025, 6, 30)
+        Invoice.objects.filter(pk=self.invoice.pk).update(
+            issued_at=date(2025, 6, 1), due_date=date(2025, 7, 10),
+        )
+        self.overdue_15 = Invoice.objects.create(
+            customer=self.customer, total_amount=Decimal("50.000"), status=Invoice.Status.SENT,
+            issued_at=date(2025, 5, 15), due_date=date(2025, 6, 15),
+        )
+        self.overdue_120 = Invoice.objects.create(
+            customer=self.customer, total_amount=Decimal("80.000"), status=Invoice.Status.SENT,
+            issued_at=date(2025, 3, 2), due_date=None,
+        )
+        self.payment.date = date(2025, 6, 20)
+        self.payment.save()
+        services.allocate_payment_to_invoices(self.payment, {self.overdue_120.pk: Decimal("30.000")})
+
+        later = Payment.objects.create(
+            contact=self.customer, method=self.method, amount=Decimal("50.000"), date=date(2025, 7, 5),
+        )
+        services.allocate_payment_to_invoices(later, {self.overdue_15.pk: Decimal("50.000")})
+
+    def test_buckets_use_allocations_dated_up_to_as_of(self):
+        with self.assertNumQueries(1):
+            report = reports.compute_aging_report(reports.AGING_RECEIVABLE, as_of=self.as_of)
+
+        self.assertEqual(len(report.rows), 1)
+        row = report.rows[0]
+        self.assertEqual(row.invoices_count, 3)
+        self.assertEqual(row.buckets["current"], Decimal("100.000"))
+        self.assertEqual(row.buckets["days_1_30"], Decimal("50.000"))  # paid only on 2025-07-05
+        self.assertEqual(row.buckets["days_31_60"], Decimal("0.000"))
+        self.assertEqual(row.buckets["days_over_90"], Decimal("50.000"))
+        self.assertEqual(report.total, Decimal("200.000"))
+
+        # Issued after as_of -> not in the report; payables are a separate kind
+        early = reports.compute_aging_report(reports.AGING_RECEIVABLE, as_of=date(2025, 4, 1))
+        self.assertEqual(early.total, Decimal("80.000"))
+        self.assertEqual(reports.compute_aging_report(reports.AGING_PAYABLE, as_of=self.as_of).rows, [])
+
+    def test_cached_until_invoice_changes(self):
+        first = reports.get_aging_report(as_of=self.as_of)
+        self.assertFalse(first.from_cache)
+
+        with self.assertNumQueriesOutsideCache(0):
+            self.assertTrue(reports.get_aging_report(as_of=self.as_of).from_cache)
+
+        self.invoice.refresh_from_db()
+        self.invoice.total_amount = Decimal("110.000")
+        self.invoice.save()
+        refreshed = reports.get_aging_report(as_of=self.as_of)
+        self.assertFalse(refreshed.from_cache)
+        self.assertEqual(refreshed.totals["current"], Decimal("110.000"))
+
+        # A change saved by another worker bumps the version through its own
+        # connection to the shared cache.
+        other_worker = caches.create_connection("default")
+        other_worker.set(reports.AGING_CACHE_VERSION_KEY, "other-worker", timeout=None)
+        self.assertFalse(reports.get_aging_report(as_of=self.as_of).from_cache)
+
+    def test_view_and_csv_export(self):
+        user = get_user_model().objects.create_user("acc", password="x", is_staff=True)
+        self.client.force_login(user)
+        url = reverse("accounting:aging_report")
+
+        response = self.client.get(url, {"kind": "receivable", "as_of": "2025-06-30"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["report"].total, Decimal("200.000"))
+
+        response = self.client.get(url, {"kind": "receivable", "as_of": "2025-06-30", "format": "csv"})
+        lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        self.assertEqual(len(lines), 2)
+        name, *amounts = lines[1].split(",")
+        self.assertEqual(name, "Customer")
+        self.assertEqual([Decimal(a) for a in amounts], [100, 50, 0, 0, 50, 200])
+
+
+class FinancialStatementTests(BaseAccountingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.expense = Account.objects.create(code="5000", name="Rent", type=Account.Type.EXPENSE)
+        self.make_entry(date(2025, 3, 10), "100.000", posted=True)
+        self.make_entry(date(2025, 4, 5), "250.000", posted=True)
+
+        entry = JournalEntry.objects.create(fiscal_year=self.fy, journal=self.journal, date=date(2025, 4, 20))
+        JournalLine.objects.create(entry=entry, account=self.expense, debit=Decimal("40.000"))
+        JournalLine.objects.create(entry=entry, account=self.cash, credit=Decimal("40.000"))
+        services.post_journal_entry(entry)
+
+    def test_income_statement_month_over_month_in_one_query(self):
+        columns = statements.monthly_columns(2025, 4, 2)
+        self.assertEqual([c.label for c in columns], ["2025-04", "2025-03"])
+
+        # + the (empty) year-end closing entries
+        with self.assertNumQueries(2):
+            statement = statements.income_statement(columns)
+
+        revenue, expense = statement.sections
+        self.assertEqual(revenue.totals, [Decimal("250.000"), Decimal("100.000")])
+        self.assertEqual(expense.totals, [Decimal("40.000"), Decimal("0.000")])
+        self.assertEqual(statement.summary[0][1], [Decimal("210.000"), Decimal("100.000")])
+
+    def test_balance_sheet_includes_unclosed_earnings_and_balances(self):
+        statement = statements.balance_sheet(statements.monthly_columns(2025, 4, 2))
+        assets, _liabilities, equity = statement.sections
+
+        self.assertEqual(assets.totals, [Decimal("310.000"), Decimal("100.000")])
+        self.assertEqual(equity.totals, [Decimal("310.000"), Decimal("100.000")])
+        self.assertEqual(statement.summary[-1][1], [Decimal("0.000"), Decimal("0.000")])
+
+        # Year over year: April 2024 has no history
+        yoy = statements.balance_sheet(statements.yearly_columns(2025, 4, 2))
+        self.assertEqual(yoy.sections[0].totals, [Decimal("310.000"), Decimal("0.000")])
+
+    def test_view_html_and_xlsx(self):
+        self.client.force_login(get_user_model().objects.create_user("acc", password="x", is_staff=True))
+        url = reverse("accounting:financial_statements")
+        params = {"statement": "income", "compare": "mom", "month": "2025-04", "periods": 2}
+
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["statement"].columns), 2)
+
+        response = self.client.get(url, {**params, "format": "xlsx"})
+        wb = load_workbook(BytesIO(b"".join(response.streaming_content)), read_only=True)
+        rows = list(wb["income"].iter_rows(values_only=True))
+        self.assertEqual(rows[0][2:], ("2025-04", "2025-03"))
+        self.assertEqual(rows[-1][2:], (210, 100))
+
+
+class ComparativeTrialBalanceTests(BaseAccountingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.make_entry(date(2025, 3, 10), "100.000", posted=True)
+        self.make_entry(date(2025, 4, 5), "250.000", posted=True)
+        self.make_entry(date(2025, 4, 6), "5.000")  # draft, ignored
+        self.columns = statements.monthly_columns(2025, 4, 3)
+
+    def test_periods_pivoted_from_one_grouped_query(self):
+        # + the (empty) year-end closing entries
+        with self.assertNumQueries(2):
+            report = reports.compute_comparative_trial_balance(self.columns)
+
+        self.assertEqual([row.code for row in report.rows], ["1000", "4000"])
+        cash = report.rows[0]
+        self.assertEqual(cash.balances, [Decimal("250.000"), Decimal("100.000"), Decimal("0.000")])
+        self.assertTrue(report.is_balanced)
+
+    def test_cached_per_ledger_version(self):
+        self.assertFalse(reports.get_comparative_trial_balance(self.columns).from_cache)
+        with self.assertNumQueriesOutsideCache(0):
+            self.assertTrue(reports.get_comparative_trial_balance(self.columns).from_cache)
+
+        self.make_entry(date(2025, 4, 9), "10.000", posted=True)
+        report = reports.get_comparative_trial_balance(self.columns)
+        self.assertFalse(report.from_cache)
+        self.assertEqual(report.rows[0].balances[0], Decimal("260.000"))
+
+    def test_posting_in_another_worker_invalidates_cached_report(self):
+        reports.get_comparative_trial_balance(self.columns)  # cached by this worker
+
+        # Another worker posts: its ledger version bump goes through its own
+        # connection to the shared cache.
+        other_worker = caches.create_connection("default")
+        other_worker.set(services.LEDGER_VERSION_KEY, "other-worker", timeout=None)
+        self.assertFalse(reports.get_comparative_trial_balance(self.columns).from_cache)
+
+    def test_view_comparative_mode_and_export(self):
+        self.client.force_login(get_user_model().objects.create_user("acc", password="x", is_staff=True))
+        params = {"compare": "mom", "month": "2025-04", "periods": 2}
+        response = self.client.get(reverse("accounting:trial_balance"), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["comparative"].columns), 2)
+
+        response = self.client.get(reverse("accounting:trial_balance"), {**params, "format": "csv"})
+        lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        self.assertEqual(lines[1].split(",")[:4], ["1000", "Cash", "250.000", "0.000"])
+
+
+class DeferredInvoiceTotalsTests(BaseInvoiceTestCase):
+    def test_items_saved_individually_still_recalculate(self):
+        item = InvoiceItem.objects.create(
+            invoice=self.invoice, description="A", quantity=Decimal("2.00"), unit_price=Decimal("1.250"),
+        )
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.total_amount, Decimal("2.500"))
+
+        item.delete()
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.total_amount, Decimal("0.000"))
+
+    def test_deferred_block_recalculates_once(self):
+        # inserts + one SUM + status snapshot (StatefulDomainModel) + one UPDATE
+        with self.assertNumQueriesOutsideCache(20 + 3):
+            with self.invoice.deferred_totals():
+                with self.invoice.deferred_totals():  # nested: no extra work
+                    for i in range(20):
+                        InvoiceItem.objects.create(
+                            invoice_id=self.invoice.pk, description=f"L{i}",
+                            quantity=Decimal("1.50"), unit_price=Decimal("2.000"),
+                        )
+
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.total_amount, Decimal("60.000"))
+        self.assertEqual(self.invoice.balance, Decimal("60.000"))
+
+    def test_exception_skips_recalculation(self):
+        with self.assertRaises(RuntimeError):
+            with self.invoice.deferred_totals():
+                InvoiceItem.objects.create(invoice=self.invoice, description="X", unit_price=Decimal("5.000"))
+                raise RuntimeError
+
+        self.assertFalse(Invoice.totals_deferred(self.invoice.pk))
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.total_amount, Decimal("100.000"))
+
+
+class FiscalYearClosingTests(BaseAccountingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.next_fy = FiscalYear.objects.create(
+            year=2026, start_date=date(2026, 1, 1), end_date=date(2026, 12, 31),
+        )
+        self.expense = Account.objects.create(code="5000", name="Rent", type=Account.Type.EXPENSE)
+        self.retained = Account.objects.create(code="3100", name="Retained", type=Account.Type.EQUITY)
+        settings_obj = LedgerSettings.get_solo()
+        settings_obj.retained_earnings_account = self.retained
+        settings_obj.save()
+
+        self.make_entry(date(2025, 3, 10), "300.000", posted=True)
+        entry = JournalEntry.objects.create(fiscal_year=self.fy, journal=self.journal, date=date(2025, 6, 1))
+        JournalLine.objects.create(entry=entry, account=self.expense, debit=Decimal("120.000"))
+        JournalLine.objects.create(entry=entry, account=self.cash, credit=Decimal("120.000"))
+        services.post_journal_entry(entry)
+
+    def test_close_moves_pl_to_retained_earnings_and_carries_forward(self):
+        result = services.close_fiscal_year(self.fy)
+        self.fy.refresh_from_db()
+        self.assertTrue(self.fy.is_closed)
+        self.assertEqual(self.fy.closing_entry, result["closing_entry"])
+
+        closing = result["closing_entry"]
+        self.assertTrue(closing.posted)
+        self.assertEqual(closing.date, date(2025, 12, 31))
+        self.assertTrue(closing.is_balanced)
+        self.assertEqual(
+            {line.account_id: line.credit - line.debit for line in closing.lines.all()},
+            {self.revenue.pk: Decimal("-300.000"), self.expense.pk: Decimal("120.000"), self.retained.pk: Decimal("180.000")},
+        )
+
+        opening = result["opening_entry"]
+        self.assertEqual((opening.fiscal_year, opening.date), (self.next_fy, date(2026, 1, 1)))
+        self.assertEqual(
+            {line.account_id: line.debit - line.credit for line in opening.lines.all()},
+            {self.cash.pk: Decimal("180.000"), self.retained.pk: Decimal("-180.000")},
+        )
+
+        # The carried balances are not counted twice
+        totals = services.get_account_totals(date_to=date(2026, 6, 30))
+        self.assertEqual(totals[self.cash.pk], (Decimal("180.000"), Decimal("0.000")))
+        self.assertNotIn(self.revenue.pk, totals)
+
+        ledger = AccountLedger(self.cash, date_to=date(2026, 6, 30))
+        self.assertEqual(ledger.opening_balance(), Decimal("0.000"))
+        self.assertEqual(ledger.period_totals()["closing_balance"], Decimal("180.000"))
+
+        sheet = statements.balance_sheet(statements.monthly_columns(2026, 1, 1))
+        self.assertEqual(sheet.sections[0].totals, [Decimal("180.000")])
+        self.assertEqual(sheet.summary[-1][1], [Decimal("0.000")])
+
+    def test_closed_year_is_frozen(self):
+        draft = self.make_entry(date(2025, 7, 1), "10.000")
+        with self.assertRaises(ValidationError):
+            services.close_fiscal_year(self.fy)  # draft left in the year
+        draft.delete()
+
+        services.close_fiscal_year(self.fy)
+        with self.assertRaises(ValidationError):
+            services.close_fiscal_year(self.fy)
+
+        entry = JournalEntry.objects.filter(fiscal_year=self.fy, reference="").first()
+        with self.assertRaises(ValidationError):
+            services.unpost_journal_entry(entry)
+
+        before = AccountPeriodBalance.objects.filter(fiscal_year=self.fy).count()
+        self.assertEqual(services.rebuild_account_balances(fiscal_year=self.fy), 0)
+        services.rebuild_account_balances()
+        self.assertEqual(AccountPeriodBalance.objects.filter(fiscal_year=self.fy).count(), before)
+
+    def test_requires_retained_earnings_account_and_next_year(self):
+        settings_obj = LedgerSettings.get_solo()
+        settings_obj.retained_earnings_account = None
+        settings_obj.save()
+        with self.assertRaises(ValidationError):
+            services.close_fiscal_year(self.fy)
+
+        settings_obj.retained_earnings_account = self.retained
+        settings_obj.save()
+        self.next_fy.delete()
+        with self.assertRaises(ValidationError):
+            services.close_fiscal_year(self.fy)
+        self.assertFalse(FiscalYear.objects.get(pk=self.fy.pk).is_closed)
+
+    def test_closing_leaves_the_income_statement_unchanged(self):
+        entry = JournalEntry.objects.create(fiscal_year=self.fy, journal=self.journal, date=date(2025, 12, 5))
+        JournalLine.objects.create(entry=entry, account=self.cash, debit=Decimal("50.000"))
+        JournalLine.objects.create(entry=entry, account=self.revenue, credit=Decimal("50.000"))
+        services.post_journal_entry(entry)
+
+        columns = statements.monthly_columns(2025, 12, 12)
+        before = statements.income_statement(columns)
+        trial_before = reports.compute_comparative_trial_balance(columns)
+
+        services.close_fiscal_year(self.fy)
+
+        after = statements.income_statement(columns)
+        self.assertEqual(after.summary, before.summary)
+        self.assertEqual(after.summary[0][1][0], Decimal("50.000"))  # December
+        self.assertEqual([s.totals for s in after.sections], [s.totals for s in before.sections])
+
+        trial_after = reports.compute_comparative_trial_balance(columns)
+        self.assertEqual(trial_after.totals, trial_before.totals)
+        self.assertEqual(
+            [(row.code, row.pairs) for row in trial_after.rows],
+            [(row.code, row.pairs) for row in trial_before.rows],
+        )
+
+        # The balance sheet still sees the closing entry: earnings moved to retained
+        sheet = statements.balance_sheet(statements.monthly_columns(2025, 12, 1))
+        self.assertEqual(sheet.summary[-1][1], [Decimal("0.000")])
+
+    def test_reopen_then_close_again_carries_forward_once(self):
+        self.assertNotIn("is_closed", FiscalYearForm().fields)
+
+        services.close_fiscal_year(self.fy)
+        self.assertEqual(services.reopen_fiscal_year(self.fy), 2)
+        self.fy.refresh_from_db()
+        self.assertFalse(self.fy.is_closed)
+        self.assertIsNone(self.fy.opening_entry)
+        self.assertFalse(JournalEntry.objects.filter(fiscal_year=self.next_fy).exists())
+        self.assertFalse(JournalEntry.objects.filter(reference="CLOSING-2025").exists())
+        self.assertEqual(services.get_account_totals(date_to=date(2025, 12, 31))[self.revenue.pk][1], Decimal("300.000"))
+
+        services.close_fiscal_year(self.fy)
+        self.assertEqual(JournalEntry.objects.filter(fiscal_year=self.next_fy).count(), 1)
+        totals = services.get_account_totals(date_to=date(2026, 6, 30))
+        self.assertEqual(totals[self.cash.pk], (Decimal("180.000"), Decimal("0.000")))
+
+    def test_close_refused_while_next_year_has_an_opening_entry(self):
+        services.close_fiscal_year(self.fy)
+        # Old path: the year unticked as closed, its carry-forward left behind
+        FiscalYear.objects.filter(pk=self.fy.pk).update(is_closed=False)
+        with self.assertRaises(ValidationError):
+            services.close_fiscal_year(self.fy)
+
+        FiscalYear.objects.filter(pk=self.fy.pk).update(opening_entry=None, closing_entry=None)
+        with self.assertRaises(ValidationError):
+            services.close_fiscal_year(self.fy)
+        self.assertEqual(JournalEntry.objects.filter(fiscal_year=self.next_fy).count(), 1)
+
+    def test_reopen_refused_while_a_later_year_is_closed(self):
+        services.close_fiscal_year(self.fy)
+        FiscalYear.objects.filter(pk=self.next_fy.pk).update(is_closed=True)
+        with self.assertRaises(ValidationError):
+            services.reopen_fiscal_year(self.fy)
+
+    def test_reopen_view(self):
+        services.close_fiscal_year(self.fy)
+        self.client.force_login(get_user_model().objects.create_user("acc", password="x", is_staff=True))
+        response = self.client.post(reverse("accounting:fiscal_year_reopen", args=[self.fy.pk]))
+        self.assertRedirects(response, reverse("accounting:fiscal_year_list"), fetch_redirect_response=False)
+        self.assertFalse(FiscalYear.objects.get(pk=self.fy.pk).is_closed)
+
+    def test_post_and_unpost_views_report_closed_year(self):
+        draft = self.make_entry(date(2025, 7, 1), "10.000")
+        posted = JournalEntry.objects.filter(fiscal_year=self.fy, posted=True).first()
+        FiscalYear.objects.filter(pk=self.fy.pk).update(is_closed=True)
+        self.client.force_login(get_user_model().objects.create_user("acc", password="x", is_staff=True))
+
+        for name, entry in (("journal_entry_post", draft), ("journal_entry_unpost", posted)):
+            response = self.client.post(reverse(f"accounting:{name}", args=[entry.pk]), follow=False)
+            self.assertRedirects(
+                response, reverse("accounting:journal_entry_detail", args=[entry.pk]),
+                fetch_redirect_response=False,
+            )
+            messages = [str(m) for m in response.wsgi_request._messages]
+            self.assertEqual(messages[-1], "السنة المالية لهذا القيد مقفلة.")
+
+        draft.refresh_from_db()
+        posted.refresh_from_db()
+        self.assertFalse(draft.posted)
+        self.assertTrue(posted.posted)
+
+
+class JournalLineWriterTests(BaseAccountingTestCase):
+    def lines(self, *amounts):
+        result = []
+        for amount in amounts:
+            result.append({"account": self.cash, "debit": Decimal(amount), "credit": Decimal("0.000")})
+            result.append({"account": self.revenue, "debit": Decimal("0.000"), "credit": Decimal(amount)})
+        return [dict(line, order=i) for i, line in enumerate(result)]
+
+    def test_new_entry_lines_written_in_one_insert(self):
+        entry = JournalEntry.objects.create(fiscal_year=self.fy, journal=self.journal, date=date(2025, 5, 1))
+        # savepoint + existing lines + one INSERT + release
+        with self.assertNumQueries(4):
+            result = services.write_journal_lines(entry, self.lines(*["1.000"] * 50))
+        self.assertEqual(result, {"created": 100, "updated": 0, "deleted": 0})
+        self.assertTrue(entry.is_balanced)
+
+    def test_update_is_a_diff_and_keeps_unchanged_lines(self):
+        entry = JournalEntry.objects.create(fiscal_year=self.fy, journal=self.journal, date=date(2025, 5, 1))
+        services.write_journal_lines(entry, self.lines("10.000", "20.000", "30.000"))
+        ids = list(entry.lines.values_list("pk", flat=True))
+
+        result = services.write_journal_lines(entry, self.lines("10.000", "25.000"))
+        self.assertEqual(result, {"created": 0, "updated": 2, "deleted": 2})
+        self.assertEqual(list(entry.lines.values_list("pk", flat=True)), ids[:4])
+        self.assertEqual(entry.lines.get(pk=ids[2]).debit, Decimal("25.000"))
+
+    def test_invalid_lines_write_nothing(self):
+        entry = JournalEntry.objects.create(fiscal_year=self.fy, journal=self.journal, date=date(2025, 5, 1))
+        unbalanced = self.lines("10.000")[:1]
+        with self.assertRaises(ValidationError):
+            services.write_journal_lines(entry, unbalanced)
+        with self.assertRaises(ValidationError):
+            services.write_journal_lines(entry, [
+                {"account": self.cash, "debit": Decimal("5.000"), "credit": Decimal("5.000")},
+            ])
+        self.assertFalse(entry.lines.exists())
+
+
+class JournalEntryTotalsTests(BaseAccountingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.balanced = self.make_entry(date(2025, 2, 1), "50.000", posted=True)
+        self.unbalanced = JournalEntry.objects.create(fiscal_year=self.fy, journal=self.journal, date=date(2025, 2, 2))
+        JournalLine.objects.create(entry=self.unbalanced, account=self.cash, debit=Decimal("30.000"))
+        JournalLine.objects.create(entry=self.unbalanced, account=self.revenue, credit=Decimal("20.000"))
+
+    def test_properties_read_annotations(self):
+        entries = list(JournalEntry.objects.with_totals().order_by("date"))
+        with self.assertNumQueries(0):
+            self.assertEqual([e.total_debit for e in entries], [Decimal("50.000"), Decimal("30.000")])
+            self.assertEqual([e.is_balanced for e in entries], [True, False])
+            self.assertEqual(entries[1].imbalance, Decimal("10.000"))
+
+        # Without the annotation the properties still aggregate
+        self.assertEqual(JournalEntry.objects.get(pk=self.unbalanced.pk).total_credit, Decimal("20.000"))
+
+    def test_unbalanced_filter_in_sql(self):
+        qs = JournalEntry.objects.unbalanced()
+        self.assertIn("HAVING", str(qs.query))
+        self.assertEqual(list(qs), [self.unbalanced])
+
+    def test_list_view_queries_do_not_grow_with_entries(self):
+        self.client.force_login(get_user_model().objects.create_user("acc", password="x", is_staff=True))
+        url = reverse("accounting:journal_entry_list")
+
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(url)
+        for day in range(3, 13):
+            self.make_entry(date(2025, 2, day), "1.000")
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(url)
+        self.assertEqual(len(after), len(before))
+
+        response = self.client.get(url, {"balance": "unbalanced"})
+        self.assertEqual(list(response.context["entries"]), [self.unbalanced])
+
+        response = self.client.get(reverse("accounting:journal_entry_detail", args=[self.unbalanced.pk]))
+        self.assertContains(response, "القيد غير متوازن")
+
+
+class JournalLineReconciliationTests(BaseAccountingTestCase):
+    def setUp(self):
+        super().setUp()
+        from banking.models import BankAccount, BankStatement, BankStatementLine
+
+        self.bank_account = BankAccount.objects.create(name="Bank", account=self.cash)
+        statement = BankStatement.objects.create(
+            bank_account=self.bank_account, name="Jan", date=date(2025, 1, 31),
+            start_balance=Decimal("0.000"), end_balance=Decimal("150.000"),
+        )
+        self.bank_line = BankStatementLine.objects.create(
+            statement=statement, date=date(2025, 1, 5), label="Deposit", amount=Decimal("150.000"),
+        )
+        self.entries = [self.make_entry(date(2025, 1, day), "100.000", posted=True) for day in (2, 3, 4)]
+        self.lines = [entry.lines.get(account=self.cash) for entry in self.entries]
+
+    def reconcile(self, line, amount):
+        from banking.models import BankReconciliation
+
+        return BankReconciliation.objects.create(
+            bank_line=self.bank_line, journal_item=line, amount_reconciled=Decimal(amount),
+        )
+
+    def test_annotations_and_maintained_total(self):
+        self.reconcile(self.lines[0], "100.000")
+        rec = self.reconcile(self.lines[1], "40.000")
+
+        lines = list(JournalLine.objects.filter(account=self.cash).with_reconciliation().order_by("entry__date"))
+        with self.assertNumQueries(0):
+            self.assertEqual([l.amount_open for l in lines], [Decimal("0.000"), Decimal("60.000"), Decimal("100.000")])
+            self.assertEqual([l.is_fully_reconciled for l in lines], [True, False, False])
+
+        self.assertEqual(
+            list(JournalLine.objects.filter(account=self.cash).values_list("amount_reconciled_total", "reconciled")),
+            [(Decimal("100.000"), True), (Decimal("40.000"), False), (Decimal("0.000"), False)],
+        )
+        self.assertEqual(
+            list(JournalLine.objects.filter(account=self.cash).open_items().order_by("amount_reconciled_total")),
+            [self.lines[2], self.lines[1]],
+        )
+
+        rec.delete()
+        self.lines[1].refresh_from_db()
+        self.assertEqual(self.lines[1].amount_reconciled_total, Decimal("0.000"))
+
+    def test_dashboard_and_perform_reconciliation(self):
+        self.client.force_login(get_user_model().objects.create_user("acc", password="x", is_staff=True))
+        response = self.client.post(
+            reverse("banking:reconcile_perform"),
+            data={"bank_line_id": self.bank_line.pk, "journal_item_id": self.lines[0].pk, "amount": "100.000"},
+            content_type="application/json",
+        )
+        self.assertEqual(Decimal(response.json()["journal_item_open_amount"]), Decimal("0.000"))
+        self.assertTrue(response.json()["journal_item_reconciled"])
+
+        response = self.client.get(reverse("banking:reconciliation_dashboard", args=[self.bank_account.pk]))
+        self.assertEqual(list(response.context["journal_items"]), self.lines[1:])
+
+
+class GeneralLedgerExportTests(BaseAccountingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.entries = [self.make_entry(date(2025, 1, day), f"{day}.000", posted=True) for day in (5, 6, 7)]
+        self.make_entry(date(2025, 1, 8), "1.000")  # draft
+
+    def test_rows_stream_with_progress(self):
+        seen = []
+        rows = ledger_export.general_ledger_rows(
+            ledger_export.general_ledger_queryset(), progress=seen.append, progress_every=4,
+        )
+        rows = list(rows)
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(seen, [4, 6])
+        self.assertEqual(dict(zip(ledger_export.GL_HEADER, rows[0]))["account_code"], "1000")
+
+        drafts = ledger_export.general_ledger_queryset(posted_only=False)
+        self.assertEqual(drafts.count(), 8)
+
+    def test_view_csv_and_saft_xml(self):
+        import xml.etree.ElementTree as ET
+
+        self.client.force_login(get_user_model().objects.create_user("acc", password="x", is_staff=True))
+        url = reverse("accounting:general_ledger_export")
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        response = self.client.get(url, {"format": "csv", "fiscal_year": self.fy.pk})
+        lines = b"".join(response.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual(lines[0].split(",")[:2], ["entry_id", "date"])
+        self.assertEqual(len(lines), 7)
+
+        response = self.client.get(url, {"format": "xml"})
+        root = ET.fromstring(b"".join(response.streaming_content))
+        ns = {"s": ledger_export.SAFT_NAMESPACE}
+        entries = root.find("s:GeneralLedgerEntries", ns)
+        self.assertEqual(entries.findtext("s:NumberOfEntries", namespaces=ns), "3")
+        self.assertEqual(entries.findtext("s:TotalDebit", namespaces=ns), "18.000")
+        self.assertEqual(len(entries.findall("s:Journal/s:Transaction", ns)), 3)
+        self.assertEqual(len(entries.findall("s:Journal/s:Transaction/s:Line", ns)), 6)
+
+    def test_management_command(self):
+        import os
+        import tempfile
+
+        out, err = StringIO(), StringIO()
+        call_command("export_general_ledger", "--year", "2025", stdout=out, stderr=err)
+        self.assertEqual(len(out.getvalue().lstrip("\ufeff").splitlines()), 7)
+        self.assertIn("6 lines", err.getvalue())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "gl.xlsx")
+            call_command("export_general_ledger", "--format", "xlsx", "--output", path, stderr=StringIO())
+            rows = list(load_workbook(path, read_only=True).active.iter_rows(values_only=True))
+        self.assertEqual(len(rows), 7)
+
+
+class SeedAccountingDemoTests(BaseAccountingTestCase):
+    def test_seeded_entries_reach_the_period_balances(self):
+        get_user_model().objects.create_superuser("admin", password="x")
+        for code, account_type in (
+            ("1112", Account.Type.ASSET), ("1120", Account.Type.ASSET), ("1125", Account.Type.ASSET),
+            ("2110", Account.Type.LIABILITY), ("2130", Account.Type.LIABILITY), ("3200", Account.Type.EQUITY),
+            ("4100", Account.Type.REVENUE), ("5100", Account.Type.EXPENSE),
+        ):
+            Account.objects.create(code=code, name=code, type=account_type)
+
+        call_command("seed_accounting_demo", stdout=StringIO())
+
+        posted = JournalEntry.objects.filter(posted=True)
+        self.assertEqual(posted.count(), 4)
+        self.assertTrue(all(entry.posted_by_id for entry in posted))
+
+        totals = services.get_account_totals()
+        self.assertEqual(totals[Account.objects.get(code="4100").pk], (Decimal("0.000"), Decimal("1000.000")))
+        balances = AccountPeriodBalance.objects.values_list("account_id", "debit", "credit").order_by("account_id")
+        before = list(balances)
+        services.rebuild_account_balances()
+        self.assertEqual(list(balances), before)
@@ -86,7 +86,11 @@ urlpatterns = [
     # Reports
     # =========================================
     path("reports/trial-balance/", views.trial_balance_view, name="trial_balance"),
+    path("reports/aging/", views.aging_report_view, name="aging_report"),
+    path("reports/statements/", views.financial_statements_view, name="financial_statements"),
     path("reports/account-ledger/", views.account_ledger_view, name="account_ledger"),
+    path("reports/account-ledger/export/", views.account_ledger_export_view, name="account_ledger_export"),
+    path("reports/general-ledger/export/", views.general_ledger_export_view, name="general_ledger_export"),
 
     # =========================================
     # Settings & Setup
@@ -96,6 +100,7 @@ urlpatterns = [
     path("settings/fiscal-years/new/", views.FiscalYearCreateView.as_view(), name="fiscal_year_create"),
     path("settings/fiscal-years/<int:pk>/edit/", views.FiscalYearUpdateView.as_view(), name="fiscal_year_edit"),
     path("settings/fiscal-years/<int:pk>/close/", views.FiscalYearCloseView.as_view(), name="fiscal_year_close"),
+    path("settings/fiscal-years/<int:pk>/reopen/", views.FiscalYearReopenView.as_view(), name="fiscal_year_reopen"),
 
     # Chart Import/Export & Setup
     path("settings/chart-of-accounts/bootstrap/", views.chart_of_accounts_bootstrap_view,
@@ -7,9 +7,8 @@ from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.core.exceptions import ValidationError
 from django.db import transaction
-from django.db.models import Q, Sum, Value, DecimalField, F
-from django.db.models.functions import Coalesce
-from django.http import HttpResponse, HttpResponseRedirect
+from django.db.models import Q, F, Prefetch
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
@@ -23,18 +22,21 @@ from django.views.generic import (
     UpdateView,
     DeleteView, FormView,
 )
-from openpyxl import Workbook
-from openpyxl.styles import Font
 
 from contacts.models import Contact
 
+from core.services.exports import export_response, queryset_rows
 from core.views.attachments import AttachmentPanelMixin  # (لو تحتاجه لاحقاً)
+from inventory.utils import render_pdf_view
 from .mixins import ProductJsonMixin
 from .forms import (
     AccountForm,
     AccountLedgerFilterForm,
+    AgingReportFilterForm,
     ChartOfAccountsImportForm,
+    FinancialStatementForm,
     FiscalYearForm,
+    GeneralLedgerExportForm,
     InvoiceForm,
     InvoiceItemFormSet,
     JournalEntryFilterForm,
@@ -60,9 +62,30 @@ from .models import (
 )
 from .services import (
     build_lines_from_formset,
+    close_fiscal_year,
+    delete_payment,
     ensure_default_chart_of_accounts,
+    get_account_totals,
     import_chart_of_accounts_from_excel, allocate_payment_to_invoices, clear_payment_allocations,
+    post_journal_entry,
+    reopen_fiscal_year,
+    unpost_journal_entry,
+    write_journal_lines,
 )
+from .reports import (
+    AGING_BUCKET_KEYS,
+    AGING_RECEIVABLE,
+    AccountLedger,
+    build_trial_balance_tree,
+    get_aging_report,
+    get_comparative_trial_balance,
+    get_dashboard_metrics,
+)
+from .ledger_export import GL_HEADER, general_ledger_queryset, general_ledger_rows, iter_saft_xml
+from .statements import build_statement, comparative_columns
+
+LEDGER_PAGE_SIZE = 200
+CHART_IMPORT_PREVIEW_LIMIT = 500
 
 
 # ============================================================
@@ -162,24 +185,8 @@ class AccountingDashboardView(AccountingBaseView, TemplateView):
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
 
-        ctx.update({
-            "invoices_count": Invoice.objects.count(),
-            "unposted_entries": JournalEntry.objects.unposted().count(),
-            "recent_invoices": Invoice.objects.order_by("-created_at")[:5],
-            "recent_payments": Payment.objects.order_by("-date")[:5],
-            "sales_total_amount":
-                Invoice.objects.filter(type=Invoice.InvoiceType.SALES).aggregate(s=Sum('total_amount'))['s'] or 0,
-            "purchase_total_amount":
-                Invoice.objects.filter(type=Invoice.InvoiceType.PURCHASE).aggregate(s=Sum('total_amount'))['s'] or 0,
-            "sales_invoice_count": Invoice.objects.filter(type=Invoice.InvoiceType.SALES).count(),
-            "purchase_invoice_count": Invoice.objects.filter(type=Invoice.InvoiceType.PURCHASE).count(),
-            "payments_receipt_total": Payment.objects.filter(type=Payment.Type.RECEIPT).aggregate(s=Sum('amount'))[
-                                          's'] or 0,
-            "payments_payment_total": Payment.objects.filter(type=Payment.Type.PAYMENT).aggregate(s=Sum('amount'))[
-                                          's'] or 0,
-            "recent_sales_invoices": Invoice.objects.filter(type=Invoice.InvoiceType.SALES).order_by('-id')[:5],
-            "key_accounts": Account.objects.filter(parent__isnull=True)[:5],
-        })
+        # Single-pass aggregates, cached for a short time (see reports.get_dashboard_metrics)
+        ctx.update(get_dashboard_metrics())
         return ctx
 
 
@@ -258,10 +265,10 @@ class BaseInvoiceCreateView(AccountingBaseView, ProductJsonMixin, CreateView):
                     self.object.type = self.invoice_type
                 self.object.save()
 
+                # Totals are computed once when the block exits
                 item_formset.instance = self.object
-                item_formset.save()
-
-                self.object.recalculate_totals()
+                with self.object.deferred_totals():
+                    item_formset.save()
 
             messages.success(self.request, _("تم حفظ الفاتورة بنجاح."))
             return redirect(self.get_success_url())
@@ -329,8 +336,8 @@ class InvoiceUpdateView(AccountingBaseView, ProductJsonMixin, UpdateView):
         if item_formset.is_valid():
             with transaction.atomic():
                 self.object = form.save()
-                item_formset.save()
-                self.object.recalculate_totals()
+                with self.object.deferred_totals():
+                    item_formset.save()
 
             messages.success(self.request, _("تم تحديث الفاتورة بنجاح."))
             return redirect(self.get_success_url())
@@ -402,6 +409,11 @@ class PaymentDeleteView(AccountingStaffRequiredMixin, DeleteView):
     success_url = reverse_lazy("accounting:payment_list")
     template_name = "accounting/delete.html"
 
+    def form_valid(self, form):
+        # الحذف عبر الخدمة حتى تُحدّث أرصدة الفواتير المسوّاة مع الدفعة
+        delete_payment(self.object)
+        return HttpResponseRedirect(self.get_success_url())
+
 
 # ============================================================
 # Journals & Entries
@@ -438,10 +450,11 @@ class JournalEntryListView(AccountingBaseView, ListView):
     accounting_section = "entries"
 
     def get_queryset(self):
-        qs = JournalEntry.objects.select_related("journal").order_by("-date", "-id")
+        qs = JournalEntry.objects.with_totals().select_related("journal").order_by("-date", "-id")
 
         q = self.request.GET.get('q')
         posted = self.request.GET.get('posted')
+        balance = self.request.GET.get('balance')
 
         if q:
             qs = qs.filter(Q(reference__icontains=q) | Q(description__icontains=q))
@@ -451,6 +464,9 @@ class JournalEntryListView(AccountingBaseView, ListView):
         elif posted == 'draft':
             qs = qs.filter(posted=False)
 
+        if balance == 'unbalanced':
+            qs = qs.unbalanced()
+
         return qs
 
     def get_context_data(self, **kwargs):
@@ -506,17 +522,8 @@ class JournalEntryCreateView(
                 self.object.created_by = self.request.user
                 self.object.save()
 
-                lines, dr, cr = build_lines_from_formset(line_formset)
-
-                diff = dr - cr
-                if abs(diff) > Decimal("0.001"):
-                    raise ValidationError(
-                        _("القيد غير متوازن.\nالمدين: %(dr)s | الدائن: %(cr)s | الفرق: %(diff)s")
-                        % {'dr': dr, 'cr': cr, 'diff': diff}
-                    )
-
-                for line_data in lines:
-                    JournalLine.objects.create(entry=self.object, **line_data)
+                lines, _dr, _cr = build_lines_from_formset(line_formset)
+                write_journal_lines(self.object, lines)
 
             messages.success(self.request, _("تم حفظ القيد بنجاح."))
             return redirect("accounting:journal_entry_detail", pk=self.object.pk)
@@ -567,17 +574,8 @@ class JournalEntryUpdateView(AccountingBaseView, UpdateView):
 
                     self.object = form.save()
 
-                    self.object.lines.all().delete()
-
-                    lines, dr, cr = build_lines_from_formset(line_formset)
-
-                    if abs(dr - cr) > Decimal("0.001"):
-                        raise ValidationError(
-                            _("القيد غير متوازن. الفرق: %(diff)s") % {'diff': abs(dr - cr)}
-                        )
-
-                    for line_data in lines:
-                        JournalLine.objects.create(entry=self.object, **line_data)
+                    lines, _dr, _cr = build_lines_from_formset(line_formset)
+                    write_journal_lines(self.object, lines)
 
                 messages.success(self.request, _("تم تحديث القيد بنجاح."))
                 return redirect("accounting:journal_entry_detail", pk=self.object.pk)
@@ -594,6 +592,13 @@ class JournalEntryDetailView(AccountingBaseView, DetailView):
     context_object_name = "entry"
     accounting_section = "entries"
 
+    def get_queryset(self):
+        return (
+            JournalEntry.objects.with_totals()
+            .select_related("journal", "fiscal_year")
+            .prefetch_related(Prefetch("lines", queryset=JournalLine.objects.select_related("account")))
+        )
+
 
 def journalentry_post_view(request, pk):
     entry = get_object_or_404(JournalEntry, pk=pk)
@@ -605,10 +610,11 @@ def journalentry_post_view(request, pk):
     if not entry.is_balanced:
         messages.error(request, _("القيد غير متوازن."))
     else:
-        entry.posted = True
-        entry.posted_at = timezone.now()
-        entry.posted_by = request.user
-        entry.save()
+        try:
+            post_journal_entry(entry, user=request.user)
+        except ValidationError as e:
+            messages.error(request, " ".join(e.messages))
+            return redirect("accounting:journal_entry_detail", pk=pk)
         messages.success(request, _("تم ترحيل القيد."))
     return redirect("accounting:journal_entry_detail", pk=pk)
 
@@ -620,8 +626,11 @@ def journalentry_unpost_view(request, pk):
         messages.warning(request, _("عملية غير مسموحة."))
         return redirect("accounting:journal_entry_detail", pk=pk)
 
-    entry.posted = False
-    entry.save()
+    try:
+        unpost_journal_entry(entry)
+    except ValidationError as e:
+        messages.error(request, " ".join(e.messages))
+        return redirect("accounting:journal_entry_detail", pk=pk)
     messages.success(request, _("تم إلغاء الترحيل."))
     return redirect("accounting:journal_entry_detail", pk=pk)
 
@@ -718,9 +727,33 @@ class FiscalYearUpdateView(AccountingBaseView, UpdateView):
 class FiscalYearCloseView(AccountingStaffRequiredMixin, View):
     def post(self, request, pk):
         fy = get_object_or_404(FiscalYear, pk=pk)
-        fy.is_closed = True
-        fy.save()
-        messages.success(request, _("تم إقفال السنة المالية."))
+        try:
+            result = close_fiscal_year(fy, user=request.user)
+        except ValidationError as e:
+            messages.error(request, " ".join(e.messages))
+            return redirect("accounting:fiscal_year_list")
+
+        messages.success(
+            request,
+            _("تم إقفال السنة المالية (%(closing)d سطر إقفال، %(opening)d سطر افتتاحي).")
+            % {"closing": result["closing_lines"], "opening": result["opening_lines"]},
+        )
+        return redirect("accounting:fiscal_year_list")
+
+
+class FiscalYearReopenView(AccountingStaffRequiredMixin, View):
+    def post(self, request, pk):
+        fy = get_object_or_404(FiscalYear, pk=pk)
+        try:
+            deleted = reopen_fiscal_year(fy)
+        except ValidationError as e:
+            messages.error(request, " ".join(e.messages))
+            return redirect("accounting:fiscal_year_list")
+
+        messages.success(
+            request,
+            _("تمت إعادة فتح السنة المالية وحذف %(count)d من قيود الإقفال والترحيل.") % {"count": deleted},
+        )
         return redirect("accounting:fiscal_year_list")
 
 
@@ -740,6 +773,7 @@ def chart_of_accounts_bootstrap_view(request):
 
 @ledger_staff_required
 def chart_of_accounts_import_view(request):
+    preview = None
     if request.method == "POST":
         form = ChartOfAccountsImportForm(request.POST, request.FILES)
         if form.is_valid():
@@ -747,8 +781,18 @@ def chart_of_accounts_import_view(request):
                 res = import_chart_of_accounts_from_excel(
                     form.cleaned_data['file'],
                     replace_existing=form.cleaned_data['replace_existing'],
-                    fiscal_year=form.cleaned_data['fiscal_year']
+                    fiscal_year=form.cleaned_data['fiscal_year'],
+                    dry_run=form.cleaned_data['dry_run'],
                 )
+                if res["dry_run"]:
+                    # معاينة فقط: نعرض الفروقات بدون حفظ
+                    preview = {**res, "diff": res["diff"][:CHART_IMPORT_PREVIEW_LIMIT]}
+                    preview["truncated"] = len(res["diff"]) > CHART_IMPORT_PREVIEW_LIMIT
+                    return render(
+                        request,
+                        "accounting/setup/import.html",
+                        {"form": form, "preview": preview, "accounting_section": "settings"},
+                    )
                 messages.success(request, _(f"تم الاستيراد: {res['created']} جديد, {res['updated']} محدث."))
                 if res['errors']:
                     for e in res['errors']:
@@ -761,35 +805,29 @@ def chart_of_accounts_import_view(request):
     return render(
         request,
         "accounting/setup/import.html",
-        {"form": form, "accounting_section": "settings"},
+        {"form": form, "preview": preview, "accounting_section": "settings"},
     )
 
 
 @ledger_staff_required
 def chart_of_accounts_export_view(request):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Chart of Accounts"
-
+    """
+    Export the chart of accounts (same columns as the importer).
+    ?format=csv streams CSV; default is a write-only XLSX.
+    """
     headers = ["code", "name", "type", "parent_code", "allow_settlement", "is_active"]
-    ws.append(headers)
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
-
-    for acc in Account.objects.all().select_related('parent').order_by('code'):
-        ws.append([
-            acc.code,
-            acc.name,
-            acc.type,
-            acc.parent.code if acc.parent else "",
-            1 if acc.allow_settlement else 0,
-            1 if acc.is_active else 0
-        ])
-
-    response = HttpResponse(content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    response["Content-Disposition"] = 'attachment; filename=\"chart_of_accounts.xlsx\"'
-    wb.save(response)
-    return response
+    rows = queryset_rows(
+        Account.objects.order_by("code"),
+        ["code", "name", "type", "parent__code", "allow_settlement", "is_active"],
+        transform=lambda r: (r[0], r[1], r[2], r[3] or "", int(r[4]), int(r[5])),
+    )
+    return export_response(
+        request.GET.get("format"),
+        "chart_of_accounts",
+        headers,
+        rows,
+        sheet_title="Chart of Accounts",
+    )
 
 
 # ============================================================
@@ -803,33 +841,53 @@ def trial_balance_view(request):
     totals = {"debit": Decimal(0), "credit": Decimal(0)}
     report_title = _("ميزان المراجعة")
 
-    qs = JournalLine.objects.filter(entry__posted=True)
-
+    fiscal_year = date_from = date_to = None
+    as_tree = False
     if form.is_valid():
         fiscal_year = form.cleaned_data.get("fiscal_year")
         date_from = form.cleaned_data.get("date_from")
         date_to = form.cleaned_data.get("date_to")
+        as_tree = form.cleaned_data.get("as_tree", False)
+
+        if form.cleaned_data.get("compare"):
+            return _comparative_trial_balance_response(request, form, report_title)
 
-        if fiscal_year:
-            qs = qs.filter(entry__fiscal_year=fiscal_year)
-        if date_from:
-            qs = qs.filter(entry__date__gte=date_from)
-        if date_to:
-            qs = qs.filter(entry__date__lte=date_to)
-
-    data = qs.values("account__code", "account__name").annotate(
-        total_debit=Coalesce(Sum("debit"), Value(0), output_field=DecimalField()),
-        total_credit=Coalesce(Sum("credit"), Value(0), output_field=DecimalField())
-    ).order_by("account__code")
-
-    for item in data:
-        dr = item["total_debit"]
-        cr = item["total_credit"]
+    # Whole months are read from AccountPeriodBalance, partial months from lines
+    account_totals = get_account_totals(
+        date_from=date_from,
+        date_to=date_to,
+        fiscal_year=fiscal_year,
+    )
+
+    if as_tree:
+        # Group subtotals are rolled up along Account.path (no recursion)
+        tree = build_trial_balance_tree(account_totals)
+        for node in tree:
+            totals["debit"] += node.debit
+            totals["credit"] += node.credit
+        return render(request, "accounting/reports/trial_balance.html", {
+            "form": form,
+            "tree": tree,
+            "as_tree": True,
+            "totals": totals,
+            "title": report_title,
+            "accounting_section": "reports",
+        })
+
+    accounts = (
+        Account.objects.filter(pk__in=account_totals.keys())
+        .values("pk", "code", "name", "type")
+        .order_by("code")
+    )
+
+    for acc in accounts:
+        dr, cr = account_totals[acc["pk"]]
         if dr == 0 and cr == 0:
             continue
         rows.append({
-            "code": item["account__code"],
-            "name": item["account__name"],
+            "code": acc["code"],
+            "name": acc["name"],
+            "type": acc["type"],
             "debit": dr,
             "credit": cr
         })
@@ -845,72 +903,284 @@ def trial_balance_view(request):
     })
 
 
+def _aging_bucket_columns():
+    labels = {
+        "current": _("غير مستحق"),
+        "days_1_30": _("1 - 30 يوم"),
+        "days_31_60": _("31 - 60 يوم"),
+        "days_61_90": _("61 - 90 يوم"),
+        "days_over_90": _("أكثر من 90 يوم"),
+    }
+    return [(key, labels[key]) for key in AGING_BUCKET_KEYS]
+
+
 @ledger_staff_required
-def account_ledger_view(request):
-    form = AccountLedgerFilterForm(request.GET or None)
-    account = None
-    lines = []
-    opening_balance = Decimal(0)
-    current_balance = Decimal(0)
+def aging_report_view(request):
+    """
+    أعمار الذمم (مدينة / دائنة) كما في تاريخ معيّن.
+    ?format=csv|xlsx يصدّر نفس النتيجة (من الكاش إن وُجدت).
+    """
+    form = AgingReportFilterForm(request.GET or None)
+    kind, as_of = AGING_RECEIVABLE, None
+    if form.is_valid():
+        kind = form.cleaned_data.get("kind") or AGING_RECEIVABLE
+        as_of = form.cleaned_data.get("as_of")
+
+    report = get_aging_report(kind, as_of=as_of)
+    bucket_columns = _aging_bucket_columns()
+
+    export_format = request.GET.get("format")
+    if export_format:
+        header = [_("الطرف")] + [label for _key, label in bucket_columns] + [_("الإجمالي")]
+        rows = (
+            [row.contact_name] + [row.buckets[key] for key in AGING_BUCKET_KEYS] + [row.total]
+            for row in report.rows
+        )
+        return export_response(
+            export_format,
+            f"aging_{report.kind}_{report.as_of.isoformat()}",
+            header,
+            rows,
+            sheet_title=report.kind,
+        )
 
-    if form.is_valid() and form.cleaned_data.get("account"):
-        account = form.cleaned_data["account"]
-        date_from = form.cleaned_data.get("date_from")
+    return render(request, "accounting/reports/aging.html", {
+        "form": form,
+        "report": report,
+        "bucket_columns": bucket_columns,
+        "title": _("أعمار الذمم"),
+        "accounting_section": "reports",
+    })
 
-        # Opening Balance Logic
-        op_qs = JournalLine.objects.filter(account=account, entry__posted=True)
-        if date_from:
-            op_qs = op_qs.filter(entry__date__lt=date_from)
 
-        agg = op_qs.aggregate(
-            dr=Coalesce(Sum("debit"), Value(0), output_field=DecimalField()),
-            cr=Coalesce(Sum("credit"), Value(0), output_field=DecimalField())
-        )
+@ledger_staff_required
+def financial_statements_view(request):
+    """
+    قائمة الدخل / الميزانية العمومية بأعمدة مقارنة (شهرية أو سنوية)،
+    مبنية من AccountPeriodBalance في استعلام تجميعي واحد.
+    ?format=xlsx|pdf لتصدير نفس القائمة.
+    """
+    form = FinancialStatementForm(request.GET or None)
+    today = timezone.localdate()
+    kind, compare, month, periods = "income", "mom", today, 3
+    if form.is_valid():
+        kind = form.cleaned_data.get("statement") or kind
+        compare = form.cleaned_data.get("compare") or compare
+        month = form.cleaned_data.get("month") or month
+        periods = form.cleaned_data.get("periods") or periods
 
-        # Standard Accounting Equation
-        if account.type in [Account.Type.ASSET, Account.Type.EXPENSE]:
-            opening_balance = agg['dr'] - agg['cr']
-        else:
-            opening_balance = agg['cr'] - agg['dr']
+    statement = build_statement(kind, comparative_columns(compare, month.year, month.month, periods))
+    filename_base = f"{statement.kind}_{month:%Y_%m}"
 
-        current_balance = opening_balance
+    export_format = request.GET.get("format")
+    if export_format == "pdf":
+        return render_pdf_view(
+            request,
+            "accounting/reports/pdf/financial_statement.html",
+            {"statement": statement},
+            filename=f"{filename_base}.pdf",
+        )
+    if export_format == "xlsx":
+        return export_response(
+            "xlsx",
+            filename_base,
+            statement.header(),
+            statement.iter_rows(),
+            sheet_title=statement.kind,
+        )
+
+    return render(request, "accounting/reports/financial_statement.html", {
+        "form": form,
+        "statement": statement,
+        "title": statement.title,
+        "accounting_section": "reports",
+    })
 
-        # Running Lines
-        qs = JournalLine.objects.filter(account=account, entry__posted=True).select_related('entry').order_by(
-            'entry__date', 'entry__id')
-        if date_from:
-            qs = qs.filter(entry__date__gte=date_from)
-        if form.cleaned_data.get("date_to"):
-            qs = qs.filter(entry__date__lte=form.cleaned_data.get("date_to"))
 
-        for line in qs:
-            dr = line.debit
-            cr = line.credit
+def _comparative_trial_balance_response(request, form, report_title):
+    """
+    ميزان مراجعة مقارن: عدة أشهر كأعمدة (من الكاش حسب نسخة الدفتر).
+    ?format=csv|xlsx يصدّر مدين/دائن لكل عمود.
+    """
+    month = form.cleaned_data.get("month") or timezone.localdate()
+    columns = comparative_columns(
+        form.cleaned_data["compare"],
+        month.year,
+        month.month,
+        form.cleaned_data.get("periods") or 3,
+    )
+    report = get_comparative_trial_balance(columns)
+
+    export_format = request.GET.get("format")
+    if export_format:
+        header = [_("الكود"), _("اسم الحساب")]
+        for column in report.columns:
+            header += [f"{column.label} {_('مدين')}", f"{column.label} {_('دائن')}"]
+        rows = (
+            [row.code, row.name] + [amount for pair in row.pairs for amount in pair]
+            for row in report.rows
+        )
+        return export_response(export_format, f"trial_balance_{month:%Y_%m}", header, rows, sheet_title="TB")
 
-            if account.type in [Account.Type.ASSET, Account.Type.EXPENSE]:
-                current_balance += (dr - cr)
-            else:
-                current_balance += (cr - dr)
-
-            lines.append({
-                "date": line.entry.date,
-                "ref": line.entry.reference,
-                "desc": line.description or line.entry.description,
-                "debit": dr,
-                "credit": cr,
-                "balance": current_balance
-            })
-
-    return render(request, "accounting/reports/account_ledger.html", {
+    return render(request, "accounting/reports/trial_balance.html", {
         "form": form,
-        "account": account,
-        "lines": lines,
-        "opening_balance": opening_balance,
-        "closing_balance": current_balance,
+        "comparative": report,
+        "title": report_title,
         "accounting_section": "reports",
     })
 
 
+def _account_ledger_from_request(request):
+    """
+    Build (form, AccountLedger, effective fiscal year) from the GET filters.
+    If a fiscal year is chosen, its dates fill any missing date_from/date_to.
+    """
+    form = AccountLedgerFilterForm(request.GET or None)
+    if not (form.is_valid() and form.cleaned_data.get("account")):
+        return form, None, None
+
+    fiscal_year = form.cleaned_data.get("fiscal_year")
+    date_from = form.cleaned_data.get("date_from")
+    date_to = form.cleaned_data.get("date_to")
+    if fiscal_year:
+        date_from = date_from or fiscal_year.start_date
+        date_to = date_to or fiscal_year.end_date
+
+    ledger = AccountLedger(
+        form.cleaned_data["account"],
+        date_from=date_from,
+        date_to=date_to,
+        include_children=form.cleaned_data.get("include_children", False),
+    )
+    return form, ledger, fiscal_year
+
+
+@ledger_staff_required
+def account_ledger_view(request):
+    form, ledger, fiscal_year = _account_ledger_from_request(request)
+    context = {
+        "form": form,
+        "account": None,
+        "lines": [],
+        "opening_balance": Decimal(0),
+        "totals": None,
+        "effective_fiscal_year": fiscal_year,
+        "accounting_section": "reports",
+    }
+
+    if ledger is not None:
+        # Keyset pagination: running balance is computed in SQL per page
+        page = ledger.page(request.GET.get("cursor"), limit=LEDGER_PAGE_SIZE)
+
+        query = request.GET.copy()
+        query.pop("cursor", None)
+        next_query = None
+        if page.has_more:
+            next_query = query.copy()
+            next_query["cursor"] = page.next_cursor
+
+        context.update({
+            "account": ledger.account,
+            "lines": page.lines,
+            "opening_balance": page.opening_balance,
+            "totals": page.totals,
+            "closing_balance": page.totals["closing_balance"],
+            "has_more": page.has_more,
+            "next_querystring": next_query.urlencode() if next_query else "",
+            "filter_querystring": query.urlencode(),
+            "is_first_page": not request.GET.get("cursor"),
+        })
+
+    return render(request, "accounting/reports/account_ledger.html", context)
+
+
+@ledger_staff_required
+def account_ledger_export_view(request):
+    """
+    Export the full account ledger (CSV or XLSX) as a stream of rows,
+    so memory does not grow with the number of lines.
+    """
+    form, ledger, _fiscal_year = _account_ledger_from_request(request)
+    if ledger is None:
+        messages.error(request, _("الرجاء اختيار حساب أولاً."))
+        return redirect("accounting:account_ledger")
+
+    header = [
+        _("التاريخ"),
+        _("رقم القيد"),
+        _("المرجع"),
+        _("الوصف"),
+        _("مدين"),
+        _("دائن"),
+        _("الرصيد التراكمي"),
+    ]
+    rows = (
+        [
+            line["date"],
+            line["entry_number"],
+            line["reference"],
+            line["description"],
+            line["debit"],
+            line["credit"],
+            line["balance"],
+        ]
+        for line in ledger.iter_lines()
+    )
+
+    return export_response(
+        request.GET.get("format") or "csv",
+        f"ledger_{ledger.account.code}",
+        header,
+        rows,
+        sheet_title=ledger.account.code,
+    )
+
+
+@ledger_staff_required
+def general_ledger_export_view(request):
+    """
+    تصدير الأستاذ العام كاملاً (كل سطور القيود) للمدققين الخارجيين.
+    ?format=csv|xlsx|xml: البيانات تُقرأ بـ iterator() وتُكتب أثناء الإرسال،
+    فلا تتراكم السطور في ذاكرة العامل مهما كان عددها.
+    (لملفات ضخمة جداً: python manage.py export_general_ledger)
+    """
+    form = GeneralLedgerExportForm(request.GET or None)
+    if not request.GET.get("format") or not form.is_valid():
+        return render(request, "accounting/reports/general_ledger_export.html", {
+            "form": form,
+            "title": _("تصدير الأستاذ العام"),
+            "accounting_section": "reports",
+        })
+
+    data = form.cleaned_data
+    fiscal_year = data.get("fiscal_year")
+    date_from = data.get("date_from") or (fiscal_year.start_date if fiscal_year else None)
+    date_to = data.get("date_to") or (fiscal_year.end_date if fiscal_year else None)
+    queryset = general_ledger_queryset(
+        date_from=date_from,
+        date_to=date_to,
+        fiscal_year=fiscal_year,
+        posted_only=not data.get("include_drafts"),
+    )
+
+    filename_base = "general_ledger" + (f"_{fiscal_year.year}" if fiscal_year else "")
+    if data["format"] == "xml":
+        response = StreamingHttpResponse(
+            iter_saft_xml(queryset, date_from=date_from, date_to=date_to),
+            content_type="application/xml; charset=utf-8",
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename_base}_saft.xml"'
+        return response
+
+    return export_response(
+        data["format"],
+        filename_base,
+        GL_HEADER,
+        general_ledger_rows(queryset),
+        sheet_title="General Ledger",
+    )
+
+
 # ============================================================
 # Payment Methods Configuration
 # ============================================================
@@ -983,9 +1253,13 @@ class PaymentReconcileView(AccountingStaffRequiredMixin, FormView):
         يرجّع الفواتير المفتوحة لنفس الطرف المرتبط بهذه الدفعة.
         - لو الدفعة قبض من عميل → نستخدم فواتير مبيعات.
         - لو الدفعة صرف لمورد → نستخدم فواتير مشتريات.
-        - نستثني فقط الملغاة والمدفوعة بالكامل.
-        - وبعدها نفلتر في الذاكرة على balance > 0.
+        - نستثني الملغاة والمدفوعة بالكامل، ونفلتر balance > 0 في SQL
+          (balance حقل مخزن تحدّثه خدمات التسوية).
+        - النتيجة تُحفظ على الـ view لأن الفورم والكونتكست يستخدمانها معاً.
         """
+        if hasattr(self, "_open_invoices"):
+            return self._open_invoices
+
         payment_type = self.payment.type  # حقل string عندك
 
         # نبدأ بكل فواتير هذا الكونتاكت
@@ -998,19 +1272,16 @@ class PaymentReconcileView(AccountingStaffRequiredMixin, FormView):
             qs = qs.filter(type=Invoice.InvoiceType.PURCHASE)
         # غير كذا نخليها بدون فلتر type لو حاب (أو تقدر تضيف منطق خاص لاحقاً)
 
-        # نستثني فقط الملغاة والمدفوعة بالكامل
+        # نستثني الملغاة والمدفوعة بالكامل
         qs = qs.exclude(
             status__in=[
                 Invoice.Status.CANCELLED,
                 Invoice.Status.PAID,
             ]
-        ).order_by("issued_at", "pk")
-
-        # balance خاصية بايثون تعتمد على allocations، فنفلتر في الذاكرة
-        open_invoices = [inv for inv in qs if inv.balance > 0]
-
-        return open_invoices
+        ).filter(balance__gt=0).order_by("issued_at", "pk")
 
+        self._open_invoices = list(qs)
+        return self._open_invoices
 
     # ------------------------------------------------------
     # تمرير الدفعة والفواتير إلى الفورم
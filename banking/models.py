@@ -301,6 +301,7 @@ class BankReconciliation(models.Model):
 
             if is_new:
                 self._update_bank_line_residual()
+            self._refresh_journal_item_total()
 
     def delete(self, *args, **kwargs):
         """
@@ -321,6 +322,8 @@ class BankReconciliation(models.Model):
             bank_line.refresh_from_db()
             bank_line.save()
 
+            self._refresh_journal_item_total()
+
     def _update_bank_line_residual(self):
         """
         تحديث المتبقي في سطر البنك بعد إنشاء تسوية جديدة.
@@ -331,5 +334,11 @@ class BankReconciliation(models.Model):
         self.bank_line.refresh_from_db()
         self.bank_line.save()
 
+    def _refresh_journal_item_total(self):
+        """
+        تحديث amount_reconciled_total وحالة reconciled في سطر القيد (UPDATE واحد).
+        """
+        JournalLine.objects.filter(pk=self.journal_item_id).refresh_reconciled_totals()
+
     def __str__(self):
         return f"Rec: {self.amount_reconciled} ({self.bank_line_id} <-> {self.journal_item_id})"
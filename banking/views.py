@@ -270,10 +270,14 @@ class ReconciliationDashboardView(BankBaseView, DetailView):
         )
 
         # 2. جلب قيود المحاسبة غير المسواة لهذا الحساب
-        # نستخدم حقل reconciled (bool) الذي يحدث عبر التسوية البنكية
+        # open_items() يعتمد على amount_reconciled_total، والمتبقي لكل سطر
+        # يأتي من with_reconciliation() بدل استعلام لكل سطر
         ctx["journal_items"] = (
             JournalLine.objects
-            .filter(account=gl_account, reconciled=False)
+            .filter(account=gl_account)
+            .open_items()
+            .with_reconciliation()
+            .select_related("entry", "account")
             .order_by("entry__date", "id")
         )
 
@@ -336,10 +340,9 @@ def perform_reconciliation(request):
                 amount_reconciled=amount,
             )
 
-            # تحديث حالة القيد المحاسبي (مسوى/غير مسوى) بناءً على الخاصية is_fully_reconciled
-            journal_item.refresh_from_db()
-            journal_item.reconciled = journal_item.is_fully_reconciled
-            journal_item.save(update_fields=["reconciled"])
+            # حالة القيد المحاسبي (reconciled / amount_reconciled_total) تُحدَّث في
+            # BankReconciliation.save()؛ المتبقي يُقرأ من with_reconciliation()
+            journal_item = JournalLine.objects.with_reconciliation().get(pk=journal_item.pk)
 
             # إعادة تحميل سطر البنك بعد تحديث المتبقي عن طريق الموديل
             bank_line.refresh_from_db()
@@ -396,10 +399,8 @@ def undo_reconciliation(request):
             # تحديث سطر البنك
             bank_line.refresh_from_db()
 
-            # تحديث حالة القيد المحاسبي
-            journal_item.refresh_from_db()
-            journal_item.reconciled = journal_item.is_fully_reconciled
-            journal_item.save(update_fields=["reconciled"])
+            # حالة القيد المحاسبي تُحدَّث في BankReconciliation.delete()
+            journal_item = JournalLine.objects.with_reconciliation().get(pk=journal_item.pk)
 
         return JsonResponse(
             {
@@ -4,3 +4,28 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        """
+        Bump the cached singleton settings when they, or a row they point
+        to (Journal, Account, ...), are saved or deleted.
+        """
+        from django.apps import apps
+        from django.db.models.signals import post_delete, post_save
+
+        from core.models.singleton import CachedSingletonMixin
+
+        for model in apps.get_models():
+            if not issubclass(model, CachedSingletonMixin):
+                continue
+
+            def invalidate(sender, model=model, **kwargs):
+                model.invalidate_solo()
+
+            related = {
+                f.related_model for f in model._meta.concrete_fields
+                if f.is_relation and f.many_to_one
+            }
+            for related_model in related:
+                post_save.connect(invalidate, sender=related_model, weak=False)
+                post_delete.connect(invalidate, sender=related_model, weak=False)
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-16 21:40
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    """
+    The shared DatabaseCache table (settings.CACHES) is created by migrate,
+    so no separate createcachetable step is needed. Existing tables are kept.
+    """
+    call_command("createcachetable", database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
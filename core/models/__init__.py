@@ -5,6 +5,7 @@ from .domain import StatefulDomainModel, DomainEvent
 from .numbering import NumberingScheme
 from .sequences import NumberSequence
 from .notifications import Notification
+from .singleton import CachedSingletonMixin
 
 __all__ = [
     "BaseModel",
@@ -21,5 +22,7 @@ __all__ = [
     "attachment_upload_to",
     #domain
     "StatefulDomainModel",
-    "DomainEvent"
+    "DomainEvent",
+    # settings singletons
+    "CachedSingletonMixin",
 ]
@@ -0,0 +1,103 @@
+# core/models/singleton.py
+import copy
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+class CachedSingletonMixin:
+    """
+    Cached get_solo() for single-row settings models.
+
+    - The row (pk=1) is loaded once with its foreign keys (select_related)
+      and stored in the Django cache under a versioned key.
+    - Each process also keeps the last loaded copy in memory; a call to
+      get_solo() only reads the version key from the cache. With the
+      DatabaseCache that is still one (indexed, single-table) query per
+      call: what is saved is the settings query's joins, not the round trip.
+    - save() / delete() bump the version (now and again on commit), so every
+      worker reloads on its next call. Saving a related row (e.g. a Journal
+      referenced by LedgerSettings) also bumps it, see CoreConfig.ready().
+
+    The version key must live in a cache shared by all workers (settings.CACHES);
+    a per-process LocMemCache would keep the other workers on stale settings.
+
+    Put the mixin before models.Model / SingletonModel in the bases.
+    """
+
+    singleton_pk = 1
+
+    # ------------------------------------------------------------------
+    # Cache keys
+    # ------------------------------------------------------------------
+    @classmethod
+    def _solo_cache_prefix(cls) -> str:
+        return f"solo:{cls._meta.label_lower}"
+
+    @classmethod
+    def _solo_version(cls) -> str:
+        key = f"{cls._solo_cache_prefix()}:version"
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            version = cache.get(key)
+        return version
+
+    # ------------------------------------------------------------------
+    # Access
+    # ------------------------------------------------------------------
+    @classmethod
+    def _load_solo(cls):
+        related = [
+            f.name for f in cls._meta.concrete_fields
+            if f.is_relation and f.many_to_one
+        ]
+        obj = cls.objects.select_related(*related).filter(pk=cls.singleton_pk).first()
+        if obj is None:
+            obj, _created = cls.objects.get_or_create(pk=cls.singleton_pk)
+        return obj
+
+    @classmethod
+    def get_solo(cls):
+        """
+        Return the settings row (a private copy, safe to modify and save).
+        """
+        version = cls._solo_version()
+
+        local = cls.__dict__.get("_solo_local")
+        if local is not None and local[0] == version:
+            return copy.copy(local[1])
+
+        key = f"{cls._solo_cache_prefix()}:{version}"
+        obj = cache.get(key)
+        if obj is None:
+            obj = cls._load_solo()
+            cache.set(key, obj, timeout=getattr(settings, "SINGLETON_CACHE_TIMEOUT", 3600))
+
+        cls._solo_local = (version, obj)
+        return copy.copy(obj)
+
+    @classmethod
+    def invalidate_solo(cls) -> None:
+        """
+        Bump the cache version; every process reloads on its next get_solo().
+        """
+        def bump():
+            cache.set(f"{cls._solo_cache_prefix()}:version", uuid.uuid4().hex, timeout=None)
+
+        bump()
+        transaction.on_commit(bump)
+
+    # ------------------------------------------------------------------
+    # Invalidation on write
+    # ------------------------------------------------------------------
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        type(self).invalidate_solo()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        type(self).invalidate_solo()
+        return result
@@ -0,0 +1,146 @@
+# core/services/exports.py
+
+from __future__ import annotations
+
+import csv
+import tempfile
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.functional import Promise
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORT_FORMATS = ("xlsx", "csv")
+DEFAULT_CHUNK_SIZE = 2000
+
+
+class _Echo:
+    """
+    File-like object whose write() just returns the value,
+    so csv.writer can be used to produce lines for a generator.
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_csv_lines(header: Sequence[str], rows: Iterable[Sequence[Any]]):
+    """
+    Yield CSV-encoded lines (header first) one row at a time.
+    A UTF-8 BOM is emitted first so Excel opens Arabic text correctly.
+    """
+    writer = csv.writer(_Echo())
+    yield "\ufeff"
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def csv_streaming_response(filename: str, header: Sequence[str], rows: Iterable[Sequence[Any]]):
+    """
+    StreamingHttpResponse that writes CSV rows as they are produced.
+    `rows` should be a lazy iterable (e.g. built on queryset.iterator()).
+    """
+    response = StreamingHttpResponse(
+        iter_csv_lines(header, rows),
+        content_type="text/csv; charset=utf-8",
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _cell_value(value):
+    """
+    openpyxl only accepts plain types: lazy translations (gettext_lazy
+    headers, choice labels) are turned into str first.
+    """
+    return str(value) if isinstance(value, Promise) else value
+
+
+def write_xlsx(file_obj, header: Sequence[str], rows: Iterable[Sequence[Any]], *, sheet_title: str = "Sheet1") -> int:
+    """
+    Write rows into `file_obj` using openpyxl write-only mode
+    (rows are flushed to disk instead of being kept in memory).
+
+    Returns:
+        int: number of data rows written.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_title[:31])
+
+    bold = Font(bold=True)
+    header_cells = []
+    for value in header:
+        cell = WriteOnlyCell(ws, value=_cell_value(value))
+        cell.font = bold
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    count = 0
+    for row in rows:
+        ws.append([_cell_value(value) for value in row])
+        count += 1
+
+    wb.save(file_obj)
+    return count
+
+
+def xlsx_file_response(
+    filename: str,
+    header: Sequence[str],
+    rows: Iterable[Sequence[Any]],
+    *,
+    sheet_title: str = "Sheet1",
+):
+    """
+    Build the workbook in a temporary file (write-only mode) and stream it
+    back in chunks with FileResponse. Memory stays bounded by openpyxl's
+    write-only buffer, not by the number of rows.
+    """
+    tmp = tempfile.TemporaryFile(suffix=".xlsx")
+    write_xlsx(tmp, header, rows, sheet_title=sheet_title)
+    tmp.seek(0)
+
+    return FileResponse(
+        tmp,
+        as_attachment=True,
+        filename=filename,
+        content_type=XLSX_CONTENT_TYPE,
+    )
+
+
+def queryset_rows(
+    queryset,
+    fields: Sequence[str],
+    *,
+    transform: Callable[[tuple], Sequence[Any]] | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[Sequence[Any]]:
+    """
+    Lazily yield tuples from `queryset.values_list(*fields)` using a
+    server-side iterator, so rows never accumulate in memory.
+    `transform` can reshape each tuple (e.g. bool -> 1/0).
+    """
+    for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size):
+        yield transform(row) if transform else row
+
+
+def export_response(
+    fmt: str,
+    filename_base: str,
+    header: Sequence[str],
+    rows: Iterable[Sequence[Any]],
+    *,
+    sheet_title: str = "Sheet1",
+):
+    """
+    One entry point for list exports:
+      - "csv": StreamingHttpResponse, first bytes are sent immediately.
+      - "xlsx" (default): write-only workbook spooled to a temp file.
+    """
+    if fmt == "csv":
+        return csv_streaming_response(f"{filename_base}.csv", header, rows)
+    return xlsx_file_response(f"{filename_base}.xlsx", header, rows, sheet_title=sheet_title)
@@ -0,0 +1,259 @@
+# inventory/counting.py
+
+from __future__ import annotations
+
+import csv
+import io
+from collections import defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from typing import Iterable, Iterator
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from core.models import AuditLog
+from core.services.audit import log_event
+
+from .models import (
+    DECIMAL_ZERO,
+    InventoryAdjustment,
+    InventoryAdjustmentLine,
+    Product,
+    StockLevel,
+    StockLocation,
+)
+
+# set: the row is the full count of (product, location)
+# add: the row adds to what was counted so far (scanner, one scan = one unit)
+COUNT_MODE_SET = "set"
+COUNT_MODE_ADD = "add"
+COUNT_MODES = (COUNT_MODE_SET, COUNT_MODE_ADD)
+
+MAX_SCAN_BATCH = 5000
+
+# (row number, barcode or product code, location code, quantity)
+CountRow = tuple[int, str, str, str]
+
+
+@dataclass
+class CountResult:
+    rows: int = 0
+    updated: int = 0
+    created: int = 0
+    errors: list[tuple[int, str]] = field(default_factory=list)
+
+
+# ============================================================
+# Product index
+# ============================================================
+
+class ProductIndex:
+    """
+    barcode / code -> product_id, loaded with one values_list() query.
+    Barcodes win over codes when the same string is both.
+    """
+
+    def __init__(self, products=None):
+        products = Product.objects.all() if products is None else products
+        self._ids: dict[str, int] = {}
+        barcodes = []
+        for pk, code, barcode in products.values_list("pk", "code", "barcode").iterator(chunk_size=5000):
+            if code:
+                self._ids[code.strip().upper()] = pk
+            if barcode:
+                barcodes.append((barcode.strip().upper(), pk))
+        self._ids.update(barcodes)
+
+    def resolve(self, identifier: str) -> int | None:
+        return self._ids.get((identifier or "").strip().upper())
+
+
+# ============================================================
+# Parsing
+# ============================================================
+
+def _parse_qty(raw) -> Decimal | None:
+    try:
+        qty = Decimal(str(raw).strip())
+    except (InvalidOperation, ValueError):
+        return None
+    return qty if qty.is_finite() else None
+
+
+def parse_count_csv(uploaded) -> Iterator[CountRow]:
+    """
+    Rows of `barcode|code, location, qty` from an uploaded CSV, read as a
+    stream. A first row whose qty is not a number is taken as the header.
+    """
+    stream = getattr(uploaded, "file", uploaded)  # Django UploadedFile -> underlying binary file
+    reader = csv.reader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    for row_no, row in enumerate(reader, start=1):
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        row = (row + ["", "", ""])[:3]
+        if row_no == 1 and _parse_qty(row[2]) is None:
+            continue
+        yield row_no, row[0], row[1], row[2]
+
+
+def parse_scan_batch(items) -> Iterator[CountRow]:
+    """
+    Scanner batch (decoded JSON): a list of {"code", "location", "qty"}
+    objects or [code, location, qty] lists; qty defaults to 1.
+    """
+    for row_no, item in enumerate(items, start=1):
+        if isinstance(item, dict):
+            code = item.get("barcode") or item.get("code") or ""
+            yield row_no, code, item.get("location") or "", item.get("qty", 1)
+        elif isinstance(item, (list, tuple)) and item:
+            item = list(item) + ["", 1]
+            yield row_no, item[0], item[1] or "", item[2]
+        else:
+            yield row_no, "", "", ""
+
+
+# ============================================================
+# Recording counts
+# ============================================================
+
+@transaction.atomic
+def record_counts(
+    adjustment: InventoryAdjustment,
+    rows: Iterable[CountRow],
+    *,
+    mode: str = COUNT_MODE_SET,
+    user=None,
+) -> CountResult:
+    """
+    Write counted quantities for many (product, location) pairs at once:
+
+    - products are resolved through ProductIndex, locations through the
+      warehouse's location codes (both loaded once);
+    - rows for the same pair are summed, then every touched line gets one
+      bulk_update of counted_qty (set or add, see COUNT_MODES);
+    - a pair without a line (stock found outside the session) gets a new
+      line, with its current level as theoretical quantity.
+
+    Rows that cannot be resolved are skipped and reported in the result.
+    """
+    if mode not in COUNT_MODES:
+        raise ValidationError(_("طريقة العد غير معروفة: %(mode)s") % {"mode": mode})
+
+    adjustment = InventoryAdjustment.objects.select_for_update().get(pk=adjustment.pk)
+    if adjustment.status in (InventoryAdjustment.Status.APPLIED, InventoryAdjustment.Status.CANCELLED):
+        raise ValidationError(_("لا يمكن تعديل كميات جرد مرحّل أو ملغى."))
+
+    lines = {
+        (line.product_id, line.location_id): line
+        for line in adjustment.lines.only("id", "product_id", "location_id", "counted_qty")
+    }
+    line_locations: dict[int, set[int]] = defaultdict(set)
+    for product_id, location_id in lines:
+        line_locations[product_id].add(location_id)
+
+    index = ProductIndex()
+    locations = {
+        code.strip().upper(): pk
+        for pk, code in StockLocation.objects.filter(warehouse_id=adjustment.warehouse_id).values_list("pk", "code")
+    }
+
+    result = CountResult()
+    counted: dict[tuple[int, int], Decimal] = defaultdict(Decimal)
+    for row_no, identifier, location_code, raw_qty in rows:
+        result.rows += 1
+
+        product_id = index.resolve(identifier)
+        if product_id is None:
+            result.errors.append((row_no, _("منتج غير معروف: %(code)s") % {"code": identifier}))
+            continue
+
+        qty = _parse_qty(raw_qty)
+        if qty is None or qty < 0:
+            result.errors.append((row_no, _("كمية غير صحيحة: %(qty)s") % {"qty": raw_qty}))
+            continue
+
+        if location_code:
+            location_id = locations.get(str(location_code).strip().upper())
+        elif adjustment.location_id:
+            location_id = adjustment.location_id
+        elif len(line_locations[product_id]) == 1:
+            location_id = next(iter(line_locations[product_id]))
+        else:
+            location_id = None
+        if location_id is None:
+            result.errors.append((row_no, _("الموقع غير محدد أو غير موجود في المستودع: %(loc)s") % {"loc": location_code}))
+            continue
+        if adjustment.location_id and location_id != adjustment.location_id:
+            result.errors.append((row_no, _("الموقع خارج نطاق الجرد: %(loc)s") % {"loc": location_code}))
+            continue
+
+        counted[(product_id, location_id)] += qty
+
+    if not counted:
+        return result
+
+    now = timezone.now()
+    user = user if getattr(user, "is_authenticated", False) else None
+
+    to_update = []
+    missing = []
+    for key, qty in counted.items():
+        line = lines.get(key)
+        if line is None:
+            missing.append(key)
+            continue
+        if mode == COUNT_MODE_ADD:
+            qty += line.counted_qty or DECIMAL_ZERO
+        line.counted_qty = qty
+        line.updated_by = user
+        line.updated_at = now
+        to_update.append(line)
+
+    if to_update:
+        InventoryAdjustmentLine.objects.bulk_update(
+            to_update, ["counted_qty", "updated_by", "updated_at"], batch_size=1000
+        )
+        result.updated = len(to_update)
+
+    if missing:
+        on_hand = {
+            (product_id, location_id): qty
+            for product_id, location_id, qty in StockLevel.objects.filter(
+                warehouse_id=adjustment.warehouse_id,
+                product_id__in={product_id for product_id, _loc in missing},
+            ).values_list("product_id", "location_id", "quantity_on_hand")
+        }
+        InventoryAdjustmentLine.objects.bulk_create(
+            [
+                InventoryAdjustmentLine(
+                    adjustment=adjustment,
+                    product_id=product_id,
+                    location_id=location_id,
+                    theoretical_qty=on_hand.get((product_id, location_id), DECIMAL_ZERO),
+                    counted_qty=counted[(product_id, location_id)],
+                    created_by=user,
+                    updated_by=user,
+                )
+                for product_id, location_id in missing
+            ],
+            batch_size=1000,
+        )
+        result.created = len(missing)
+
+    if adjustment.status == InventoryAdjustment.Status.DRAFT:
+        adjustment.status = InventoryAdjustment.Status.IN_PROGRESS
+    adjustment.updated_by = user
+    adjustment.save(update_fields=["status", "updated_by"])
+
+    log_event(
+        action=AuditLog.Action.UPDATE,
+        message=_("Inventory counts imported."),
+        actor=user,
+        target=adjustment,
+        extra={"mode": mode, "rows": result.rows, "updated": result.updated,
+               "created": result.created, "errors": len(result.errors)},
+    )
+    return result
@@ -16,6 +16,7 @@ from .models import (
     InventoryAdjustmentLine,
     ReorderRule,
 )
+from .counting import COUNT_MODE_ADD, COUNT_MODE_SET
 
 # ============================================================
 # Bootstrap Mixin (موحد)
@@ -243,6 +244,21 @@ InventoryAdjustmentLineFormSet = inlineformset_factory(
 )
 
 
+class InventoryCountImportForm(BootstrapFormMixin, forms.Form):
+    file = forms.FileField(
+        label=_("ملف العد (CSV)"),
+        help_text=_("الأعمدة: الباركود أو كود المنتج، كود الموقع، الكمية."),
+    )
+    mode = forms.ChoiceField(
+        choices=[
+            (COUNT_MODE_SET, _("استبدال الكمية المجرودة")),
+            (COUNT_MODE_ADD, _("إضافة إلى الكمية المجرودة")),
+        ],
+        initial=COUNT_MODE_SET,
+        label=_("طريقة الإدخال"),
+    )
+
+
 # ============================================================
 # Reorder Rule
 # ============================================================
@@ -255,6 +271,9 @@ class ReorderRuleForm(BootstrapFormMixin, forms.ModelForm):
             "location",
             "min_qty",
             "target_qty",
+            "supplier",
+            "multiple_of",
+            "lead_time_days",
             "is_active",
         ]
 
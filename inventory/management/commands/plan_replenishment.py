@@ -0,0 +1,51 @@
+# inventory/management/commands/plan_replenishment.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.models import Warehouse
+from inventory.replenishment import create_replenishment_moves, plan_replenishment
+
+
+class Command(BaseCommand):
+    """
+    Turn triggered reorder rules into draft receipts, one per
+    supplier / warehouse location. Quantities already on draft receipts
+    are deducted, so running it again does not order twice.
+    """
+
+    help = "Plan replenishment from reorder rules and create draft IN moves (use --dry-run to only print the plan)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--warehouse", help="Only rules of this warehouse (code).")
+        parser.add_argument("--supplier", type=int, help="Only rules of this supplier (contact id).")
+        parser.add_argument("--dry-run", action="store_true", help="Print the plan without creating moves.")
+
+    def handle(self, *args, **options):
+        warehouse_id = None
+        if options.get("warehouse"):
+            warehouse = Warehouse.objects.filter(code=options["warehouse"]).first()
+            if warehouse is None:
+                raise CommandError(f"Warehouse {options['warehouse']} not found.")
+            warehouse_id = warehouse.pk
+
+        groups = plan_replenishment(warehouse_id=warehouse_id, supplier_id=options.get("supplier"))
+        if not groups:
+            self.stdout.write("Nothing to replenish.")
+            return
+
+        for group in groups:
+            self.stdout.write(
+                f"{group.supplier_label} -> {group.warehouse.code}/{group.location.code} "
+                f"(expected {group.expected_date.isoformat()}):"
+            )
+            for line in group.lines:
+                self.stdout.write(
+                    f"  {line.rule.product.code}: {line.quantity} "
+                    f"(on hand {line.rule.current_stock}, on order {line.incoming})"
+                )
+
+        if options["dry_run"]:
+            return
+
+        moves = create_replenishment_moves(groups)
+        self.stdout.write(self.style.SUCCESS(f"{len(moves)} draft receipt(s) created."))
@@ -0,0 +1,46 @@
+# inventory/management/commands/take_stock_snapshot.py
+
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.stock_ledger import month_end, previous_month_end, take_stock_snapshot
+
+
+class Command(BaseCommand):
+    """
+    Month-end StockLevel snapshots for point-in-time stock queries
+    (inventory.stock_ledger.stock_on_hand_as_of). Meant to run from cron
+    early each month; --months re-takes dropped snapshots oldest first,
+    each one building on the previous.
+    """
+
+    help = "Snapshot on-hand quantities per product/location at month end (default: end of last month)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", help="Snapshot the end of this day (YYYY-MM-DD) instead of last month end.")
+        parser.add_argument(
+            "--months", type=int, default=1,
+            help="Number of consecutive month ends to (re)take, ending at --date / last month end (default: 1).",
+        )
+
+    def handle(self, *args, **options):
+        if options.get("date"):
+            try:
+                last = date.fromisoformat(options["date"])
+            except ValueError:
+                raise CommandError(f"Invalid --date: {options['date']} (expected YYYY-MM-DD).")
+        else:
+            last = previous_month_end()
+
+        months = options["months"]
+        if months < 1:
+            raise CommandError("--months must be at least 1.")
+
+        days = [last]
+        for _i in range(months - 1):
+            days.append(month_end(days[-1].replace(day=1) - date.resolution))
+
+        for day in reversed(days):
+            count = take_stock_snapshot(day)
+            self.stdout.write(self.style.SUCCESS(f"{day.isoformat()}: {count} stock level(s) snapshotted."))
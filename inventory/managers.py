@@ -6,7 +6,7 @@ from typing import TYPE_CHECKING, Optional
 
 from django.apps import apps
 from django.db import models
-from django.db.models import Count, F, Prefetch, Q, Sum
+from django.db.models import Case, Count, F, Max, OuterRef, Prefetch, Q, Subquery, Sum, When
 from django.db.models.functions import Coalesce
 
 if TYPE_CHECKING:
@@ -17,9 +17,11 @@ if TYPE_CHECKING:
         ProductCategory,
         ReorderRule,
         StockLevel,
+        StockLevelSnapshot,
         StockLocation,
         StockMove,
         StockMoveLine,
+        StockValuationLayer,
         Warehouse,
     )
 
@@ -303,14 +305,45 @@ class ReorderRuleQuerySet(SoftDeleteQuerySet, models.QuerySet["ReorderRule"]):
         return self.visible().filter(is_active=True)
 
     def with_related(self) -> "ReorderRuleQuerySet":
-        return self.select_related("product", "warehouse", "location")
+        return self.select_related("product", "warehouse", "location", "supplier")
+
+    def with_stock(self) -> "ReorderRuleQuerySet":
+        """
+        Annotate current_stock_value: on-hand at the rule's location, or the
+        whole warehouse when the rule has none (correlated SUM subqueries,
+        so a page of rules costs one query).
+        """
+        StockLevelModel = apps.get_model("inventory", "StockLevel")
+        output = models.DecimalField(max_digits=14, decimal_places=3)
+
+        def on_hand(levels):
+            return Subquery(
+                levels.order_by()
+                .values("product_id")
+                .annotate(total=Sum("quantity_on_hand"))
+                .values("total")[:1],
+                output_field=output,
+            )
+
+        levels = StockLevelModel.objects.filter(product_id=OuterRef("product_id"), warehouse_id=OuterRef("warehouse_id"))
+        return self.annotate(
+            current_stock_value=Coalesce(
+                Case(
+                    When(location__isnull=True, then=on_hand(levels)),
+                    default=on_hand(levels.filter(location_id=OuterRef("location_id"))),
+                    output_field=output,
+                ),
+                DECIMAL_ZERO,
+                output_field=output,
+            )
+        )
 
     def triggered(self) -> "ReorderRuleQuerySet":
-        return self.active().with_related()
+        """Active rules whose current stock is below min_qty, evaluated in SQL."""
+        return self.active().with_stock().filter(current_stock_value__lt=F("min_qty"))
 
     def get_triggered_rules(self):
-        rules = self.active().with_related()
-        return [r for r in rules if r.is_below_min]
+        return list(self.triggered().with_related())
 
 
 class ReorderRuleManager(models.Manager.from_queryset(ReorderRuleQuerySet)):  # type: ignore[misc]
@@ -367,3 +400,58 @@ class InventoryAdjustmentLineQuerySet(SoftDeleteQuerySet, models.QuerySet["Inven
 class InventoryAdjustmentLineManager(models.Manager.from_queryset(InventoryAdjustmentLineQuerySet)):  # type: ignore[misc]
     def get_queryset(self) -> InventoryAdjustmentLineQuerySet:
         return super().get_queryset().visible()
+
+
+# ============================================================
+# StockValuationLayer Manager
+# ============================================================
+class StockValuationLayerQuerySet(models.QuerySet["StockValuationLayer"]):
+    def incoming(self) -> "StockValuationLayerQuerySet":
+        return self.filter(quantity__gt=0)
+
+    def outgoing(self) -> "StockValuationLayerQuerySet":
+        return self.filter(quantity__lt=0)
+
+    def open(self) -> "StockValuationLayerQuerySet":
+        """Incoming layers not fully consumed yet (FIFO candidates, partial index)."""
+        return self.filter(remaining_qty__gt=0)
+
+    def as_of(self, when=None) -> "StockValuationLayerQuerySet":
+        return self.filter(date__lte=when) if when is not None else self
+
+    def within(self, date_from=None, date_to=None) -> "StockValuationLayerQuerySet":
+        qs = self
+        if date_from is not None:
+            qs = qs.filter(date__gte=date_from)
+        if date_to is not None:
+            qs = qs.filter(date__lte=date_to)
+        return qs
+
+    def totals_by_product(self) -> "StockValuationLayerQuerySet":
+        """One row per product: (product_id, qty, value) — one GROUP BY."""
+        return (
+            self.order_by()
+            .values("product_id")
+            .annotate(
+                qty=Coalesce(Sum("quantity"), DECIMAL_ZERO, output_field=models.DecimalField(max_digits=16, decimal_places=3)),
+                value=Coalesce(Sum("value"), DECIMAL_ZERO, output_field=models.DecimalField(max_digits=18, decimal_places=3)),
+            )
+        )
+
+
+class StockValuationLayerManager(models.Manager.from_queryset(StockValuationLayerQuerySet)):  # type: ignore[misc]
+    pass
+
+
+# ============================================================
+# StockLevelSnapshot Manager
+# ============================================================
+class StockLevelSnapshotQuerySet(models.QuerySet["StockLevelSnapshot"]):
+    def latest_date(self, on_or_before=None):
+        """Date of the most recent snapshot (optionally on/before a day), or None."""
+        qs = self.filter(date__lte=on_or_before) if on_or_before is not None else self
+        return qs.aggregate(d=Max("date"))["d"]
+
+
+class StockLevelSnapshotManager(models.Manager.from_queryset(StockLevelSnapshotQuerySet)):  # type: ignore[misc]
+    pass
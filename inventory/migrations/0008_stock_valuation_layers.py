@@ -0,0 +1,81 @@
+# Generated by Django 5.2.8 on 2026-10-16 20:15
+
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Q, Sum
+
+
+def backfill_opening_layers(apps, schema_editor):
+    """
+    One opening layer per stockable product that has stock: on-hand
+    quantity valued at the current average cost, open for FIFO.
+
+    The layers are dated when the migration runs (there is no cost history
+    to rebuild earlier ones from), so layer-based values as of earlier dates
+    are zero; see valuation.stock_valuation().
+    """
+    Product = apps.get_model("inventory", "Product")
+    StockValuationLayer = apps.get_model("inventory", "StockValuationLayer")
+
+    products = (
+        Product.objects.filter(product_type="stockable")
+        .annotate(on_hand=Sum("stock_levels__quantity_on_hand", filter=Q(stock_levels__is_deleted=False)))
+        .filter(on_hand__gt=0)
+    )
+    now = django.utils.timezone.now()
+    layers = []
+    for product in products.iterator():
+        qty = product.on_hand
+        unit_cost = product.average_cost or Decimal("0.000")
+        value = (qty * unit_cost).quantize(Decimal("0.001"))
+        layers.append(StockValuationLayer(
+            product=product,
+            date=now,
+            quantity=qty,
+            unit_cost=unit_cost,
+            value=value,
+            remaining_qty=qty,
+            remaining_value=value,
+        ))
+    StockValuationLayer.objects.bulk_create(layers, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_remove_inventoryadjustmentline_uniq_inv_adj_line_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventorysettings',
+            name='costing_method',
+            field=models.CharField(choices=[('average', 'متوسط التكلفة المرجح'), ('fifo', 'الوارد أولاً صادر أولاً (FIFO)')], default='average', help_text='تحدد تكلفة الكميات الصادرة في طبقات التقييم.', max_length=20, verbose_name='طريقة التكلفة'),
+        ),
+        migrations.CreateModel(
+            name='StockValuationLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='التاريخ')),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=14, verbose_name='الكمية')),
+                ('unit_cost', models.DecimalField(decimal_places=4, default=Decimal('0.000'), max_digits=14, verbose_name='تكلفة الوحدة')),
+                ('value', models.DecimalField(decimal_places=3, max_digits=16, verbose_name='القيمة')),
+                ('remaining_qty', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=14, verbose_name='الكمية المتبقية')),
+                ('remaining_value', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=16, verbose_name='القيمة المتبقية')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('move', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='valuation_layers', to='inventory.stockmove', verbose_name='الحركة')),
+                ('move_line', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='valuation_layers', to='inventory.stockmoveline', verbose_name='بند الحركة')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='valuation_layers', to='inventory.product', verbose_name='المنتج')),
+                ('reverses', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='reversals', to='inventory.stockvaluationlayer', verbose_name='عكس الطبقة')),
+            ],
+            options={
+                'verbose_name': 'طبقة تقييم مخزون',
+                'verbose_name_plural': 'طبقات تقييم المخزون',
+                'ordering': ('date', 'id'),
+                'indexes': [models.Index(fields=['product', 'date'], name='svl_product_date_idx'), models.Index(fields=['date'], name='svl_date_idx'), models.Index(condition=models.Q(('remaining_qty__gt', 0)), fields=['product', 'date', 'id'], name='svl_fifo_open_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_opening_layers, migrations.RunPython.noop),
+    ]
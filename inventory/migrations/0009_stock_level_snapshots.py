@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-16 20:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0008_stock_valuation_layers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockLevelSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='التاريخ')),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=14, verbose_name='الكمية')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='inventory.stocklocation', verbose_name='الموقع')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='inventory.product', verbose_name='المنتج')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='inventory.warehouse', verbose_name='المستودع')),
+            ],
+            options={
+                'verbose_name': 'لقطة رصيد مخزون',
+                'verbose_name_plural': 'لقطات أرصدة المخزون',
+                'ordering': ('-date', 'product_id'),
+                'indexes': [models.Index(fields=['date', 'warehouse'], name='stocksnap_date_wh_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'product', 'warehouse', 'location'), name='uniq_stocksnap_date_prod_wh_loc')],
+            },
+        ),
+    ]
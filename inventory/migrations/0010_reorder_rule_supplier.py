@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-16 20:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0001_initial'),
+        ('inventory', '0009_stock_level_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reorderrule',
+            name='supplier',
+            field=models.ForeignKey(blank=True, limit_choices_to={'is_supplier': True}, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reorder_rules', to='contacts.contact', verbose_name='المورد'),
+        ),
+    ]
@@ -13,7 +13,7 @@ from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from solo.models import SingletonModel
 
-from core.models import BaseModel
+from core.models import BaseModel, CachedSingletonMixin
 from uom.models import UnitOfMeasure
 
 from inventory.managers import (
@@ -27,6 +27,8 @@ from inventory.managers import (
     StockMoveLineManager,
     InventoryAdjustmentManager,
     InventoryAdjustmentLineManager,
+    StockValuationLayerManager,
+    StockLevelSnapshotManager,
 )
 
 # ============================================================
@@ -39,13 +41,25 @@ DECIMAL_ONE = Decimal("1.000")
 # ============================================================
 # Inventory Settings
 # ============================================================
-class InventorySettings(SingletonModel):
+class InventorySettings(CachedSingletonMixin, SingletonModel):
     allow_negative_stock = models.BooleanField(
         default=True,
         verbose_name=_("السماح بالمخزون السالب"),
         help_text=_("إذا تم تفعيله، يمكن تأكيد حركات الصرف حتى لو لم تتوفر كمية كافية."),
     )
 
+    class CostingMethod(models.TextChoices):
+        AVERAGE = "average", _("متوسط التكلفة المرجح")
+        FIFO = "fifo", _("الوارد أولاً صادر أولاً (FIFO)")
+
+    costing_method = models.CharField(
+        max_length=20,
+        choices=CostingMethod.choices,
+        default=CostingMethod.AVERAGE,
+        verbose_name=_("طريقة التكلفة"),
+        help_text=_("تحدد تكلفة الكميات الصادرة في طبقات التقييم."),
+    )
+
     stock_move_in_prefix = models.CharField(max_length=10, default="IN", verbose_name=_("بادئة الحركات الواردة"))
     stock_move_out_prefix = models.CharField(max_length=10, default="OUT", verbose_name=_("بادئة الحركات الصادرة"))
     stock_move_transfer_prefix = models.CharField(max_length=10, default="TRF", verbose_name=_("بادئة التحويلات"))
@@ -648,6 +662,125 @@ class StockLevel(BaseModel):
         return (self.quantity_on_hand or DECIMAL_ZERO) - (self.quantity_reserved or DECIMAL_ZERO)
 
 
+# ============================================================
+# Stock Valuation Layers (append-only costing ledger)
+# ============================================================
+class StockValuationLayer(models.Model):
+    """
+    One row per confirmed stock move line (base UOM), never edited except
+    for remaining_qty / remaining_value of incoming layers:
+
+      - incoming (quantity > 0): value = quantity * unit_cost; remaining_*
+        is what FIFO has not consumed yet.
+      - outgoing (quantity < 0): value = -(cost of what left), from the
+        product's average or from the FIFO layers it consumed.
+      - reversal: mirror of another layer (reverses), so cancelling a move
+        restores the previous valuation exactly.
+
+    Stock value = SUM(value), COGS = -SUM(value) of outgoing layers.
+    """
+
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name="valuation_layers", verbose_name=_("المنتج"))
+    # null: opening balance layers (no source move)
+    move = models.ForeignKey(
+        StockMove,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="valuation_layers",
+        verbose_name=_("الحركة"),
+    )
+    move_line = models.ForeignKey(
+        StockMoveLine,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="valuation_layers",
+        verbose_name=_("بند الحركة"),
+    )
+    reverses = models.ForeignKey(
+        "self",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="reversals",
+        verbose_name=_("عكس الطبقة"),
+    )
+
+    date = models.DateTimeField(default=timezone.now, verbose_name=_("التاريخ"))
+    quantity = models.DecimalField(max_digits=14, decimal_places=3, verbose_name=_("الكمية"))
+    unit_cost = models.DecimalField(max_digits=14, decimal_places=4, default=DECIMAL_ZERO, verbose_name=_("تكلفة الوحدة"))
+    value = models.DecimalField(max_digits=16, decimal_places=3, verbose_name=_("القيمة"))
+    remaining_qty = models.DecimalField(max_digits=14, decimal_places=3, default=DECIMAL_ZERO, verbose_name=_("الكمية المتبقية"))
+    remaining_value = models.DecimalField(max_digits=16, decimal_places=3, default=DECIMAL_ZERO, verbose_name=_("القيمة المتبقية"))
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = StockValuationLayerManager()
+
+    class Meta:
+        verbose_name = _("طبقة تقييم مخزون")
+        verbose_name_plural = _("طبقات تقييم المخزون")
+        ordering = ("date", "id")
+        indexes = [
+            models.Index(fields=["product", "date"], name="svl_product_date_idx"),
+            models.Index(fields=["date"], name="svl_date_idx"),
+            # FIFO: open incoming layers of a product, oldest first
+            models.Index(
+                fields=["product", "date", "id"],
+                condition=Q(remaining_qty__gt=0),
+                name="svl_fifo_open_idx",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.product_id}: {self.quantity} @ {self.unit_cost} = {self.value}"
+
+    @property
+    def is_incoming(self) -> bool:
+        return self.quantity > 0
+
+
+# ============================================================
+# Stock Level Snapshots (month-end quantities)
+# ============================================================
+class StockLevelSnapshot(models.Model):
+    """
+    On-hand quantity per (product, warehouse, location) at the end of `date`
+    (normally a month end), written by the `take_stock_snapshot` command.
+    As-of quantities = latest snapshot + done move lines since
+    (see inventory.stock_ledger). Snapshots on/after the date of a
+    back-dated confirm or a cancel are dropped, so they never go stale.
+    """
+
+    date = models.DateField(verbose_name=_("التاريخ"))
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="stock_snapshots", verbose_name=_("المنتج"))
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name="stock_snapshots", verbose_name=_("المستودع"))
+    location = models.ForeignKey(StockLocation, on_delete=models.CASCADE, related_name="stock_snapshots", verbose_name=_("الموقع"))
+    quantity = models.DecimalField(max_digits=14, decimal_places=3, verbose_name=_("الكمية"))
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = StockLevelSnapshotManager()
+
+    class Meta:
+        verbose_name = _("لقطة رصيد مخزون")
+        verbose_name_plural = _("لقطات أرصدة المخزون")
+        ordering = ("-date", "product_id")
+        indexes = [
+            models.Index(fields=["date", "warehouse"], name="stocksnap_date_wh_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "product", "warehouse", "location"],
+                name="uniq_stocksnap_date_prod_wh_loc",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.date}: {self.product_id} @ {self.location_id} = {self.quantity}"
+
+
 # ============================================================
 # Reorder Rules
 # ============================================================
@@ -667,6 +800,15 @@ class ReorderRule(BaseModel):
     target_qty = models.DecimalField(max_digits=12, decimal_places=3, default=DECIMAL_ZERO, verbose_name=_("الكمية المستهدفة"))
     multiple_of = models.DecimalField(max_digits=12, decimal_places=3, null=True, blank=True, verbose_name=_("مضاعفات الكمية"))
     lead_time_days = models.PositiveIntegerField(default=0, verbose_name=_("مدة التوريد (أيام)"))
+    supplier = models.ForeignKey(
+        "contacts.Contact",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        limit_choices_to={"is_supplier": True},
+        related_name="reorder_rules",
+        verbose_name=_("المورد"),
+    )
     is_active = models.BooleanField(default=True, verbose_name=_("نشطة"))
 
     objects = ReorderRuleManager()
@@ -698,6 +840,10 @@ class ReorderRule(BaseModel):
 
     @property
     def current_stock(self) -> Decimal:
+        # Annotated by ReorderRuleQuerySet.with_stock()
+        if "current_stock_value" in self.__dict__:
+            return self.current_stock_value
+
         if self.location_id:
             level = StockLevel.objects.filter(
                 product_id=self.product_id,
@@ -712,9 +858,13 @@ class ReorderRule(BaseModel):
         ).aggregate(t=Sum("quantity_on_hand"))["t"]
         return total if total is not None else DECIMAL_ZERO
 
-    def get_recommended_qty(self) -> Decimal:
+    def get_recommended_qty(self, incoming: Decimal = DECIMAL_ZERO) -> Decimal:
+        """
+        Quantity to order to reach target_qty, rounded up to multiple_of.
+        `incoming`: quantity already on order (draft receipts).
+        """
         target = self.target_qty or DECIMAL_ZERO
-        current = self.current_stock or DECIMAL_ZERO
+        current = (self.current_stock or DECIMAL_ZERO) + (incoming or DECIMAL_ZERO)
         diff = target - current
 
         if diff <= 0:
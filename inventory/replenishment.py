@@ -0,0 +1,187 @@
+# inventory/replenishment.py
+
+from __future__ import annotations
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from .models import (
+    DECIMAL_ZERO,
+    ReorderRule,
+    StockLocation,
+    StockMove,
+    StockMoveLine,
+)
+from .stock_ledger import base_quantity_expression
+
+
+# ============================================================
+# Plan
+# ============================================================
+
+@dataclass
+class ReplenishmentLine:
+    rule: ReorderRule
+    incoming: Decimal
+    quantity: Decimal
+
+
+@dataclass
+class ReplenishmentGroup:
+    """
+    One future draft receipt: everything to order from one supplier into
+    one warehouse location, expected after the slowest lead time.
+    """
+    supplier: object | None
+    warehouse: object
+    location: StockLocation
+    expected_date: date
+    lines: list[ReplenishmentLine] = field(default_factory=list)
+
+    @property
+    def supplier_label(self) -> str:
+        return str(self.supplier) if self.supplier else _("بدون مورد")
+
+
+def incoming_quantities(warehouse_ids) -> dict[tuple[int, int, int], Decimal]:
+    """
+    Quantity already on order per (product, warehouse, location): draft
+    receipts in base UOM, one GROUP BY. Counted so re-running the planner
+    does not order twice.
+    """
+    rows = (
+        StockMoveLine.objects.filter(
+            move__move_type=StockMove.MoveType.IN,
+            move__status=StockMove.Status.DRAFT,
+            move__is_deleted=False,
+            move__to_warehouse_id__in=warehouse_ids,
+        )
+        .order_by()
+        .values_list("product_id", "move__to_warehouse_id", "move__to_location_id")
+        .annotate(qty=Sum(base_quantity_expression()))
+    )
+    return {(product_id, wh_id, loc_id): qty or DECIMAL_ZERO for product_id, wh_id, loc_id, qty in rows}
+
+
+def _default_locations(warehouse_ids) -> dict[int, StockLocation]:
+    """First active internal location per warehouse, for rules without a location."""
+    locations: dict[int, StockLocation] = {}
+    for location in (
+        StockLocation.objects.filter(
+            warehouse_id__in=warehouse_ids,
+            type=StockLocation.LocationType.INTERNAL,
+            is_active=True,
+        ).order_by("warehouse_id", "id")
+    ):
+        locations.setdefault(location.warehouse_id, location)
+    return locations
+
+
+def plan_replenishment(
+    *,
+    warehouse_id: int | None = None,
+    supplier_id: int | None = None,
+    today: date | None = None,
+) -> list[ReplenishmentGroup]:
+    """
+    Triggered reorder rules (stock below min_qty, evaluated in SQL) turned
+    into quantities to order:
+      - target_qty - (on hand + already on order), rounded up to multiple_of;
+      - grouped per (supplier, warehouse, location);
+      - expected on today + the longest lead_time_days of the group.
+    """
+    today = today or timezone.localdate()
+    rules = ReorderRule.objects.triggered().with_related().select_related("product__base_uom")
+    if warehouse_id is not None:
+        rules = rules.filter(warehouse_id=warehouse_id)
+    if supplier_id is not None:
+        rules = rules.filter(supplier_id=supplier_id)
+    rules = list(rules.order_by("warehouse_id", "supplier_id", "product_id"))
+    if not rules:
+        return []
+
+    warehouse_ids = {rule.warehouse_id for rule in rules}
+    incoming = incoming_quantities(warehouse_ids)
+    incoming_per_warehouse: dict[tuple[int, int], Decimal] = defaultdict(Decimal)
+    for (product_id, wh_id, _loc_id), qty in incoming.items():
+        incoming_per_warehouse[(product_id, wh_id)] += qty
+    default_locations = _default_locations(warehouse_ids)
+
+    groups: dict[tuple, ReplenishmentGroup] = {}
+    for rule in rules:
+        location = rule.location or default_locations.get(rule.warehouse_id)
+        if location is None:
+            continue
+
+        if rule.location_id:
+            on_order = incoming.get((rule.product_id, rule.warehouse_id, rule.location_id), DECIMAL_ZERO)
+        else:
+            on_order = incoming_per_warehouse[(rule.product_id, rule.warehouse_id)]
+        quantity = rule.get_recommended_qty(incoming=on_order)
+        if quantity <= 0:
+            continue
+
+        expected = today + timedelta(days=rule.lead_time_days or 0)
+        key = (rule.supplier_id, rule.warehouse_id, location.pk)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = ReplenishmentGroup(rule.supplier, rule.warehouse, location, expected)
+        group.expected_date = max(group.expected_date, expected)
+        group.lines.append(ReplenishmentLine(rule=rule, incoming=on_order, quantity=quantity))
+
+    return list(groups.values())
+
+
+# ============================================================
+# Draft receipts
+# ============================================================
+
+@transaction.atomic
+def create_replenishment_moves(groups: list[ReplenishmentGroup], *, user=None) -> list[StockMove]:
+    """
+    One draft IN move per group and its lines, written with two
+    bulk_create calls. Moves are dated on the expected receipt date and
+    costed at the product's average cost; they are confirmed on arrival,
+    which re-dates them to that moment (see confirm_stock_move).
+    """
+    user = user if getattr(user, "is_authenticated", False) else None
+    stamp = timezone.localdate().strftime("%Y%m%d")
+
+    moves = [
+        StockMove(
+            move_type=StockMove.MoveType.IN,
+            status=StockMove.Status.DRAFT,
+            to_warehouse=group.warehouse,
+            to_location=group.location,
+            move_date=timezone.make_aware(datetime.combine(group.expected_date, time.min)),
+            reference=f"REPL-{stamp}-{group.warehouse.code}-{group.supplier.pk if group.supplier else 0}",
+            note=_("إعادة طلب تلقائية - المورد: %(supplier)s") % {"supplier": group.supplier_label},
+            created_by=user,
+            updated_by=user,
+        )
+        for group in groups
+    ]
+    StockMove.objects.bulk_create(moves, batch_size=500)
+
+    lines = [
+        StockMoveLine(
+            move=move,
+            product=line.rule.product,
+            quantity=line.quantity,
+            uom=line.rule.product.base_uom,
+            cost_price=line.rule.product.average_cost or DECIMAL_ZERO,
+            created_by=user,
+            updated_by=user,
+        )
+        for move, group in zip(moves, groups)
+        for line in group.lines
+    ]
+    StockMoveLine.objects.bulk_create(lines, batch_size=500)
+    return moves
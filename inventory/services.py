@@ -9,6 +9,7 @@ from typing import Any, Optional, TYPE_CHECKING
 from django.core.exceptions import ValidationError
 from django.db import transaction
 from django.db.models import F, Sum
+from django.utils import timezone
 from django.utils.translation import gettext as _
 
 from core.models import AuditLog, Notification
@@ -25,6 +26,8 @@ from .models import (
     StockMove,
     StockMoveLine,
 )
+from .stock_ledger import invalidate_snapshots
+from .valuation import create_valuation_layers, reverse_valuation_layers
 
 if TYPE_CHECKING:
     from django.contrib.auth import get_user_model
@@ -141,186 +144,133 @@ def _get_or_create_level_locked(
     return level
 
 
-def _adjust_on_hand_locked(
-    *,
-    product_id: int,
-    warehouse_id: int,
-    location_id: int,
-    delta: Decimal,
-) -> StockLevel:
-    level = _get_or_create_level_locked(
-        product_id=product_id,
-        warehouse_id=warehouse_id,
-        location_id=location_id,
-    )
-
-    if delta == 0:
-        return level
-
-    StockLevel.objects.filter(pk=level.pk).update(quantity_on_hand=F("quantity_on_hand") + delta)
-    level.refresh_from_db(fields=["quantity_on_hand"])
-    return level
-
-
 # ============================================================
-# Negative stock validation
+# Set-based stock level engine
 # ============================================================
 
-def _validate_negative_stock(move: StockMove) -> None:
-    settings = InventorySettings.get_solo()
-    if settings.allow_negative_stock:
-        return
-
-    if move.move_type == StockMove.MoveType.IN:
-        return
-
-    # OUT and TRANSFER: validate source
-    source_wh_id = move.from_warehouse_id
-    source_loc_id = move.from_location_id
-    if not source_wh_id or not source_loc_id:
-        return
+LevelKey = tuple[int, int, int]  # (product_id, warehouse_id, location_id)
 
-    # Requirements per product in base UOM
-    requirements: dict[int, Decimal] = defaultdict(Decimal)
-    product_names: dict[int, str] = {}
 
-    for line in move.lines.select_related("product", "uom").all():
-        if not getattr(line.product, "is_stock_item", True):
-            continue
-        requirements[line.product_id] += line.get_base_quantity()
-        product_names[line.product_id] = line.product.name
-
-    # Lock levels and validate
-    for prod_id, required_qty in requirements.items():
-        level = StockLevel.objects.select_for_update().filter(
-            product_id=prod_id,
-            warehouse_id=source_wh_id,
-            location_id=source_loc_id,
-        ).values("quantity_on_hand").first()
-
-        current_qty = level["quantity_on_hand"] if level else DECIMAL_ZERO
-        if current_qty < required_qty:
-            prod_name = product_names.get(prod_id, _("Unknown Product"))
-            raise ValidationError(
-                _("الرصيد غير كافٍ للمنتج '%(prod)s'. المتاح: %(curr)s، المطلوب: %(req)s.") % {
-                    "prod": prod_name,
-                    "curr": current_qty,
-                    "req": required_qty,
-                }
-            )
-
-
-# ============================================================
-# Costing
-# ============================================================
-
-def _update_product_average_cost(move: StockMove) -> None:
+def _move_level_deltas(move: StockMove, *, factor: Decimal) -> dict[LevelKey, Decimal]:
     """
-    Weighted average cost update for IN moves.
-    Updates Product.average_cost for STOCKABLE items only.
+    Group a move's lines in memory into one on-hand delta per
+    (product, warehouse, location). One query for all lines.
+    factor:
+      +1  confirm
+      -1  reverse
     """
-    if move.move_type != StockMove.MoveType.IN:
-        return
+    deltas: dict[LevelKey, Decimal] = defaultdict(Decimal)
+    source = (move.from_warehouse_id, move.from_location_id)
+    destination = (move.to_warehouse_id, move.to_location_id)
 
-    # Iterate for memory safety
-    for line in move.lines.select_related("product", "uom").iterator():
-        product = line.product
-        if product.product_type != Product.ProductType.STOCKABLE:
+    lines = move.lines.select_related("product", "product__base_uom", "product__alt_uom", "uom")
+    for line in lines:
+        if not getattr(line.product, "is_stock_item", True):
             continue
 
-        incoming_qty = line.get_base_quantity()
-        if incoming_qty <= 0:
+        qty = line.get_base_quantity() * factor
+        if qty == 0:
             continue
 
-        incoming_cost = line.cost_price or DECIMAL_ZERO
+        if move.move_type in (StockMove.MoveType.OUT, StockMove.MoveType.TRANSFER):
+            deltas[(line.product_id, *source)] -= qty
+        if move.move_type in (StockMove.MoveType.IN, StockMove.MoveType.TRANSFER):
+            deltas[(line.product_id, *destination)] += qty
 
-        # Lock product row
-        locked_product = Product.objects.select_for_update().get(pk=product.pk)
+    return {key: delta for key, delta in deltas.items() if delta}
 
-        current_qty = locked_product.total_on_hand
-        current_avg = locked_product.average_cost or DECIMAL_ZERO
 
-        if current_qty <= 0:
-            new_avg = incoming_cost
-        else:
-            current_value = current_qty * current_avg
-            incoming_value = incoming_qty * incoming_cost
-            new_total_qty = current_qty + incoming_qty
-            new_avg = (current_value + incoming_value) / new_total_qty if new_total_qty > 0 else incoming_cost
+LOCK_BATCH_SIZE = 500
 
-        # Save only if changed meaningfully
-        if (locked_product.average_cost or DECIMAL_ZERO) != new_avg:
-            locked_product.average_cost = new_avg
-            locked_product.save(update_fields=["average_cost"])
 
+def _lock_levels(keys) -> dict[LevelKey, StockLevel]:
+    """
+    Lock the StockLevel rows of `keys`: one query per (warehouse, location)
+    and batch of LOCK_BATCH_SIZE products (`product_id IN (...)`), instead of
+    one OR per key, which SQLite rejects past ~1000 keys.
 
-def _snapshot_out_cost(move: StockMove) -> None:
+    Groups and batches are taken in sorted order and each query locks by pk,
+    so concurrent confirmations always lock in the same order.
     """
-    For OUT moves, fill cost_price from product.average_cost if cost_price is zero.
+    products_per_location: dict[tuple[int, int], list[int]] = defaultdict(list)
+    for product_id, warehouse_id, location_id in keys:
+        products_per_location[(warehouse_id, location_id)].append(product_id)
+
+    levels: dict[LevelKey, StockLevel] = {}
+    for (warehouse_id, location_id), product_ids in sorted(products_per_location.items()):
+        product_ids.sort()
+        for start in range(0, len(product_ids), LOCK_BATCH_SIZE):
+            batch = StockLevel.objects.select_for_update().filter(
+                warehouse_id=warehouse_id,
+                location_id=location_id,
+                product_id__in=product_ids[start:start + LOCK_BATCH_SIZE],
+            ).order_by("pk")
+            levels.update({(lv.product_id, lv.warehouse_id, lv.location_id): lv for lv in batch})
+    return levels
+
+
+def _check_negative_levels(deltas: dict[LevelKey, Decimal], levels: dict[LevelKey, StockLevel]) -> None:
     """
-    if move.move_type != StockMove.MoveType.OUT:
+    Raise if a decreasing delta would take a level below zero
+    (unless InventorySettings.allow_negative_stock).
+    """
+    if InventorySettings.get_solo().allow_negative_stock:
         return
 
-    updates: list[StockMoveLine] = []
-    for line in move.lines.select_related("product").all():
-        if (line.cost_price or DECIMAL_ZERO) == DECIMAL_ZERO and (line.product.average_cost or DECIMAL_ZERO) > 0:
-            line.cost_price = line.product.average_cost
-            updates.append(line)
-
-    if updates:
-        StockMoveLine.objects.bulk_update(updates, ["cost_price"])
-
+    for key, delta in deltas.items():
+        if delta >= 0:
+            continue
+        level = levels.get(key)
+        current_qty = level.quantity_on_hand if level else DECIMAL_ZERO
+        if current_qty + delta < 0:
+            product = Product.objects.filter(pk=key[0]).only("name").first()
+            raise ValidationError(
+                _("الرصيد غير كافٍ للمنتج '%(prod)s'. المتاح: %(curr)s، المطلوب: %(req)s.") % {
+                    "prod": product.name if product else _("Unknown Product"),
+                    "curr": current_qty,
+                    "req": -delta,
+                }
+            )
 
-# ============================================================
-# Apply move deltas (stock levels)
-# ============================================================
 
-def _apply_move_delta(move: StockMove, *, factor: Decimal) -> None:
+def apply_stock_deltas(deltas: dict[LevelKey, Decimal], *, check_negative: bool = False) -> dict[LevelKey, StockLevel]:
     """
-    Apply move lines to stock levels.
-    factor:
-      +1  confirm
-      -1  reverse
+    Apply on-hand deltas to StockLevel in bulk:
+      1) lock all affected rows in one ordered query,
+      2) (optionally) validate none goes negative,
+      3) bulk_create the missing rows with their delta as quantity,
+      4) bulk_update the existing rows (one UPDATE per batch).
+    Must run inside a transaction.
     """
-    for line in move.lines.select_related("product", "uom").iterator():
-        if not getattr(line.product, "is_stock_item", True):
-            continue
-
-        base_qty = line.get_base_quantity()
-        if base_qty == 0:
-            continue
-
-        qty = base_qty * factor
-
-        if move.move_type == StockMove.MoveType.IN:
-            _adjust_on_hand_locked(
-                product_id=line.product_id,
-                warehouse_id=move.to_warehouse_id,
-                location_id=move.to_location_id,
-                delta=qty,
-            )
-
-        elif move.move_type == StockMove.MoveType.OUT:
-            _adjust_on_hand_locked(
-                product_id=line.product_id,
-                warehouse_id=move.from_warehouse_id,
-                location_id=move.from_location_id,
-                delta=-qty,  # OUT reduces; note qty already includes factor
+    levels = _lock_levels(deltas)
+    if check_negative:
+        _check_negative_levels(deltas, levels)
+
+    to_create: list[StockLevel] = []
+    to_update: list[StockLevel] = []
+    for key, delta in deltas.items():
+        level = levels.get(key)
+        if level is None:
+            product_id, warehouse_id, location_id = key
+            level = StockLevel(
+                product_id=product_id,
+                warehouse_id=warehouse_id,
+                location_id=location_id,
+                quantity_on_hand=delta,
+                quantity_reserved=DECIMAL_ZERO,
+                min_stock=DECIMAL_ZERO,
             )
+            levels[key] = level
+            to_create.append(level)
+        else:
+            level.quantity_on_hand = (level.quantity_on_hand or DECIMAL_ZERO) + delta
+            to_update.append(level)
 
-        else:  # TRANSFER
-            _adjust_on_hand_locked(
-                product_id=line.product_id,
-                warehouse_id=move.from_warehouse_id,
-                location_id=move.from_location_id,
-                delta=-qty,
-            )
-            _adjust_on_hand_locked(
-                product_id=line.product_id,
-                warehouse_id=move.to_warehouse_id,
-                location_id=move.to_location_id,
-                delta=qty,
-            )
+    if to_create:
+        StockLevel.objects.bulk_create(to_create, batch_size=500)
+    if to_update:
+        StockLevel.objects.bulk_update(to_update, ["quantity_on_hand"], batch_size=500)
+    return levels
 
 
 # ============================================================
@@ -341,23 +291,30 @@ def confirm_stock_move(move: StockMove, user: Optional["User"] = None) -> StockM
     if move.status != StockMove.Status.DRAFT:
         raise ValidationError(_("يجب أن تكون الحالة مسودة لتأكيد الحركة."))
 
-    # Validate negative stock first
-    _validate_negative_stock(move)
+    # A draft dated ahead (e.g. a replenishment receipt on its expected date)
+    # happens now: its layers and ledger rows must not sit in the future
+    update_fields = ["status", "updated_by"]
+    now = timezone.now()
+    if move.move_date > now:
+        move.move_date = now
+        update_fields.append("move_date")
+
+    deltas = _move_level_deltas(move, factor=DECIMAL_ONE)
 
-    # Costing
-    if move.move_type == StockMove.MoveType.IN:
-        _update_product_average_cost(move)
-    elif move.move_type == StockMove.MoveType.OUT:
-        _snapshot_out_cost(move)
+    # Apply stock (validates negative stock on the locked rows first)
+    apply_stock_deltas(deltas, check_negative=move.move_type != StockMove.MoveType.IN)
 
-    # Apply stock
-    _apply_move_delta(move, factor=DECIMAL_ONE)
+    # Costing: one valuation layer per line (also snapshots OUT cost_price)
+    create_valuation_layers(move)
+
+    # Month-end snapshots after a back-dated move no longer hold
+    invalidate_snapshots(move)
 
     # Update status
     move.status = StockMove.Status.DONE
     if user is not None and getattr(user, "is_authenticated", False):
         move.updated_by = user
-    move.save(update_fields=["status", "updated_by"])
+    move.save(update_fields=update_fields)
 
     # Audit
     log_event(
@@ -395,8 +352,10 @@ def cancel_stock_move(move: StockMove, user: Optional["User"] = None) -> StockMo
     was_done = (move.status == StockMove.Status.DONE)
 
     if was_done:
-        # Reverse stock
-        _apply_move_delta(move, factor=DECIMAL_MINUS_ONE)
+        # Reverse stock and its valuation
+        apply_stock_deltas(_move_level_deltas(move, factor=DECIMAL_MINUS_ONE))
+        reverse_valuation_layers(move)
+        invalidate_snapshots(move)
 
     move.status = StockMove.Status.CANCELLED
     if user is not None and getattr(user, "is_authenticated", False):
@@ -0,0 +1,228 @@
+# inventory/stock_ledger.py
+
+from __future__ import annotations
+
+import calendar
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Case, F, Sum, When
+from django.utils import timezone
+
+from .models import (
+    DECIMAL_ZERO,
+    Product,
+    StockLevel,
+    StockLevelSnapshot,
+    StockMove,
+    StockMoveLine,
+    StockValuationLayer,
+)
+
+LevelKey = tuple[int, int, int]  # (product_id, warehouse_id, location_id)
+
+STOCK_PRODUCT_TYPES = (Product.ProductType.STOCKABLE, Product.ProductType.CONSUMABLE)
+
+_QTY_FIELD = models.DecimalField(max_digits=18, decimal_places=3)
+
+
+# ============================================================
+# Dates
+# ============================================================
+
+def day_end(day: date) -> datetime:
+    """Start of the next local day: "as of `day`" means move_date < day_end(day)."""
+    return timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def month_end(day: date) -> date:
+    return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+
+def previous_month_end(today: date | None = None) -> date:
+    today = today or timezone.localdate()
+    return today.replace(day=1) - timedelta(days=1)
+
+
+# ============================================================
+# Move deltas (SQL aggregates, no Python replay)
+# ============================================================
+
+def base_quantity_expression():
+    """Line quantity in the product's base UOM (mirrors Product.to_base)."""
+    return Case(
+        When(uom_id=F("product__alt_uom_id"), product__alt_factor__isnull=False,
+             then=F("quantity") * F("product__alt_factor")),
+        default=F("quantity"),
+        output_field=_QTY_FIELD,
+    )
+
+
+def move_deltas(
+    start: datetime | None = None,
+    end: datetime | None = None,
+    *,
+    warehouse_id: int | None = None,
+    location_id: int | None = None,
+    product_ids=None,
+) -> dict[LevelKey, Decimal]:
+    """
+    Net on-hand change per (product, warehouse, location) from done move
+    lines with start <= move_date < end: one GROUP BY for the incoming
+    side (IN, TRANSFER) and one for the outgoing side (OUT, TRANSFER).
+    """
+    lines = StockMoveLine.objects.filter(
+        move__status=StockMove.Status.DONE,
+        move__is_deleted=False,
+        product__product_type__in=STOCK_PRODUCT_TYPES,
+    )
+    if start is not None:
+        lines = lines.filter(move__move_date__gte=start)
+    if end is not None:
+        lines = lines.filter(move__move_date__lt=end)
+    if product_ids is not None:
+        lines = lines.filter(product_id__in=product_ids)
+
+    deltas: dict[LevelKey, Decimal] = defaultdict(Decimal)
+    sides = (
+        (1, "to", (StockMove.MoveType.IN, StockMove.MoveType.TRANSFER)),
+        (-1, "from", (StockMove.MoveType.OUT, StockMove.MoveType.TRANSFER)),
+    )
+    for sign, side, move_types in sides:
+        qs = lines.filter(move__move_type__in=move_types)
+        if warehouse_id is not None:
+            qs = qs.filter(**{f"move__{side}_warehouse_id": warehouse_id})
+        if location_id is not None:
+            qs = qs.filter(**{f"move__{side}_location_id": location_id})
+
+        rows = (
+            qs.order_by()
+            .values_list("product_id", f"move__{side}_warehouse_id", f"move__{side}_location_id")
+            .annotate(qty=Sum(base_quantity_expression()))
+        )
+        for product_id, wh_id, loc_id, qty in rows:
+            deltas[(product_id, wh_id, loc_id)] += sign * (qty or DECIMAL_ZERO)
+
+    return deltas
+
+
+# ============================================================
+# As-of quantities
+# ============================================================
+
+def _filtered(qs, warehouse_id, location_id, product_ids):
+    if warehouse_id is not None:
+        qs = qs.filter(warehouse_id=warehouse_id)
+    if location_id is not None:
+        qs = qs.filter(location_id=location_id)
+    if product_ids is not None:
+        qs = qs.filter(product_id__in=product_ids)
+    return qs
+
+
+def stock_on_hand_as_of(
+    as_of: date,
+    *,
+    warehouse_id: int | None = None,
+    location_id: int | None = None,
+    product_ids=None,
+) -> dict[LevelKey, Decimal]:
+    """
+    On-hand quantity per (product, warehouse, location) at the end of `as_of`.
+
+    - With a snapshot on/before `as_of`: snapshot + deltas since it
+      (monthly snapshots keep this to about one month of move lines).
+    - Without one: current StockLevel - deltas after `as_of`.
+    """
+    filters = dict(warehouse_id=warehouse_id, location_id=location_id, product_ids=product_ids)
+    snapshot_date = StockLevelSnapshot.objects.latest_date(on_or_before=as_of)
+
+    quantities: dict[LevelKey, Decimal] = defaultdict(Decimal)
+    if snapshot_date is not None:
+        base = _filtered(StockLevelSnapshot.objects.filter(date=snapshot_date), warehouse_id, location_id, product_ids)
+        for product_id, wh_id, loc_id, qty in base.values_list("product_id", "warehouse_id", "location_id", "quantity"):
+            quantities[(product_id, wh_id, loc_id)] += qty
+        sign, deltas = 1, move_deltas(day_end(snapshot_date), day_end(as_of), **filters)
+    else:
+        base = _filtered(
+            StockLevel.objects.filter(product__product_type__in=STOCK_PRODUCT_TYPES),
+            warehouse_id, location_id, product_ids,
+        )
+        for product_id, wh_id, loc_id, qty in base.values_list(
+            "product_id", "warehouse_id", "location_id", "quantity_on_hand"
+        ):
+            quantities[(product_id, wh_id, loc_id)] += qty
+        sign, deltas = -1, move_deltas(day_end(as_of), None, **filters)
+
+    for key, delta in deltas.items():
+        quantities[key] += sign * delta
+    return {key: qty for key, qty in quantities.items() if qty}
+
+
+def unit_costs_as_of(as_of: date, product_ids) -> dict[int, Decimal]:
+    """
+    Unit cost per product at the end of `as_of` from the valuation layers
+    (value / qty, one GROUP BY); falls back to Product.average_cost.
+    """
+    costs = dict(Product.objects.filter(pk__in=product_ids).values_list("pk", "average_cost"))
+    rows = StockValuationLayer.objects.filter(date__lt=day_end(as_of), product_id__in=product_ids).totals_by_product()
+    for row in rows:
+        if row["qty"] > 0:
+            costs[row["product_id"]] = row["value"] / row["qty"]
+    return costs
+
+
+def stock_report_as_of(as_of: date, *, warehouse_id: int | None = None, location_id: int | None = None) -> list[dict]:
+    """
+    Rows for a point-in-time stock report (e.g. year end):
+    product_id, warehouse_id, location_id, quantity, unit_cost, value.
+    """
+    quantities = stock_on_hand_as_of(as_of, warehouse_id=warehouse_id, location_id=location_id)
+    costs = unit_costs_as_of(as_of, {product_id for product_id, _wh, _loc in quantities})
+
+    rows = []
+    for (product_id, wh_id, loc_id), qty in sorted(quantities.items()):
+        unit_cost = costs.get(product_id) or DECIMAL_ZERO
+        rows.append({
+            "product_id": product_id,
+            "warehouse_id": wh_id,
+            "location_id": loc_id,
+            "quantity": qty,
+            "unit_cost": unit_cost,
+            "value": (qty * unit_cost).quantize(Decimal("0.001")),
+        })
+    return rows
+
+
+# ============================================================
+# Snapshots
+# ============================================================
+
+@transaction.atomic
+def take_stock_snapshot(day: date) -> int:
+    """
+    (Re)write the snapshot for the end of `day` from the previous snapshot
+    (or the current levels) plus deltas. Returns the number of rows.
+    """
+    StockLevelSnapshot.objects.filter(date=day).delete()
+    quantities = stock_on_hand_as_of(day)
+    StockLevelSnapshot.objects.bulk_create(
+        [
+            StockLevelSnapshot(date=day, product_id=product_id, warehouse_id=wh_id, location_id=loc_id, quantity=qty)
+            for (product_id, wh_id, loc_id), qty in quantities.items()
+        ],
+        batch_size=1000,
+    )
+    return len(quantities)
+
+
+def invalidate_snapshots(move: StockMove) -> int:
+    """
+    Drop snapshots that a confirm / cancel of `move` makes stale
+    (those at or after the move's local date). No-op for current moves.
+    """
+    since = timezone.localdate(move.move_date)
+    deleted, _per_model = StockLevelSnapshot.objects.filter(date__gte=since).delete()
+    return deleted
@@ -1,17 +1,36 @@
+import json
+from datetime import date, timedelta
 from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 
 from inventory.models import (
+    InventoryAdjustment,
+    InventorySettings,
     ProductCategory,
+    ReorderRule,
     Product,
     Warehouse,
     StockLocation,
     StockMove,
+    StockMoveLine,
     StockLevel,
+    StockLevelSnapshot,
+    StockValuationLayer,
 )
-from inventory import services
+from inventory import counting, replenishment, services, stock_ledger, valuation, views
 
 
 class BaseInventoryTestCase(TestCase):
@@ -778,3 +797,410 @@ class ManagersTests(BaseInventoryTestCase):
         # for_warehouse: WH2 appears only as destination in transfer
         for_wh2 = list(StockMove.objects.for_warehouse(self.wh2))
         self.assertEqual(for_wh2, [move_transfer])
+
+
+class StockEngineTestCase(TestCase):
+    """
+    Self-contained fixtures (UOM-based products) for the stock engine services.
+    """
+
+    def setUp(self):
+        from uom.models import UnitOfMeasure, UomCategory
+
+        category = UomCategory.objects.create(code="unit", name="Unit")
+        self.pcs = UnitOfMeasure.objects.create(category=category, code="PCS", name="Piece", symbol="pcs")
+        self.box = UnitOfMeasure.objects.create(category=category, code="BOX", name="Box", symbol="box")
+
+        self.products = [
+            Product.objects.create(
+                code=f"SKU-{i}", name=f"Product {i}", base_uom=self.pcs, alt_uom=self.box, alt_factor=Decimal("10"),
+            )
+            for i in range(5)
+        ]
+        self.warehouse = Warehouse.objects.create(code="WH", name="Main")
+        self.shelf = StockLocation.objects.create(warehouse=self.warehouse, code="A", name="Shelf A")
+        self.other = StockLocation.objects.create(warehouse=self.warehouse, code="B", name="Shelf B")
+
+    def make_move(self, move_type, lines, cost_price="1.000", **locations):
+        move = StockMove.objects.create(move_type=move_type, **locations)
+        for product, qty, uom in lines:
+            StockMoveLine.objects.create(
+                move=move, product=product, quantity=Decimal(qty), uom=uom or self.pcs, cost_price=Decimal(cost_price),
+            )
+        return move
+
+    def receive(self, lines, cost_price="1.000"):
+        return self.make_move(
+            StockMove.MoveType.IN, lines, cost_price, to_warehouse=self.warehouse, to_location=self.shelf,
+        )
+
+    def ship(self, lines):
+        return self.make_move(
+            StockMove.MoveType.OUT, lines, "0", from_warehouse=self.warehouse, from_location=self.shelf,
+        )
+
+    def on_hand(self, product, location=None):
+        level = StockLevel.objects.filter(product=product, location=location or self.shelf).first()
+        return level.quantity_on_hand if level else None
+
+
+class StockMoveConfirmationEngineTests(StockEngineTestCase):
+    def test_receipt_groups_lines_and_bulk_writes_levels(self):
+        # Two lines of the same product (one in boxes) collapse into one delta
+        lines = [(p, "2", None) for p in self.products] + [(self.products[0], "1", self.box)]
+        move = self.receive(lines)
+        StockLevel.objects.create(product=self.products[1], warehouse=self.warehouse, location=self.shelf)
+
+        deltas = services._move_level_deltas(move, factor=services.DECIMAL_ONE)
+        self.assertEqual(len(deltas), 5)
+        self.assertEqual(deltas[(self.products[0].pk, self.warehouse.pk, self.shelf.pk)], Decimal("12"))
+
+        with CaptureQueriesContext(connection) as ctx:
+            levels = services.apply_stock_deltas(deltas)
+        self.assertEqual(len(levels), 5)
+        # one locking SELECT + one INSERT + one UPDATE, whatever the line count
+        self.assertEqual(len(ctx), 3)
+
+        self.assertEqual(self.on_hand(self.products[0]), Decimal("12.000"))
+        self.assertEqual(self.on_hand(self.products[1]), Decimal("2.000"))
+
+    def test_confirm_and_cancel_transfer(self):
+        services.confirm_stock_move(self.receive([(self.products[0], "5", None)]))
+        transfer = self.make_move(
+            StockMove.MoveType.TRANSFER, [(self.products[0], "3", None)],
+            from_warehouse=self.warehouse, from_location=self.shelf,
+            to_warehouse=self.warehouse, to_location=self.other,
+        )
+        services.confirm_stock_move(transfer)
+        self.assertEqual(self.on_hand(self.products[0]), Decimal("2.000"))
+        self.assertEqual(self.on_hand(self.products[0], self.other), Decimal("3.000"))
+
+        services.cancel_stock_move(transfer)
+        self.assertEqual(self.on_hand(self.products[0]), Decimal("5.000"))
+        self.assertEqual(self.on_hand(self.products[0], self.other), Decimal("0.000"))
+
+    def test_negative_stock_rejected_before_any_write(self):
+        cache.clear()
+        settings_obj = InventorySettings.get_solo()
+        settings_obj.allow_negative_stock = False
+        settings_obj.save()
+
+        services.confirm_stock_move(self.receive([(self.products[0], "1", None), (self.products[1], "9", None)]))
+        out = self.make_move(
+            StockMove.MoveType.OUT, [(self.products[1], "4", None), (self.products[0], "2", None)],
+            from_warehouse=self.warehouse, from_location=self.shelf,
+        )
+        with self.assertRaises(ValidationError):
+            services.confirm_stock_move(out)
+
+        out.refresh_from_db()
+        self.assertEqual(out.status, StockMove.Status.DRAFT)
+        self.assertEqual(self.on_hand(self.products[1]), Decimal("9.000"))
+
+
+class StockValuationLayerTests(StockEngineTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.product = self.products[0]
+
+    def set_costing_method(self, method):
+        settings_obj = InventorySettings.get_solo()
+        settings_obj.costing_method = method
+        settings_obj.save()
+
+    def open_layers(self):
+        return [tuple(row) for row in StockValuationLayer.objects.open().values_list("remaining_qty", "remaining_value")]
+
+    def test_average_cost_and_exact_receipt_reversal(self):
+        services.confirm_stock_move(self.receive([(self.product, "10", None)], "2.000"))
+        second = self.receive([(self.product, "1", self.box)], "40.000")  # 10 pcs @ 4
+        services.confirm_stock_move(second)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.average_cost, Decimal("3.000"))
+        self.assertEqual(valuation.stock_value(), Decimal("60.000"))
+
+        # Cancelling the receipt brings back the previous average exactly
+        services.cancel_stock_move(second)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.average_cost, Decimal("2.000"))
+        self.assertEqual(valuation.stock_value(), Decimal("20.000"))
+        self.assertEqual(StockValuationLayer.objects.filter(reverses__isnull=False).count(), 1)
+
+    def test_average_out_snapshots_cost_and_cogs(self):
+        services.confirm_stock_move(self.receive([(self.product, "10", None)], "2.000"))
+        services.confirm_stock_move(self.receive([(self.product, "10", None)], "4.000"))
+        out = self.ship([(self.product, "5", None)])
+        services.confirm_stock_move(out)
+
+        line = out.lines.get()
+        self.assertEqual(line.cost_price, Decimal("3.000"))
+        self.assertEqual(valuation.cost_of_goods_sold(), Decimal("15.000"))
+        self.assertEqual(valuation.stock_value(), Decimal("45.000"))
+
+    def test_fifo_consumes_oldest_layers_and_reversal_restores_them(self):
+        self.set_costing_method(InventorySettings.CostingMethod.FIFO)
+        services.confirm_stock_move(self.receive([(self.product, "10", None)], "2.000"))
+        services.confirm_stock_move(self.receive([(self.product, "10", None)], "4.000"))
+
+        out = self.ship([(self.product, "15", None)])
+        services.confirm_stock_move(out)
+        self.assertEqual(valuation.cost_of_goods_sold(), Decimal("40.000"))  # 10 x 2 + 5 x 4
+
+        remaining = StockValuationLayer.objects.open().values_list("remaining_qty", "remaining_value")
+        self.assertEqual([tuple(row) for row in remaining], [(Decimal("5.000"), Decimal("20.000"))])
+
+        services.cancel_stock_move(out)
+        self.assertEqual(valuation.cost_of_goods_sold(), Decimal("0"))
+        self.assertEqual(valuation.stock_value(), Decimal("60.000"))
+        rows = valuation.stock_valuation()
+        self.assertEqual([(r["qty"], r["value"]) for r in rows], [(Decimal("20.000"), Decimal("60.000"))])
+
+    def test_average_keeps_open_layers_for_a_later_switch_to_fifo(self):
+        services.confirm_stock_move(self.receive([(self.product, "10", None)], "1.000"))
+        services.confirm_stock_move(self.receive([(self.product, "10", None)], "3.000"))
+        services.confirm_stock_move(self.ship([(self.product, "5", None)]))
+        self.assertEqual(valuation.cost_of_goods_sold(), Decimal("10.000"))  # 5 x average 2
+
+        # Oldest quantity consumed, what is left valued at the average
+        self.assertEqual(self.open_layers(), [(Decimal("5.000"), Decimal("10.000")), (Decimal("10.000"), Decimal("20.000"))])
+
+        self.set_costing_method(InventorySettings.CostingMethod.FIFO)
+        services.confirm_stock_move(self.ship([(self.product, "15", None)]))
+        self.assertEqual(valuation.cost_of_goods_sold(), Decimal("40.000"))
+        self.assertEqual(valuation.stock_value(), Decimal("0"))
+        self.assertEqual(self.open_layers(), [])
+
+    def test_switching_method_in_settings_rebuilds_open_layers(self):
+        services.confirm_stock_move(self.receive([(self.product, "10", None)], "1.000"))
+        services.confirm_stock_move(self.receive([(self.product, "10", None)], "3.000"))
+        services.confirm_stock_move(self.ship([(self.product, "12", None)]))
+        # Layers written before open layers were kept in average mode
+        StockValuationLayer.objects.filter(quantity__gt=0).update(remaining_qty=F("quantity"), remaining_value=F("value"))
+
+        self.client.force_login(get_user_model().objects.create_user("stock", password="x"))
+        response = self.client.post(reverse("inventory:settings"), {
+            "costing_method": InventorySettings.CostingMethod.FIFO,
+            "stock_move_in_prefix": "IN", "stock_move_out_prefix": "OUT", "stock_move_transfer_prefix": "TRF",
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.open_layers(), [(Decimal("8.000"), Decimal("16.000"))])
+        self.assertEqual(valuation.stock_value(), Decimal("16.000"))
+
+
+class StockLedgerAsOfTests(StockEngineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = self.products[0]
+        self.key_a = (self.product.pk, self.warehouse.pk, self.shelf.pk)
+        self.key_b = (self.product.pk, self.warehouse.pk, self.other.pk)
+
+        # 15 Dec: +10 pcs and +1 box (10 pcs), 10 Jan: -4, 5 Feb: 2 moved A -> B
+        self.confirm_on(self.receive([(self.product, "10", None), (self.product, "1", self.box)]), date(2025, 12, 15))
+        self.out = self.ship([(self.product, "4", None)])
+        self.confirm_on(self.out, date(2026, 1, 10))
+        transfer = self.make_move(
+            StockMove.MoveType.TRANSFER, [(self.product, "2", None)],
+            from_warehouse=self.warehouse, from_location=self.shelf,
+            to_warehouse=self.warehouse, to_location=self.other,
+        )
+        self.confirm_on(transfer, date(2026, 2, 5))
+
+    def confirm_on(self, move, day):
+        StockMove.objects.filter(pk=move.pk).update(move_date=stock_ledger.day_end(day) - timedelta(hours=12))
+        services.confirm_stock_move(move)
+
+    def test_as_of_without_snapshot_walks_back_from_current_levels(self):
+        self.assertEqual(stock_ledger.stock_on_hand_as_of(date(2025, 12, 1)), {})
+        self.assertEqual(stock_ledger.stock_on_hand_as_of(date(2025, 12, 31)), {self.key_a: Decimal("20.000")})
+        self.assertEqual(stock_ledger.stock_on_hand_as_of(date(2026, 1, 31)), {self.key_a: Decimal("16.000")})
+
+    def test_snapshot_plus_deltas(self):
+        self.assertEqual(stock_ledger.take_stock_snapshot(date(2025, 12, 31)), 1)
+
+        with CaptureQueriesContext(connection) as ctx:
+            quantities = stock_ledger.stock_on_hand_as_of(date(2026, 2, 28))
+        # latest snapshot date + snapshot rows + incoming and outgoing GROUP BYs
+        self.assertEqual(len(ctx), 4)
+        self.assertEqual(quantities, {self.key_a: Decimal("14.000"), self.key_b: Decimal("2.000")})
+
+        # valued at the layer average: (10 x 1 + 1 box x 1) / 20 pcs = 0.55
+        rows = stock_ledger.stock_report_as_of(date(2026, 2, 28), location_id=self.other.pk)
+        self.assertEqual([(r["quantity"], r["value"]) for r in rows], [(Decimal("2"), Decimal("1.100"))])
+
+    def test_back_dated_cancel_drops_later_snapshots(self):
+        call_command("take_stock_snapshot", date="2026-01-31", months=2, stdout=StringIO())
+        self.assertEqual(
+            list(StockLevelSnapshot.objects.order_by("date").values_list("date", "quantity")),
+            [(date(2025, 12, 31), Decimal("20.000")), (date(2026, 1, 31), Decimal("16.000"))],
+        )
+
+        services.cancel_stock_move(self.out)
+        self.assertEqual(list(StockLevelSnapshot.objects.values_list("date", flat=True)), [date(2025, 12, 31)])
+        self.assertEqual(stock_ledger.stock_on_hand_as_of(date(2026, 1, 31)), {self.key_a: Decimal("20.000")})
+
+
+class ReplenishmentPlannerTests(StockEngineTestCase):
+    def setUp(self):
+        from contacts.models import Contact
+
+        super().setUp()
+        self.supplier = Contact.objects.create(name="Supplier", is_supplier=True)
+        p0, p1, p2, p3 = self.products[:4]
+        services.confirm_stock_move(self.receive([(p0, "2", None)]))
+        services.confirm_stock_move(self.make_move(
+            StockMove.MoveType.IN, [(p1, "3", None)], to_warehouse=self.warehouse, to_location=self.other,
+        ))
+
+        rule = dict(warehouse=self.warehouse)
+        # 20 - 2 = 18 -> 20 (multiple of 5)
+        ReorderRule.objects.create(product=p0, location=self.shelf, min_qty=5, target_qty=20, multiple_of=5,
+                                   supplier=self.supplier, lead_time_days=3, **rule)
+        # whole warehouse: 15 - 3 = 12, received on the default (first internal) location
+        ReorderRule.objects.create(product=p1, min_qty=10, target_qty=15, supplier=self.supplier,
+                                   lead_time_days=7, **rule)
+        ReorderRule.objects.create(product=p2, min_qty=1, target_qty=4, **rule)
+        ReorderRule.objects.create(product=p3, min_qty=0, target_qty=10, **rule)  # 0 < 0: not triggered
+
+    def test_triggered_rules_in_one_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(ReorderRule.objects.triggered().count(), 3)
+        self.assertEqual(len(ctx), 1)
+
+        rules = list(ReorderRule.objects.active().with_stock().order_by("product__code"))
+        with CaptureQueriesContext(connection) as ctx:
+            stocks = [rule.current_stock for rule in rules]
+        self.assertEqual(len(ctx), 0)
+        self.assertEqual(stocks, [Decimal("2.000"), Decimal("3.000"), Decimal("0"), Decimal("0")])
+
+    def test_plan_groups_per_supplier_and_creates_draft_receipts(self):
+        today = date(2026, 3, 1)
+        groups = replenishment.plan_replenishment(today=today)
+        self.assertEqual(len(groups), 2)
+
+        by_supplier = {group.supplier: group for group in groups}
+        grouped = by_supplier[self.supplier]
+        self.assertEqual(grouped.location, self.shelf)
+        self.assertEqual(grouped.expected_date, date(2026, 3, 8))
+        self.assertEqual(
+            [(line.rule.product, line.quantity) for line in grouped.lines],
+            [(self.products[0], Decimal("20")), (self.products[1], Decimal("12.000"))],
+        )
+
+        moves = replenishment.create_replenishment_moves(groups)
+        self.assertEqual(StockMove.objects.draft().filter(pk__in=[m.pk for m in moves]).count(), 2)
+        self.assertEqual(StockMoveLine.objects.filter(move__in=moves).count(), 3)
+
+        # Quantities on draft receipts count as on order: nothing left to plan
+        self.assertEqual(replenishment.plan_replenishment(today=today), [])
+
+    def test_receipt_confirmed_before_its_expected_date_is_dated_now(self):
+        groups = replenishment.plan_replenishment(today=timezone.localdate())
+        move = next(
+            m for m in replenishment.create_replenishment_moves(groups) if m.lines.filter(product=self.products[0])
+        )
+        self.assertGreater(move.move_date, timezone.now())
+
+        services.confirm_stock_move(move)
+        move.refresh_from_db()
+        self.assertLessEqual(move.move_date, timezone.now())
+
+        layer = StockValuationLayer.objects.get(move=move, product=self.products[0])
+        self.assertEqual(layer.date, move.move_date)
+        on_hand = stock_ledger.stock_on_hand_as_of(timezone.localdate(), product_ids=[self.products[0].pk])
+        self.assertEqual(sum(on_hand.values()), Decimal("22.000"))
+
+
+class InventoryCountingTests(StockEngineTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="counter", password="x")
+        p0, p1 = self.products[:2]
+        p0.barcode = "6290001"
+        p0.save(update_fields=["barcode"])
+        services.confirm_stock_move(self.receive([(p0, "5", None), (p1, "3", None), (self.products[3], "1", None)]))
+        self.adjustment = services.create_inventory_session(warehouse=self.warehouse, user=self.user)
+
+    def counted(self, product, location=None):
+        return self.adjustment.lines.get(product=product, location=location or self.shelf).counted_qty
+
+    def test_csv_import_bulk_updates_counts_and_adds_found_stock(self):
+        upload = SimpleUploadedFile("count.csv", (
+            "barcode,location,qty\n"
+            "6290001,A,4\n"
+            "sku-1,,2\n"          # code, case-insensitive; location from the session line
+            "SKU-1,,1\n"          # same pair: summed
+            "SKU-2,B,7\n"         # not in the session: new line
+            "UNKNOWN,A,1\n"
+        ).encode())
+
+        result = counting.record_counts(self.adjustment, counting.parse_count_csv(upload), user=self.user)
+
+        self.assertEqual((result.rows, result.updated, result.created), (5, 2, 1))
+        self.assertEqual([row_no for row_no, _msg in result.errors], [6])
+        self.assertEqual(self.counted(self.products[0]), Decimal("4.000"))
+        self.assertEqual(self.counted(self.products[1]), Decimal("3.000"))
+        self.assertEqual(self.counted(self.products[2], self.other), Decimal("7.000"))
+        self.assertIsNone(self.counted(self.products[3]))
+
+        self.adjustment.refresh_from_db()
+        self.assertEqual(self.adjustment.status, InventoryAdjustment.Status.IN_PROGRESS)
+
+    def test_scanner_batches_add_up(self):
+        self.client.force_login(self.user)
+        url = reverse("inventory:adjustment_count_scan", args=[self.adjustment.pk])
+
+        for items in ([{"code": "6290001", "location": "A"}] * 3, [["6290001", "A", 2]]):
+            response = self.client.post(url, json.dumps({"items": items}), content_type="application/json")
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.counted(self.products[0]), Decimal("5.000"))
+
+        response = self.client.post(url, json.dumps({"mode": "set", "items": [["6290001", "A", "0"]]}),
+                                    content_type="application/json")
+        self.assertEqual(response.json()["updated"], 1)
+        self.assertEqual(self.counted(self.products[0]), Decimal("0.000"))
+
+    def test_applying_a_count_with_more_than_1000_lines(self):
+        Product.objects.bulk_create(
+            Product(code=f"BULK-{i}", name=f"Bulk {i}", base_uom=self.pcs) for i in range(1200)
+        )
+        rows = [(i, f"BULK-{i}", "A", "2") for i in range(1200)]
+        result = counting.record_counts(self.adjustment, rows, user=self.user)
+        self.assertEqual(result.created, 1200)
+
+        services.apply_inventory_adjustment(self.adjustment, self.user)
+
+        self.assertEqual(
+            StockLevel.objects.filter(product__code__startswith="BULK-", location=self.shelf, quantity_on_hand=2).count(),
+            1200,
+        )
+
+    def test_count_page_uses_keyset_pages(self):
+        self.client.force_login(self.user)
+        url = reverse("inventory:adjustment_count", args=[self.adjustment.pk])
+
+        with mock.patch.object(views.InventoryAdjustmentUpdateView, "COUNT_PAGE_SIZE", 2):
+            response = self.client.get(url)
+            first = response.context["lines_formset"]
+            self.assertEqual(len(first.forms), 2)
+            next_after = response.context["next_after"]
+            self.assertEqual(next_after, first.forms[-1].instance.pk)
+
+            response = self.client.get(f"{url}?after={next_after}")
+            self.assertEqual(len(response.context["lines_formset"].forms), 1)
+            self.assertIsNone(response.context["next_after"])
+
+            # Saving the first page writes its edited line and moves on to the next page
+            lines = [form.instance for form in first.forms]
+            data = {
+                "note": "", "after": "0",
+                "lines-TOTAL_FORMS": "2", "lines-INITIAL_FORMS": "2",
+                "lines-MIN_NUM_FORMS": "0", "lines-MAX_NUM_FORMS": "1000",
+                "lines-0-id": lines[0].pk, "lines-0-counted_qty": "9",
+                "lines-1-id": lines[1].pk, "lines-1-counted_qty": "",
+            }
+            response = self.client.post(url, data)
+            self.assertRedirects(response, f"{url}?after={next_after}", fetch_redirect_response=False)
+            lines[0].refresh_from_db()
+            self.assertEqual(lines[0].counted_qty, Decimal("9.000"))
@@ -42,6 +42,8 @@ urlpatterns = [
     path("adjustments/create/", views.InventoryAdjustmentCreateView.as_view(), name="adjustment_create"),
     path("adjustments/<int:pk>/", views.InventoryAdjustmentDetailView.as_view(), name="adjustment_detail"),
     path("adjustments/<int:pk>/count/", views.InventoryAdjustmentUpdateView.as_view(), name="adjustment_count"),
+    path("adjustments/<int:pk>/count/import/", views.adjustment_count_import_view, name="adjustment_count_import"),
+    path("adjustments/<int:pk>/count/scan/", views.adjustment_count_scan_view, name="adjustment_count_scan"),
     path("adjustments/<int:pk>/apply/", views.apply_adjustment_view, name="adjustment_apply"),
 
     # ==========================
@@ -0,0 +1,410 @@
+# inventory/valuation.py
+
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from .models import (
+    DECIMAL_ZERO,
+    InventorySettings,
+    Product,
+    StockMove,
+    StockMoveLine,
+    StockValuationLayer,
+)
+
+VALUE_STEP = Decimal("0.001")
+UNIT_COST_STEP = Decimal("0.0001")
+
+
+def _value(amount: Decimal) -> Decimal:
+    return amount.quantize(VALUE_STEP, rounding=ROUND_HALF_UP)
+
+
+def _unit_cost(value: Decimal, qty: Decimal) -> Decimal:
+    if not qty:
+        return DECIMAL_ZERO
+    return (value / qty).quantize(UNIT_COST_STEP, rounding=ROUND_HALF_UP)
+
+
+# ============================================================
+# Shared helpers
+# ============================================================
+
+def _lock_products(product_ids) -> dict[int, Product]:
+    """
+    Lock the products being costed (one ordered query) so two moves of the
+    same product cannot read the same open layers / totals concurrently.
+    """
+    return {
+        product.pk: product
+        for product in Product.objects.select_for_update().filter(pk__in=product_ids).order_by("pk")
+    }
+
+
+def _product_totals(product_ids) -> dict[int, list[Decimal]]:
+    """Current [qty, value] per product from the layers (one GROUP BY)."""
+    totals: dict[int, list[Decimal]] = defaultdict(lambda: [DECIMAL_ZERO, DECIMAL_ZERO])
+    for row in StockValuationLayer.objects.filter(product_id__in=product_ids).totals_by_product():
+        totals[row["product_id"]] = [row["qty"], row["value"]]
+    return totals
+
+
+def _refresh_average_costs(products: dict[int, Product], totals: dict[int, list[Decimal]]) -> None:
+    """
+    Product.average_cost = layer value / layer qty (kept as a cached
+    figure for forms and reports). Unchanged when there is no stock left.
+    """
+    changed = []
+    for product_id, (qty, value) in totals.items():
+        product = products.get(product_id)
+        if product is None or qty <= 0:
+            continue
+        average = _value(value / qty)
+        if average >= 0 and product.average_cost != average:
+            product.average_cost = average
+            changed.append(product)
+    if changed:
+        Product.objects.bulk_update(changed, ["average_cost"], batch_size=500)
+
+
+# ============================================================
+# Writing layers (confirm)
+# ============================================================
+
+def _consume_fifo(
+    open_layers: list[StockValuationLayer],
+    qty: Decimal,
+    fallback_cost: Decimal,
+    consumed: dict[int, StockValuationLayer],
+) -> Decimal:
+    """
+    Take `qty` from the oldest open layers (in place) and return its cost.
+    Anything beyond the open quantity (negative stock) is valued at the
+    last consumed unit cost, or `fallback_cost`.
+    """
+    cost = DECIMAL_ZERO
+    unit_cost = fallback_cost
+    while qty > 0 and open_layers:
+        layer = open_layers[0]
+        take = min(qty, layer.remaining_qty)
+        if take == layer.remaining_qty:
+            taken_value = layer.remaining_value
+        else:
+            taken_value = _value(layer.remaining_value * take / layer.remaining_qty)
+        layer.remaining_qty -= take
+        layer.remaining_value -= taken_value
+        consumed[layer.pk] = layer
+        if layer.remaining_qty == 0:
+            open_layers.pop(0)
+
+        cost += taken_value
+        qty -= take
+        unit_cost = layer.unit_cost
+
+    if qty > 0:
+        cost += _value(qty * unit_cost)
+    return cost
+
+
+def _revalue_open_layers(
+    open_layers: list[StockValuationLayer],
+    totals: list[Decimal],
+    changed: dict[int, StockValuationLayer],
+) -> None:
+    """
+    Average costing: every open unit is worth the average, so the open
+    layers' remaining_value is remaining_qty x (value / qty); the rounding
+    rest goes to the newest layer, keeping the open value equal to the
+    product's layer value whenever all its stock is open.
+    """
+    total_qty, total_value = totals
+    if not open_layers or total_qty <= 0:
+        return
+
+    open_qty = sum((layer.remaining_qty for layer in open_layers), DECIMAL_ZERO)
+    target = total_value if open_qty == total_qty else _value(open_qty * total_value / total_qty)
+    unit = total_value / total_qty
+
+    for layer in open_layers[:-1]:
+        layer.remaining_value = _value(layer.remaining_qty * unit)
+        changed[layer.pk] = layer
+    last = open_layers[-1]
+    last.remaining_value = target - sum((layer.remaining_value for layer in open_layers[:-1]), DECIMAL_ZERO)
+    changed[last.pk] = last
+
+
+def create_valuation_layers(move: StockMove) -> list[StockValuationLayer]:
+    """
+    Write one valuation layer per stockable line of an IN / OUT move
+    (transfers do not change value). Must run inside the confirm transaction.
+
+    - IN:  value = line total cost; opens a layer.
+    - OUT: costed by InventorySettings.costing_method:
+        average -> current layer value / qty of the product,
+        fifo    -> consumes the oldest open layers (locked in one query).
+      OUT lines without a cost get cost_price from the layer.
+
+    Open layers (remaining_qty / remaining_value) are kept in both modes:
+    average also takes the quantity from the oldest open layers, then
+    revalues what is left at the new average. costing_method can then be
+    switched at any time without FIFO consuming stock that already left.
+
+    Product.average_cost is refreshed from the layer sums afterwards.
+    """
+    if move.move_type not in (StockMove.MoveType.IN, StockMove.MoveType.OUT):
+        return []
+
+    lines = [
+        line
+        for line in move.lines.select_related("product", "product__base_uom", "product__alt_uom", "uom")
+        if line.product.product_type == Product.ProductType.STOCKABLE
+    ]
+    if not lines:
+        return []
+
+    product_ids = {line.product_id for line in lines}
+    products = _lock_products(product_ids)
+    totals = _product_totals(product_ids)
+    incoming = move.move_type == StockMove.MoveType.IN
+    fifo = InventorySettings.get_solo().costing_method == InventorySettings.CostingMethod.FIFO
+
+    open_layers: dict[int, list[StockValuationLayer]] = defaultdict(list)
+    if not incoming:
+        for layer in (
+            StockValuationLayer.objects.select_for_update()
+            .open()
+            .filter(product_id__in=product_ids)
+            .order_by("product_id", "date", "id")
+        ):
+            open_layers[layer.product_id].append(layer)
+
+    layers: list[StockValuationLayer] = []
+    consumed: dict[int, StockValuationLayer] = {}
+    costed_lines: list[StockMoveLine] = []
+
+    for line in lines:
+        qty = line.get_base_quantity()
+        if qty <= 0:
+            continue
+        product_totals = totals[line.product_id]
+
+        if incoming:
+            value = _value(line.line_total_cost)
+            layer = StockValuationLayer(
+                quantity=qty,
+                value=value,
+                remaining_qty=qty,
+                remaining_value=value,
+            )
+        else:
+            total_qty, total_value = product_totals
+            if total_qty > 0:
+                average = total_value / total_qty
+            else:
+                average = products[line.product_id].average_cost or DECIMAL_ZERO
+
+            if fifo:
+                cost = _consume_fifo(open_layers[line.product_id], qty, average, consumed)
+            else:
+                if qty == total_qty:
+                    cost = total_value  # last units out take the exact remaining value
+                else:
+                    cost = _value(qty * average)
+                _consume_fifo(open_layers[line.product_id], qty, average, consumed)  # quantities only
+
+            value = -cost
+            layer = StockValuationLayer(quantity=-qty, value=value)
+
+            if not line.cost_price and line.quantity:
+                line.cost_price = _value(cost / line.quantity)
+                costed_lines.append(line)
+
+        layer.product_id = line.product_id
+        layer.move = move
+        layer.move_line = line
+        layer.date = move.move_date
+        layer.unit_cost = _unit_cost(abs(value), qty)
+        layers.append(layer)
+
+        product_totals[0] += layer.quantity
+        product_totals[1] += layer.value
+
+    if not incoming and not fifo:
+        for product_id in product_ids:
+            _revalue_open_layers(open_layers[product_id], totals[product_id], consumed)
+
+    StockValuationLayer.objects.bulk_create(layers, batch_size=500)
+    if consumed:
+        StockValuationLayer.objects.bulk_update(
+            list(consumed.values()), ["remaining_qty", "remaining_value"], batch_size=500
+        )
+    if costed_lines:
+        StockMoveLine.objects.bulk_update(costed_lines, ["cost_price"], batch_size=500)
+
+    _refresh_average_costs(products, totals)
+    return layers
+
+
+# ============================================================
+# Reversal (cancel)
+# ============================================================
+
+def reverse_valuation_layers(move: StockMove) -> list[StockValuationLayer]:
+    """
+    Mirror every layer of `move` with the opposite quantity and value, so
+    the product's layer sums (and average cost) return exactly to what
+    they were before the move:
+
+      - reversed incoming layer: whatever is still open is closed;
+      - reversed outgoing layer: its quantity comes back as a new open
+        layer at the exact value it left with (same date, so FIFO keeps
+        the original order as closely as possible).
+    """
+    originals = list(
+        move.valuation_layers.select_for_update(of=("self",))
+        .filter(reverses__isnull=True, reversals__isnull=True)
+        .order_by("id")
+    )
+    if not originals:
+        return []
+
+    product_ids = {layer.product_id for layer in originals}
+    products = _lock_products(product_ids)
+
+    reversals: list[StockValuationLayer] = []
+    for layer in originals:
+        reversal = StockValuationLayer(
+            product_id=layer.product_id,
+            move=move,
+            move_line_id=layer.move_line_id,
+            reverses=layer,
+            date=layer.date,
+            quantity=-layer.quantity,
+            unit_cost=layer.unit_cost,
+            value=-layer.value,
+        )
+        if layer.is_incoming:
+            layer.remaining_qty = DECIMAL_ZERO
+            layer.remaining_value = DECIMAL_ZERO
+        else:
+            reversal.remaining_qty = reversal.quantity
+            reversal.remaining_value = reversal.value
+        reversals.append(reversal)
+
+    StockValuationLayer.objects.bulk_create(reversals, batch_size=500)
+    StockValuationLayer.objects.bulk_update(
+        [layer for layer in originals if layer.is_incoming], ["remaining_qty", "remaining_value"], batch_size=500
+    )
+
+    _refresh_average_costs(products, _product_totals(product_ids))
+    return reversals
+
+
+# ============================================================
+# Rebuilding open layers
+# ============================================================
+
+@transaction.atomic
+def rebuild_open_layers(product_ids=None) -> int:
+    """
+    Recompute remaining_qty / remaining_value of every layer from the layer
+    sums: the product's quantity is spread over its newest incoming layers
+    (older ones count as consumed, as FIFO would have done) and valued at
+    the average cost.
+
+    Run when costing_method changes (InventorySettingsView), so FIFO starts
+    from open layers that match the stock on hand, whatever happened before.
+    Returns the number of layers rewritten.
+    """
+    layers = StockValuationLayer.objects.all()
+    if product_ids is not None:
+        layers = layers.filter(product_id__in=product_ids)
+    product_ids = set(layers.values_list("product_id", flat=True).distinct())
+    if not product_ids:
+        return 0
+
+    _lock_products(product_ids)
+    totals = _product_totals(product_ids)
+
+    changed: dict[int, StockValuationLayer] = {}
+    open_layers: dict[int, list[StockValuationLayer]] = defaultdict(list)  # newest first
+    left = {product_id: max(qty, DECIMAL_ZERO) for product_id, (qty, _total_value) in totals.items()}
+
+    candidates = (
+        layers.select_for_update()
+        .filter(quantity__gt=0, reversals__isnull=True)  # reversed receipts stay closed
+        .order_by("product_id", "-date", "-id")
+    )
+    for layer in candidates.iterator(chunk_size=2000):
+        take = min(layer.quantity, left[layer.product_id])
+        left[layer.product_id] -= take
+        if take:
+            layer.remaining_qty = take
+            open_layers[layer.product_id].append(layer)
+        elif layer.remaining_qty or layer.remaining_value:
+            layer.remaining_qty = DECIMAL_ZERO
+            layer.remaining_value = DECIMAL_ZERO
+            changed[layer.pk] = layer
+
+    for product_id, product_layers in open_layers.items():
+        _revalue_open_layers(product_layers[::-1], totals[product_id], changed)
+
+    # closed layers that still carry a value (none of the above touched them)
+    stale = (
+        layers.filter(Q(quantity__lte=0) | Q(reversals__isnull=False))
+        .exclude(remaining_qty=0, remaining_value=0)
+    )
+    reset = stale.update(remaining_qty=DECIMAL_ZERO, remaining_value=DECIMAL_ZERO)
+
+    StockValuationLayer.objects.bulk_update(list(changed.values()), ["remaining_qty", "remaining_value"], batch_size=500)
+    return len(changed) + reset
+
+
+# ============================================================
+# Reporting (indexed sums over layers)
+# ============================================================
+
+def stock_valuation(as_of: datetime | None = None, *, product_ids=None):
+    """
+    Quantity and value per product at `as_of` (default: now):
+    rows of {product_id, qty, value} from one GROUP BY.
+
+    Stock held before the layers existed is one opening layer per product
+    dated when migration 0008 ran, so values as of earlier dates are zero;
+    use stock_ledger.stock_report_as_of() for those (falls back to
+    Product.average_cost).
+    """
+    qs = StockValuationLayer.objects.as_of(as_of)
+    if product_ids is not None:
+        qs = qs.filter(product_id__in=product_ids)
+    return qs.totals_by_product().exclude(qty=0, value=0)
+
+
+def stock_value(as_of: datetime | None = None, **filters) -> Decimal:
+    """
+    Total inventory value at `as_of` (filters apply to the layers).
+    Zero before the opening layers' date, see stock_valuation().
+    """
+    total = StockValuationLayer.objects.as_of(as_of).filter(**filters).aggregate(t=Sum("value"))["t"]
+    return total or DECIMAL_ZERO
+
+
+def cost_of_goods_sold(date_from: datetime | None = None, date_to: datetime | None = None, **filters) -> Decimal:
+    """
+    Cost of everything that left stock in the period: outgoing layers,
+    minus the reversals of outgoing layers (cancelled deliveries).
+    Includes inventory adjustment losses, which are OUT moves too.
+    """
+    total = (
+        StockValuationLayer.objects.within(date_from, date_to)
+        .filter(Q(quantity__lt=0, reverses__isnull=True) | Q(reverses__quantity__lt=0))
+        .filter(**filters)
+        .aggregate(t=Sum("value"))["t"]
+    )
+    return -(total or DECIMAL_ZERO)
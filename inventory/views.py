@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import json
 from typing import Optional
 
 from django.contrib import messages
@@ -11,7 +12,7 @@ from django.core.exceptions import ValidationError
 from django.db import transaction
 from django.db.models import DecimalField, F, Prefetch, Q, Sum
 from django.db.models.deletion import ProtectedError
-from django.http import HttpResponse
+from django.http import HttpResponseBadRequest, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
@@ -24,12 +25,14 @@ from tablib import Dataset
 # Core (Audit)
 from core.models import AuditLog
 from core.services.audit import log_event
+from core.services.exports import export_response, queryset_rows
 
 # Forms
 from .forms import (
     DeliveryMoveForm,
     InventoryAdjustmentLineFormSet,
     InventoryAdjustmentStartForm,
+    InventoryCountImportForm,
     ProductCategoryForm,
     ProductForm,
     ReceiptMoveForm,
@@ -44,6 +47,7 @@ from .forms import (
 from .models import (
     DECIMAL_ZERO,
     InventoryAdjustment,
+    InventoryAdjustmentLine,
     InventorySettings,
     Product,
     ProductCategory,
@@ -66,9 +70,21 @@ from .services import (
     create_inventory_session,
 )
 
+# Counting (CSV / scanner batches)
+from .counting import (
+    COUNT_MODE_ADD,
+    MAX_SCAN_BATCH,
+    parse_count_csv,
+    parse_scan_batch,
+    record_counts,
+)
+
 # Utils
 from .utils import render_pdf_view
 
+# Valuation (stock valuation layers)
+from .valuation import rebuild_open_layers, stock_value
+
 
 # ============================================================
 # Configuration
@@ -179,10 +195,7 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         context["total_products"] = Product.objects.active().count()
         context["total_warehouses"] = Warehouse.objects.active().count()
 
-        try:
-            context["low_stock_count"] = len(ReorderRule.objects.get_triggered_rules())
-        except Exception:
-            context["low_stock_count"] = ReorderRule.objects.active().count()
+        context["low_stock_count"] = ReorderRule.objects.triggered().count()
 
         context["draft_moves_count"] = StockMove.objects.draft().count()
 
@@ -407,20 +420,52 @@ class InventoryAdjustmentCreateView(LoginRequiredMixin, CreateView):
 class InventoryAdjustmentUpdateView(LoginRequiredMixin, UpdateView):
     """
     Screen to enter counted quantities (via inline formset).
+
+    Lines are shown COUNT_PAGE_SIZE at a time with a keyset cursor on the
+    line id (?after=<id>), so a count of thousands of lines stays a small
+    page; only the changed lines of the page are written (one bulk_update).
+    Large counts can also be loaded from CSV or a scanner (see counting).
     """
     model = InventoryAdjustment
     template_name = "inventory/adjustments/count.html"
     fields = ["note"]
 
+    COUNT_PAGE_SIZE = 100
+
+    def _after(self) -> int:
+        try:
+            return max(int(self.request.POST.get("after") or self.request.GET.get("after") or 0), 0)
+        except ValueError:
+            return 0
+
+    def _page(self):
+        """(line queryset of the page, id of its last line when there is a next page)."""
+        after = self._after()
+        lines = self.object.lines.all()
+        ids = list(lines.filter(id__gt=after).order_by("id").values_list("id", flat=True)[: self.COUNT_PAGE_SIZE + 1])
+        next_after = ids[self.COUNT_PAGE_SIZE - 1] if len(ids) > self.COUNT_PAGE_SIZE else None
+        page = (
+            lines.filter(id__in=ids[: self.COUNT_PAGE_SIZE])
+            .select_related("product", "product__base_uom", "location")
+            .order_by("id")
+        )
+        return page, next_after
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["active_section"] = "inventory_operations"
 
+        page, next_after = self._page()
         if self.request.POST:
-            context["lines_formset"] = InventoryAdjustmentLineFormSet(self.request.POST, instance=self.object)
+            context["lines_formset"] = InventoryAdjustmentLineFormSet(
+                self.request.POST, instance=self.object, queryset=page
+            )
         else:
-            context["lines_formset"] = InventoryAdjustmentLineFormSet(instance=self.object)
+            context["lines_formset"] = InventoryAdjustmentLineFormSet(instance=self.object, queryset=page)
 
+        context["after"] = self._after()
+        context["next_after"] = next_after
+        context["import_form"] = InventoryCountImportForm()
         return context
 
     def form_valid(self, form):
@@ -440,7 +485,17 @@ class InventoryAdjustmentUpdateView(LoginRequiredMixin, UpdateView):
                     self.object.status = InventoryAdjustment.Status.IN_PROGRESS
 
                 self.object.save(update_fields=["note", "status", "updated_by"])
-                lines_formset.save()
+
+                # Only the lines edited on this page, in one UPDATE
+                now = timezone.now()
+                changed = []
+                for line_form in lines_formset.forms:
+                    if line_form.has_changed():
+                        line = line_form.save(commit=False)
+                        line.updated_by = self.request.user
+                        line.updated_at = now
+                        changed.append(line)
+                InventoryAdjustmentLine.objects.bulk_update(changed, ["counted_qty", "updated_by", "updated_at"])
 
                 # Audit: counts entry (apply handled by service)
                 log_event(
@@ -448,10 +503,13 @@ class InventoryAdjustmentUpdateView(LoginRequiredMixin, UpdateView):
                     message=_("Inventory counts updated."),
                     actor=self.request.user,
                     target=self.object,
-                    extra={"status": str(self.object.status)},
+                    extra={"status": str(self.object.status), "lines": len(changed)},
                 )
 
             messages.success(self.request, _("تم حفظ الكميات المجرودة."))
+            if context["next_after"] is not None:
+                url = reverse("inventory:adjustment_count", kwargs={"pk": self.object.pk})
+                return redirect(f"{url}?after={context['next_after']}")
             return redirect("inventory:adjustment_detail", pk=self.object.pk)
 
         except Exception as e:
@@ -459,6 +517,94 @@ class InventoryAdjustmentUpdateView(LoginRequiredMixin, UpdateView):
             return self.render_to_response(self.get_context_data(form=form))
 
 
+@require_POST
+@login_required
+def adjustment_count_import_view(request, pk: int):
+    """
+    Counted quantities from a CSV (barcode|code, location, qty), streamed
+    and written with bulk updates.
+    """
+    adjustment = get_object_or_404(InventoryAdjustment, pk=pk)
+    form = InventoryCountImportForm(request.POST, request.FILES)
+    if not form.is_valid():
+        messages.error(request, _("الرجاء اختيار ملف CSV صالح."))
+        return redirect("inventory:adjustment_count", pk=pk)
+
+    try:
+        result = record_counts(
+            adjustment,
+            parse_count_csv(form.cleaned_data["file"]),
+            mode=form.cleaned_data["mode"],
+            user=request.user,
+        )
+    except ValidationError as e:
+        messages.error(request, " ".join(e.messages))
+        return redirect("inventory:adjustment_count", pk=pk)
+    except UnicodeDecodeError:
+        messages.error(request, _("ترميز الملف غير مدعوم، يرجى حفظه بصيغة CSV UTF-8."))
+        return redirect("inventory:adjustment_count", pk=pk)
+
+    messages.success(
+        request,
+        _("تم تحديث %(updated)s بنداً وإضافة %(created)s بنداً جديداً.") % {
+            "updated": result.updated,
+            "created": result.created,
+        },
+    )
+    for row_no, error in result.errors[:10]:
+        messages.warning(request, f"{_('سطر')} {row_no}: {error}")
+    if len(result.errors) > 10:
+        messages.warning(request, _("و %(count)s خطأ آخر.") % {"count": len(result.errors) - 10})
+    return redirect("inventory:adjustment_count", pk=pk)
+
+
+@require_POST
+@login_required
+def adjustment_count_scan_view(request, pk: int):
+    """
+    Barcode scanner batches (AJAX).
+    Data (JSON):
+      {
+        "mode": "add",            # add (default) or set
+        "items": [{"code": "6291234567890", "location": "A-01", "qty": 1}, ...]
+      }
+    """
+    try:
+        data = json.loads(request.body or "{}")
+    except json.JSONDecodeError:
+        return HttpResponseBadRequest("Invalid JSON")
+
+    items = data.get("items")
+    if not isinstance(items, list) or not items:
+        return JsonResponse({"status": "error", "message": _("لا توجد بيانات مسح.")}, status=400)
+    if len(items) > MAX_SCAN_BATCH:
+        return JsonResponse(
+            {"status": "error", "message": _("الدفعة كبيرة جداً (الحد %(max)s).") % {"max": MAX_SCAN_BATCH}},
+            status=400,
+        )
+
+    adjustment = get_object_or_404(InventoryAdjustment, pk=pk)
+    try:
+        result = record_counts(
+            adjustment,
+            parse_scan_batch(items),
+            mode=data.get("mode") or COUNT_MODE_ADD,
+            user=request.user,
+        )
+    except ValidationError as e:
+        return JsonResponse({"status": "error", "message": " ".join(e.messages)}, status=400)
+
+    return JsonResponse(
+        {
+            "status": "success",
+            "rows": result.rows,
+            "updated": result.updated,
+            "created": result.created,
+            "errors": [{"row": row_no, "message": message} for row_no, message in result.errors],
+        }
+    )
+
+
 class InventoryAdjustmentDetailView(LoginRequiredMixin, DetailView):
     model = InventoryAdjustment
     template_name = "inventory/adjustments/detail.html"
@@ -571,6 +717,13 @@ class InventoryValuationView(LoginRequiredMixin, ListView):
 
         context["total_qty"] = aggregates["total_qty"] or DECIMAL_ZERO
         context["total_value"] = aggregates["total_value"] or DECIMAL_ZERO
+
+        # Company-wide value comes from the valuation layers (one indexed SUM);
+        # layers are per product, so a warehouse filter keeps qty x average.
+        if not self.request.GET.get("warehouse"):
+            cat_id = self.request.GET.get("category")
+            filters = {"product__category_id": cat_id} if cat_id else {}
+            context["total_value"] = stock_value(**filters)
         return context
 
 
@@ -585,7 +738,7 @@ class ReorderRuleListView(LoginRequiredMixin, ListView):
     paginate_by = 50
 
     def get_queryset(self):
-        return ReorderRule.objects.with_related().active().order_by("warehouse", "product")
+        return ReorderRule.objects.with_related().active().with_stock().order_by("warehouse", "product")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -938,6 +1091,7 @@ class InventorySettingsView(LoginRequiredMixin, UpdateView):
     template_name = "inventory/settings/settings.html"
     fields = [
         "allow_negative_stock",
+        "costing_method",
         "stock_move_in_prefix",
         "stock_move_out_prefix",
         "stock_move_transfer_prefix",
@@ -948,7 +1102,11 @@ class InventorySettingsView(LoginRequiredMixin, UpdateView):
         return InventorySettings.get_solo()
 
     def form_valid(self, form):
-        response = super().form_valid(form)
+        with transaction.atomic():
+            response = super().form_valid(form)
+            if "costing_method" in form.changed_data:
+                # FIFO must start from open layers that match the stock on hand
+                rebuild_open_layers()
         messages.success(self.request, _("تم حفظ الإعدادات."))
         return response
 
@@ -962,17 +1120,32 @@ class InventorySettingsView(LoginRequiredMixin, UpdateView):
 # Import/Export Products
 # ============================================================
 
+# أعمدة ProductResource → حقول values_list (العلاقات تُصدَّر بالاسم كما في الاستيراد)
+PRODUCT_EXPORT_LOOKUPS = {
+    "category": "category__name",
+    "base_uom": "base_uom__name",
+}
+
+
 @login_required
 def export_products_view(request):
-    product_resource = ProductResource()
-    dataset = product_resource.export()
-    response = HttpResponse(
-        dataset.xlsx,
-        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    """
+    Export products with the same columns ProductResource imports,
+    streamed from values_list().iterator() (CSV with ?format=csv).
+    """
+    headers = list(ProductResource.Meta.fields)
+    rows = queryset_rows(
+        Product.objects.order_by("code"),
+        [PRODUCT_EXPORT_LOOKUPS.get(name, name) for name in headers],
     )
     timestamp = timezone.now().strftime("%Y-%m-%d")
-    response["Content-Disposition"] = f'attachment; filename="products_export_{timestamp}.xlsx"'
-    return response
+    return export_response(
+        request.GET.get("format"),
+        f"products_export_{timestamp}",
+        headers,
+        rows,
+        sheet_title="Products",
+    )
 
 
 @login_required
@@ -97,6 +97,23 @@ DATABASES = {
     }
 }
 
+# ---------------------------------
+#   Cache
+# ---------------------------------
+# لازم يكون cache مشترك بين كل عمّال gunicorn: نسخ الإعدادات، فهرس السنوات
+# المالية وتقارير المحاسبة المخزنة تعتمد على مفاتيح version فيه.
+# LocMemCache (الافتراضي) خاص بكل process فلا يصلح هنا.
+# الجدول يُنشأ مع migrate (core/migrations/0002_create_cache_table).
+# ملاحظة: كل get_solo() يقرأ مفتاح الـ version من هذا الجدول (استعلام واحد بسيط)؛
+# التوفير مقارنة بدون cache هو الـ JOINs فقط، وليس الاستعلام نفسه.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "django_cache",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+}
+
 LANGUAGE_CODE = "ar"
 
 LANGUAGES = [